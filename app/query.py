@@ -1,5 +1,5 @@
 from flask import (
-    Blueprint, g, request
+    Blueprint, g, request, Response
 )
 import os
 from flask.json import jsonify
@@ -7,7 +7,9 @@ import traceback
 import json
 import logging
 
-from awudima import AwudimaFQP, Federation
+from awudima import AwudimaFQP, Federation, FederationCache, WorkerPool
+from awudima.mediator import writers
+from awudima.mediator.cache import ResultCache, PlanCache, BindJoinCache
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -25,6 +27,59 @@ if 'CONFIG_FILE' in os.environ:
 else:
     configfile = '/data/federation.json'
 
+# Parsed federation, reloaded only when the config file changes
+federation_cache = FederationCache(configfile)
+
+# Worker pool shared by all the queries of the endpoint. Settings (environment variables):
+#   POOL_SIZE: total number of worker processes of the running queries
+#   QUERY_WORKERS: number of worker processes of a query (per-query parallelism)
+#   MAX_WAITING_QUERIES: queries waiting for admission, further queries are rejected (503)
+#   ADMISSION_TIMEOUT: seconds a query waits for admission before it is rejected (503)
+#   QUERY_TIMEOUT: seconds a query may run before it is cancelled
+#   EXECUTION_ENGINE: 'processes' or 'threads'
+#   QUERY_MEMORY_BUDGET: bytes of main memory for the hash tables of a query, beyond which they are spilled to disk.
+#                        If not set, the memory budget of the federation (if any) is used.
+#   BINDJOIN_CACHE_SIZE: right tuples of the dependent joins of a query that are cached, i.e., fetched only once
+#   BINDJOIN_CACHE_SHARED: if 'true', the bind join cache is shared by all the queries of the endpoint
+#   BINDJOIN_CACHE_TTL: seconds the entries of the shared bind join cache are valid
+bindjoin_cache = int(os.environ['BINDJOIN_CACHE_SIZE']) if 'BINDJOIN_CACHE_SIZE' in os.environ else None
+if bindjoin_cache is not None and os.environ.get('BINDJOIN_CACHE_SHARED', 'false').lower() in ['true', '1', 'yes']:
+    bindjoin_cache = BindJoinCache(bindjoin_cache,
+                                   ttl=float(os.environ['BINDJOIN_CACHE_TTL']) if 'BINDJOIN_CACHE_TTL' in os.environ else None)
+pool = WorkerPool(size=int(os.environ['POOL_SIZE']) if 'POOL_SIZE' in os.environ else None,
+                  max_workers=int(os.environ.get('QUERY_WORKERS', 8)),
+                  max_waiting=int(os.environ.get('MAX_WAITING_QUERIES', 100)),
+                  engine=os.environ.get('EXECUTION_ENGINE', 'processes'),
+                  timeout=float(os.environ['QUERY_TIMEOUT']) if 'QUERY_TIMEOUT' in os.environ else None,
+                  memory_budget=int(os.environ['QUERY_MEMORY_BUDGET']) if 'QUERY_MEMORY_BUDGET' in os.environ else None,
+                  bindjoin_cache=bindjoin_cache)
+admission_timeout = float(os.environ.get('ADMISSION_TIMEOUT', 60))
+
+# Results of repeated queries are served from a cache if RESULT_CACHE_TTL (seconds) is set. Settings:
+#   RESULT_CACHE_ENTRIES: maximum number of cached results in memory
+#   RESULT_CACHE_ROWS: maximum number of cached rows in memory (larger results are not cached)
+#   RESULT_CACHE_DIR: directory to spill cached results evicted from memory to
+result_cache = None
+if 'RESULT_CACHE_TTL' in os.environ:
+    result_cache = ResultCache(ttl=float(os.environ['RESULT_CACHE_TTL']),
+                               max_entries=int(os.environ.get('RESULT_CACHE_ENTRIES', 128)),
+                               max_rows=int(os.environ.get('RESULT_CACHE_ROWS', 1000000)),
+                               spill_dir=os.environ.get('RESULT_CACHE_DIR', None))
+
+# Decompositions of the query templates (queries that only differ in constants) are cached, unless PLAN_CACHE_SIZE is 0
+plan_cache_size = int(os.environ.get('PLAN_CACHE_SIZE', 256))
+plan_cache = PlanCache(max_entries=plan_cache_size) if plan_cache_size > 0 else None
+
+# Stream results (chunked transfer) by default, otherwise only when the request asks for it (stream=true)
+stream_results = os.environ.get('STREAM_RESULTS', 'false').lower() in ['true', '1', 'yes']
+
+# Result formats of /sparql, negotiated with the Accept header or given as format parameter. Other than JSON are streamed.
+result_formats = {'json': writers.MIME_JSON,
+                  'tsv': writers.MIME_TSV,
+                  'csv': writers.MIME_CSV}
+if writers.arrow_available():
+    result_formats['arrow'] = writers.MIME_ARROW
+
 
 @bp.route("/sparql", methods=['POST', 'GET'])
 def sparql():
@@ -43,9 +98,29 @@ def sparql():
                     "error": "No SPARQL query found"})
 
             g.collection = request.args.get("collection", None) if request.method == 'GET' else request.values.get("collection", None)
-            if os.path.exists(configfile):
-                federation = Federation.config(configfile)
-            else:
+            stream = request.args.get("stream", None) if request.method == 'GET' else request.values.get("stream", None)
+            stream = stream_results if stream is None else stream.lower() in ['true', '1', 'yes']
+            result_format = request.args.get("format", None) if request.method == 'GET' else request.values.get("format", None)
+            if result_format is None:
+                mimetype = request.accept_mimetypes.best_match([writers.MIME_JSON, 'application/json'] +
+                                                               list(result_formats.values()), default=writers.MIME_JSON)
+                result_format = 'json' if mimetype == 'application/json' else \
+                    [f for f in result_formats if result_formats[f] == mimetype][0]
+            elif result_format not in result_formats:
+                return jsonify({"head": {
+                                    "vars": []
+                                },
+                                "results": {
+                                    "bindings": []
+                                },
+                                "message": "Error in executing the query!",
+                                "query": query,
+                                "error": "Unsupported result format: " + result_format +
+                                         ". Supported formats: " + ", ".join(result_formats)}), 406
+            if result_format != 'json':
+                stream = True
+            federation = federation_cache.get()
+            if federation is None:
                 return jsonify({"head": {
                                     "vars": []
                                 },
@@ -55,9 +130,30 @@ def sparql():
                                 "message": "Error in executing the query!",
                                 "query": query,
                                 "error": "Federation setting is not found as '/data/federation.json'"})
-            fqp = AwudimaFQP(federation)
-            resultset = fqp.execute(query, keep_in_memory=True)
-            if resultset:
+            fqp = AwudimaFQP(federation, result_cache, plan_cache)
+            # cached results are bypassed with cache=false, or with the Cache-Control: no-cache header
+            use_cache = request.args.get("cache", None) if request.method == 'GET' else request.values.get("cache", None)
+            use_cache = (use_cache is None or use_cache.lower() not in ['false', '0', 'no']) and \
+                'no-cache' not in request.headers.get('Cache-Control', '')
+            resultset = fqp.get_cached(query) if use_cache else None
+            if resultset is None:
+                context = pool.admit(wait_timeout=admission_timeout)
+                if context is None:
+                    return jsonify({"head": {
+                                        "vars": []
+                                    },
+                                    "results": {
+                                        "bindings": []
+                                    },
+                                    "message": "The server is busy, please try again later!",
+                                    "query": query,
+                                    "error": "Too many queries are running. " + str(pool.stats())}), 503
+                resultset = fqp.execute(query, keep_in_memory=not stream, context=context, use_cache=False)
+            if resultset and stream:
+                # bindings are sent as they arrive, without materializing the results
+                writer = getattr(resultset, 'stream_' + result_format)
+                return Response(writer(), mimetype=result_formats[result_format])
+            elif resultset:
                 return jsonify(resultset.results)
             else:
                 return jsonify({"head": {
@@ -112,7 +208,7 @@ def configure():
             if not federation.rdfmts:
                 logger.info("No molecules in config, extracting them now!")
                 federation.extract_molecules()
-            federation.dump_to_json(configfile)
+            federation_cache.set(federation)
             return jsonify({'status': True, 'federation': federation.to_json()})
         except Exception as e:
             import sys
@@ -135,7 +231,7 @@ def inspect():
         if not os.path.exists(configfile):
             return jsonify({'federation': None})
         try:
-            federation = Federation.load_from_json(configfile)
+            federation = federation_cache.get()
             return jsonify({'federation': federation.to_json()})
         except Exception as e:
             import sys
@@ -1,3 +1,3 @@
-from awudima.mediator import AwudimaDecomposer, AwudimaPlanner, AwudimaFQP
-from awudima.pyrdfmt import Federation, DataSource, RDFMT, MTPredicate
+from awudima.mediator import AwudimaDecomposer, AwudimaPlanner, AwudimaFQP, WorkerPool
+from awudima.pyrdfmt import Federation, FederationCache, DataSource, RDFMT, MTPredicate
 from awudima.pyrml import DataSourceType
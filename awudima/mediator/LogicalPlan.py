@@ -231,6 +231,10 @@ class Leaf(Tree):
 
         translator = MongoLDFlatTranslator(self.service, SPARQL.getPrefs(query.prefs), config)
         mongo_query, variables, constants, res_temp = translator.translate()
+        # distinct pushed down to the source: documents with the same projected fields are grouped
+        if query.distinct and mongo_query is not None and isinstance(mongo_query.get('pipeline'), list):
+            mongo_query['pipeline'] = mongo_query['pipeline'] + [{'$group': {'_id': '$$ROOT'}},
+                                                                 {'$replaceRoot': {'newRoot': '$_id'}}]
         # print("********************************************************")
         # from pprint import pprint
         # pprint(mongo_query)
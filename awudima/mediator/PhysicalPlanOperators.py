@@ -3,6 +3,7 @@ __author__ = 'Kemele M. Endris'
 
 from multiprocessing import Process, Queue
 from awudima.pyrml import DataSourceType
+from awudima.mediator.engine import get_engine
 
 from awudima.wrappers import RDFStore
 from awudima.wrappers import MySQLWrapper
@@ -17,6 +18,10 @@ from awudima.wrappers import MongoDBWrapper
 
 from typing import Set
 
+# Maximum number of instantiated requests of a dependent operator that are sent to a data source at a time,
+# unless the data source sets its own (the 'max_in_flight' parameter of the data source).
+MAX_IN_FLIGHT = 4
+
 
 class NodeOperator(object):
     '''
@@ -27,7 +32,7 @@ class NodeOperator(object):
         The operator node is a physical operator, provided by the engine.
 
         The execute() method evaluates the plan.
-        It creates a process for every node of the plan.
+        It starts a process (or a thread, depending on the execution engine) for every node of the plan.
         The left node is always evaluated.
         If the right node is an independent operator or a subtree, it is evaluated.
         '''
@@ -60,6 +65,7 @@ class NodeOperator(object):
         if self.left_ds_type is not None and self.right_ds_type is not None:
             if self.left_ds_type == self.right_ds_type:
                 self.dstype = self.left_ds_type
+        self.engine = get_engine()
 
     def __repr__(self):
         return self.aux(" ")
@@ -73,7 +79,9 @@ class NodeOperator(object):
             r = self.right.instantiate(d)
         newvars = self.vars - set(d.keys())
 
-        return NodeOperator(self.operator.instantiate(d), newvars, l, r)
+        n = NodeOperator(self.operator.instantiate(d), newvars, self.config, l, r, self.consts, self.query)
+        n.engine = self.engine
+        return n
 
     def instantiateFilter(self, d, filter_str):
         l = None
@@ -83,7 +91,9 @@ class NodeOperator(object):
         if self.right:
             r = self.right.instantiateFilter(d, filter_str)
         newvars = self.vars - set(d)
-        return NodeOperator(self.operator.instantiateFilter(d, filter_str), newvars, l, r)
+        n = NodeOperator(self.operator.instantiateFilter(d, filter_str), newvars, self.config, l, r, self.consts, self.query)
+        n.engine = self.engine
+        return n
 
     def allTriplesLowSelectivity(self):
         a = True
@@ -185,23 +195,92 @@ class NodeOperator(object):
             p.join()
 
     def execute(self, outq, processq=Queue()):
+        if self.is_union():
+            self.executeUnion(outq)
+            return
         if self.left:
-            qleft = Queue()
-            qright = Queue()
+            engine = self.engine
+            qleft = engine.queue()
+            qright = engine.queue()
+            # Child nodes only start their workers and return: they are executed in the calling process,
+            # so that every worker of the plan is started (and tracked) by the same execution engine.
             # print('Left:', self.left.__class__.__name__)
             # if isinstance(self.left, NodeOperator):
             #     print('left_op:', self.left.operator)
-            p1 = Process(target=self.left.execute, args=(qleft, ))
-            p1.start()
+            self.left.engine = engine
+            self.left.execute(qleft)
+
+            if self.right:
+                self.right.engine = engine
+
+            # Hash tables of the operator are accounted in the memory budget of the query, if any.
+            if getattr(engine, 'memory', None) is not None:
+                self.operator.memory = engine.memory
+            # Operators stop (or signal to stop) when no more results are needed.
+            if getattr(engine, 'stopped', None) is not None:
+                self.operator.stopped = engine.stopped
+            # Files in secondary memory (e.g., flushed partitions) are created in the temporary directory of the query.
+            if getattr(engine, 'tmpdir', None) is not None:
+                self.operator.tmpdir = engine.tmpdir
+
+            # Dependent operators instantiate and execute the right node themselves.
+            if self.is_dependent():
+                # Right tuples fetched for the join keys are cached in the bind join cache of the query, if any.
+                if getattr(engine, 'bindjoin_cache', None) is not None:
+                    self.operator.cache = engine.bindjoin_cache
+                if engine.start(self.operator.execute, (qleft, self.right, outq,)) is None:
+                    # The query is cancelled: the operator is not started.
+                    outq.put("EOF")
+                return
 
             if self.right:
                 # print('right:', self.left.__class__.__name__)
-                p2 = Process(target=self.right.execute, args=(qright,))
-                p2.start()
+                self.right.execute(qright)
 
             # print('op:', self.operator.__class__.__name__)
-            p3 = Process(target=self.operator.execute, args=(qleft, qright, outq,))
-            p3.start()
+            if engine.start(self.operator.execute, (qleft, qright, outq,)) is None:
+                # The query is cancelled: the operator is not started.
+                outq.put("EOF")
+
+    def executeUnion(self, outq):
+        # A tree of unions is executed by a single union operator over the inputs of the tree.
+        engine = self.engine
+        inputs = self.union_inputs()
+        queues = []
+        for node in inputs:
+            q = engine.queue()
+            node.engine = engine
+            node.execute(q)
+            queues.append(q)
+
+        if getattr(engine, 'memory', None) is not None:
+            self.operator.memory = engine.memory
+        if getattr(engine, 'stopped', None) is not None:
+            self.operator.stopped = engine.stopped
+        if engine.start(self.operator.executeInputs, (queues, [node.vars for node in inputs], outq,)) is None:
+            # The query is cancelled: the operator is not started.
+            outq.put("EOF")
+
+    def union_inputs(self):
+        # Children of the tree of unions rooted at this node that are not unions (with the same operator settings).
+        inputs = []
+        for node in [self.left, self.right]:
+            if node is None:
+                continue
+            if isinstance(node, NodeOperator) and node.is_union() and node.operator.distinct == self.operator.distinct:
+                inputs.extend(node.union_inputs())
+            else:
+                inputs.append(node)
+        return inputs
+
+    def is_union(self):
+        from awudima.operators.nonblocking.Xunion import Xunion
+        return isinstance(self.operator, Xunion)
+
+    def is_dependent(self):
+        from awudima.operators.nonblocking.NestedHashJoinFilter import NestedHashJoinFilter
+        from awudima.operators.nonblocking.NestedHashOptionalFilter import NestedHashOptionalFilter
+        return isinstance(self.operator, NestedHashJoinFilter) or isinstance(self.operator, NestedHashOptionalFilter)
 
 
 class LeafOperator(object):
@@ -233,17 +312,28 @@ class LeafOperator(object):
         self.config = config
         self.cardinality = None
         self.joinCardinality = []
+        self.engine = get_engine()
+        # params of the data source may be null, or a string (e.g., 'username:...;password:...')
+        params = getattr(self.datasource, 'params', None)
+        self.max_in_flight = int(params.get('max_in_flight', MAX_IN_FLIGHT)) if isinstance(params, dict) else MAX_IN_FLIGHT
+        # LIMIT and OFFSET of the query evaluated by the source (set by the planner), -1 for none.
+        self.max_results = -1
+        self.offset = -1
 
     def __repr__(self):
         return str(self.tree)
 
     def instantiate(self, d):
         new_tree = self.tree.instantiate(d)
-        return LeafOperator(self.query, new_tree, self.config)
+        leaf = LeafOperator(self.query, new_tree, self.config)
+        leaf.engine = self.engine
+        return leaf
 
     def instantiateFilter(self, vars_instantiated, filter_str):
         new_tree = self.tree.instantiateFilter(vars_instantiated, filter_str)
-        return LeafOperator(self.query, new_tree, self.config)
+        leaf = LeafOperator(self.query, new_tree, self.config)
+        leaf.engine = self.engine
+        return leaf
 
     def getCardinality(self):
         if self.cardinality is None:
@@ -302,8 +392,14 @@ class LeafOperator(object):
 
         # Evaluate the independent operator.
         # q = Queue()
-        pf = Process(target=self.get_wrapper_fun(self.datasource).executeQuery, args=(self.query_str, outputqueue, self.result_template, self.tree.service.limit, -1,))
-        pf.start()
+        wrapper = self.get_wrapper_fun(self.datasource)
+        # The wrapper stops fetching pages when no more results are needed.
+        wrapper.stopped = getattr(self.engine, 'stopped', None)
+        worker = self.engine.start(wrapper.executeQuery, (self.query_str, outputqueue, self.result_template,
+                                                          self.tree.service.limit, self.offset, self.max_results,))
+        if worker is None:
+            # The query is cancelled: the wrapper is not started, its operator must not wait for its results.
+            outputqueue.put("EOF")
         # processqueue.put(p.pid)
         # r = q.get(True)
         # while r != 'EOF':
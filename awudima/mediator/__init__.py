@@ -1,3 +1,4 @@
 from awudima.mediator.decomposer.QueryDecomposer import AwudimaDecomposer
 from awudima.mediator.planner.QueryPlanner import AwudimaPlanner
 from awudima.mediator.executor import AwudimaFQP
+from awudima.mediator.engine import WorkerPool
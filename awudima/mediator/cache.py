@@ -0,0 +1,491 @@
+__author__ = 'Kemele M. Endris'
+
+import io
+import os
+import re
+import copy
+import pickle
+import hashlib
+from time import time
+from collections import OrderedDict
+from threading import Lock
+
+
+def normalize_query(sparql_query):
+    """
+    Normalized form of a SPARQL query, i.e., the serialization of its parsed Query,
+    so that queries that only differ in formatting share the same form.
+
+    :param sparql_query: SPARQL query string
+    :return: normalized query string
+    """
+    try:
+        from awudima.pysparql import queryParser
+        query = queryParser.parse(sparql_query)
+    except Exception as e:
+        query = None
+    if query is None:
+        return re.sub(r'\s+', ' ', sparql_query).strip()
+
+    return _serialize(query)
+
+
+def _serialize(query):
+    # modifiers are not part of the serialization of the query
+    return str(query) + '\nORDER BY ' + str(query.order_by) + '\nLIMIT ' + str(query.limit) + \
+        '\nOFFSET ' + str(query.offset)
+
+
+class ResultCache(object):
+    """
+    Cache of query results, keyed by the normalized query and the fingerprint of the federation.
+
+    Entries expire ttl seconds after they are cached. The least recently used entries are evicted when there are more
+    than max_entries entries, or more than max_rows rows, in memory. If spill_dir is given, evicted entries are
+    written to that directory (up to max_spilled entries) and read back when they are requested again.
+
+    :param ttl: time to live (in seconds) of the entries
+    :param max_entries: maximum number of entries in memory
+    :param max_rows: maximum number of rows in memory. Results with more rows are not cached.
+    :param spill_dir: directory to spill evicted entries to, None to drop them
+    :param max_spilled: maximum number of entries spilled to disk
+    """
+    def __init__(self, ttl=60, max_entries=128, max_rows=1000000, spill_dir=None, max_spilled=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.spill_dir = spill_dir
+        self.max_spilled = max_spilled
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+
+        # key -> (expires, vars, rows)
+        self.entries = OrderedDict()
+        self.rows = 0
+        # key -> expires, of the entries spilled to disk
+        self.spilled = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    @staticmethod
+    def key(sparql_query, federation):
+        """
+        :param sparql_query: SPARQL query string
+        :param federation: Federation the query is executed over
+        :return: cache key of the results of the query
+        """
+        return hashlib.sha1((federation.fingerprint + '\n' + normalize_query(sparql_query)).encode()).hexdigest()
+
+    def get(self, key):
+        """
+        :return: (vars, rows) cached for the given key, None if there are not (or they are expired)
+        """
+        now = time()
+        with self.lock:
+            if key in self.entries:
+                expires, vars, rows = self.entries[key]
+                if expires > now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return vars, rows
+                self._remove(key)
+            expires = self.spilled.pop(key, None)
+
+        entry = None
+        if expires is not None:
+            entry = self._load(key)
+            if entry is not None and entry[0] <= now:
+                entry = None
+
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._insert(key, entry)
+            return entry[1], entry[2]
+
+    def put(self, key, vars, rows):
+        """
+        Caches the results (vars and rows) of a query, unless they are larger than max_rows.
+        """
+        if len(rows) > self.max_rows:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self._insert(key, (time() + self.ttl, vars, rows))
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.spilled):
+                self._unlink(key)
+            self.entries.clear()
+            self.spilled.clear()
+            self.rows = 0
+
+    def _insert(self, key, entry):
+        now = time()
+        for k in [k for k, e in self.entries.items() if e[0] <= now]:
+            self._remove(k)
+        self.entries[key] = entry
+        self.rows += len(entry[2])
+        while len(self.entries) > 1 and (len(self.entries) > self.max_entries or self.rows > self.max_rows):
+            k, e = self.entries.popitem(last=False)
+            self.rows -= len(e[2])
+            if self.spill_dir is not None:
+                self._spill(k, e)
+
+    def _remove(self, key):
+        expires, vars, rows = self.entries.pop(key)
+        self.rows -= len(rows)
+
+    def _path(self, key):
+        return os.path.join(self.spill_dir, key + '.pickle')
+
+    def _spill(self, key, entry):
+        try:
+            with open(self._path(key), 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            print("Exception while spilling cached results to disk", e)
+            return
+        self.spilled[key] = entry[0]
+        while len(self.spilled) > self.max_spilled:
+            k, expires = self.spilled.popitem(last=False)
+            self._unlink(k)
+
+    def _load(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                entry = pickle.load(f)
+        except Exception as e:
+            print("Exception while reading cached results from disk", e)
+            entry = None
+        self._unlink(key)
+        return entry
+
+    def _unlink(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries),
+                    'rows': self.rows,
+                    'spilled': len(self.spilled),
+                    'hits': self.hits,
+                    'misses': self.misses}
+
+
+class BindJoinCache(object):
+    """
+    Cache of the right tuples fetched by dependent joins (bind joins), keyed by the fingerprint of the right plan
+    and the join key, i.e., the values of the join variables the right plan was instantiated with. Join keys
+    without right tuples are cached as well. Repeated join keys are answered from the cache, without contacting
+    the source again.
+
+    A cache is created per query by its ExecutionContext, or shared by all the queries of a process (e.g., by the
+    WorkerPool of the endpoint). Worker processes of a query fill their own copy of the cache.
+    The least recently used join keys are evicted when there are more than max_tuples tuples in the cache.
+
+    :param max_tuples: maximum number of cached right tuples (a join key without right tuples counts as one)
+    :param ttl: time to live (in seconds) of the entries, None for no expiration
+    """
+    def __init__(self, max_tuples=100000, ttl=None):
+        self.max_tuples = max_tuples
+        self.ttl = ttl
+
+        # (fingerprint, join key) -> (expires, tuples)
+        self.entries = OrderedDict()
+        self.tuples = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['lock'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = Lock()
+
+    @staticmethod
+    def fingerprint(operator):
+        """
+        :param operator: right plan of a dependent join, before it is instantiated (e.g., a LeafOperator)
+        :return: fingerprint of the plan, i.e., its source and subquery
+        """
+        return hashlib.sha1((str(getattr(operator, 'server', '')) + '\n' +
+                             str(getattr(operator, 'query_str', operator))).encode()).hexdigest()
+
+    def get(self, fingerprint, key):
+        """
+        :return: right tuples cached for the join key, None if it is not cached (or it is expired)
+        """
+        with self.lock:
+            entry = self.entries.get((fingerprint, key))
+            if entry is not None and (entry[0] is None or entry[0] > time()):
+                self.entries.move_to_end((fingerprint, key))
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._remove((fingerprint, key))
+            self.misses += 1
+            return None
+
+    def put(self, fingerprint, key, tuples):
+        """
+        Caches the right tuples of a join key, unless they are more than max_tuples.
+        """
+        if len(tuples) > self.max_tuples:
+            return
+        expires = None if self.ttl is None else time() + self.ttl
+        with self.lock:
+            if (fingerprint, key) in self.entries:
+                self._remove((fingerprint, key))
+            self.entries[(fingerprint, key)] = (expires, tuples)
+            self.tuples += max(len(tuples), 1)
+            while self.tuples > self.max_tuples:
+                k, e = self.entries.popitem(last=False)
+                self.tuples -= max(len(e[1]), 1)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tuples = 0
+
+    def _remove(self, key):
+        expires, tuples = self.entries.pop(key)
+        self.tuples -= max(len(tuples), 1)
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries),
+                    'tuples': self.tuples,
+                    'hits': self.hits,
+                    'misses': self.misses}
+
+
+RDF_TYPE = ["a", "rdf:type", "<http://www.w3.org/1999/02/22-rdf-syntax-ns#type>"]
+
+
+def _parameters(block):
+    # Yields the constant subjects and objects of the triple patterns of a query (or block), in a fixed order.
+    # Classes (objects of rdf:type) are not parameters: the sources of a star are selected by them.
+    from awudima.pysparql import Query, Triple, Optional, UnionBlock, JoinBlock
+
+    if isinstance(block, Query):
+        yield from _parameters(block.body)
+    elif isinstance(block, UnionBlock) or isinstance(block, JoinBlock):
+        for b in block.triples:
+            yield from _parameters(b)
+    elif isinstance(block, Optional):
+        yield from _parameters(block.bgg)
+    elif isinstance(block, Triple):
+        if block.subject.constant:
+            yield block.subject
+        if block.theobject.constant and not (block.predicate.constant and block.predicate.name in RDF_TYPE):
+            yield block.theobject
+
+
+def _services(block):
+    # Yields the services (i.e., star-shaped subqueries) of a decomposed query (or block)
+    from awudima.pysparql import Query, Service, Optional, UnionBlock, JoinBlock
+    from awudima.mediator.LogicalPlan import Node, Leaf
+
+    if isinstance(block, Query):
+        yield from _services(block.body)
+    elif isinstance(block, UnionBlock) or isinstance(block, JoinBlock):
+        if isinstance(block.triples, list):
+            for b in block.triples:
+                yield from _services(b)
+        else:
+            yield from _services(block.triples)
+    elif isinstance(block, Optional):
+        yield from _services(block.bgg)
+    elif isinstance(block, Node):
+        yield from _services(block.left)
+        yield from _services(block.right)
+    elif isinstance(block, Leaf):
+        yield from _services(block.service)
+    elif isinstance(block, Service):
+        yield block
+
+
+def _is_literal(name):
+    return name[:1] in ['"', "'", '+', '-', '.'] or name[:1].isdigit() or name in ['true', 'false']
+
+
+class QueryTemplate(object):
+    """
+    Template of a SPARQL query: the parsed query where the constant subjects and objects of its triple patterns are
+    replaced by parameters, i.e., placeholder IRIs (or literals). Queries that only differ in these constants share
+    the same template, hence the same decomposition.
+
+    Equal constants are replaced by the same parameter, so that the template keeps the joins on constants.
+
+    :param sparql_query: SPARQL query string
+    """
+    def __init__(self, sparql_query):
+        from awudima.pysparql import queryParser
+        query = queryParser.parse(sparql_query)
+
+        # constant (Argument) given to each parameter
+        self.values = []
+        # parameter of each constant of the query, in the order of _parameters(query)
+        self.slots = []
+        params = {}
+        for arg in _parameters(query):
+            c = (arg.name, arg.datatype, arg.lang)
+            if c not in params:
+                params[c] = len(self.values)
+                self.values.append(copy.copy(arg))
+            self.slots.append(params[c])
+            if _is_literal(arg.name):
+                arg.name = '"awudima:param:' + str(params[c]) + '"'
+            else:
+                arg.name = '<urn:awudima:param:' + str(params[c]) + '>'
+
+        self.query = query
+        self.text = _serialize(query)
+
+    def parse(self):
+        """
+        :return: a copy of the parsed query of the template, i.e., with parameters instead of constants
+        """
+        return copy.deepcopy(self.query)
+
+
+class _SharingPickler(pickle.Pickler):
+    # Pickles the given shared objects by reference, i.e., by their index in the list
+    def __init__(self, file, shared):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.shared = {id(o): i for i, o in enumerate(shared)}
+
+    def persistent_id(self, obj):
+        return self.shared.get(id(obj))
+
+
+class PlanCache(object):
+    """
+    Cache of query decompositions, keyed by the query template, the fingerprint of the federation and the
+    decomposition settings.
+
+    A cached decomposition (i.e., the logical plan: source selection and bushy tree of the template) is instantiated
+    for a query by copying it and binding its parameters to the constants of the query. Only the physical plan is
+    created per query: its operators are specific to an execution, and the subqueries of its leaves contain the
+    constants of the query.
+
+    Templates are cached as well, by query string, so repeated queries are parsed only once.
+
+    :param max_entries: maximum number of cached decompositions
+    :param max_queries: maximum number of cached templates
+    """
+    def __init__(self, max_entries=256, max_queries=1024):
+        self.max_entries = max_entries
+        self.max_queries = max_queries
+
+        # query string -> QueryTemplate
+        self.templates = OrderedDict()
+        # key -> (decomposed query, [(argument, parameter)])
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def template(self, sparql_query):
+        """
+        :param sparql_query: SPARQL query string
+        :return: QueryTemplate of the query
+        """
+        with self.lock:
+            if sparql_query in self.templates:
+                self.templates.move_to_end(sparql_query)
+                return self.templates[sparql_query]
+
+        template = QueryTemplate(sparql_query)
+        with self.lock:
+            self.templates[sparql_query] = template
+            while len(self.templates) > self.max_queries:
+                self.templates.popitem(last=False)
+        return template
+
+    @staticmethod
+    def key(template, federation, pushdownjoins=False):
+        """
+        :param template: QueryTemplate
+        :param federation: Federation the query is decomposed over
+        :param pushdownjoins: decomposition setting, whether joins are pushed down to the sources
+        :return: cache key of the decomposition of the template
+        """
+        return hashlib.sha1((federation.fingerprint + '\n' + str(pushdownjoins) + '\n' + template.text).encode()).hexdigest()
+
+    def get(self, template, federation, pushdownjoins=False):
+        """
+        :return: decomposed query of the template, instantiated with its constants, None if it is not cached
+        """
+        key = self.key(template, federation, pushdownjoins)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return self._instantiate(entry, template)
+
+    def put(self, template, federation, pushdownjoins, query, decomposed_query):
+        """
+        Caches the decomposition of a template.
+
+        :param query: the parsed query of the template (as given by template.parse()) that was decomposed
+        :param decomposed_query: its decomposition. It is owned by the cache afterwards.
+        :return: decomposed query instantiated with the constants of the template
+        """
+        args = [(arg, template.slots[i]) for i, arg in enumerate(_parameters(query))]
+
+        # Sources, molecule templates and the sources selected for the stars are not copied by the instances
+        shared = [federation]
+        for service in _services(decomposed_query):
+            shared.append(service.datasource)
+            for star in service.stars.values():
+                shared.extend([star[k] for k in ['datasources', 'rdfmts', 'predicates', 'variables'] if k in star])
+
+        # The decomposition is kept serialized: instances are unpickled, which is much faster than deep copies.
+        f = io.BytesIO()
+        pickler = _SharingPickler(f, shared)
+        pickler.dump((decomposed_query, args))
+        entry = (f.getvalue(), shared)
+
+        with self.lock:
+            self.entries[self.key(template, federation, pushdownjoins)] = entry
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return self._instantiate(entry, template)
+
+    def clear(self):
+        with self.lock:
+            self.templates.clear()
+            self.entries.clear()
+
+    def _instantiate(self, entry, template):
+        data, shared = entry
+        unpickler = pickle.Unpickler(io.BytesIO(data))
+        unpickler.persistent_load = shared.__getitem__
+        decomposed_query, args = unpickler.load()
+        for arg, p in args:
+            arg.__dict__.update(template.values[p].__dict__)
+        return decomposed_query
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries),
+                    'templates': len(self.templates),
+                    'hits': self.hits,
+                    'misses': self.misses}
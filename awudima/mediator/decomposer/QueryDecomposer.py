@@ -1,6 +1,7 @@
 
 __author__ = 'Kemele M. Endris'
 
+import copy
 from typing import List
 
 from awudima.pysparql import SPARQL as utils
@@ -16,7 +17,6 @@ class AwudimaDecomposer(object):
             self.query = queryParser.parse(query)
         else:
             self.query = query
-        self.__original_query = str(query)
         self.prefixes = utils.getPrefs(self.query.prefs)
         self.config = config
         self.relevant_mts = {}
@@ -100,7 +100,8 @@ class AwudimaDecomposer(object):
 
         tree = self.create_plan_tree(self.source_selection)
         body = UnionBlock(tree)
-        query = queryParser.parse(self.__original_query)
+        # the decomposed query is a copy of the (already parsed) query with the decomposed body
+        query = copy.copy(self.query)
         query.body = body
         self.decomposed_query = query
         return self.decomposed_query
@@ -0,0 +1,354 @@
+__author__ = 'Kemele M. Endris'
+
+import os
+import signal
+import tempfile
+from shutil import rmtree
+from time import time
+from collections import deque
+from multiprocessing import Process, Queue, Event, active_children
+from threading import Thread, Lock, Timer, Condition
+
+from awudima.operators.Multiplexer import ThreadQueue
+from awudima.operators.BlockQueue import BlockQueue, BLOCK_SIZE, FLUSH_TIMEOUT
+from awudima.operators.MemoryBudget import MemoryBudget
+from awudima.mediator.cache import BindJoinCache
+
+# Time (in seconds) given to the workers of a finished query to exit on their own before they are terminated.
+REAP_GRACE_PERIOD = 1
+
+
+def _terminate(signum, frame):
+    # SIGTERM handler of worker processes: workers started by this worker (e.g., by a dependent operator) go first.
+    for p in active_children():
+        p.terminate()
+    os._exit(1)
+
+
+def _run(target, args, tmpdir=None):
+    # Entry point of worker processes
+    signal.signal(signal.SIGTERM, _terminate)
+    if tmpdir is not None:
+        # temporary files created without a directory (e.g., by the wrappers) go to the directory of the query too
+        tempfile.tempdir = tmpdir
+    target(*args)
+
+
+class ProcessEngine(object):
+    """
+    Executes every node of a physical plan in its own OS process.
+
+    Tuples are exchanged between processes through multiprocessing queues,
+    in blocks of up to block_size tuples (block_size=1 disables batching).
+    """
+    name = 'processes'
+
+    def __init__(self, block_size=BLOCK_SIZE, flush_timeout=FLUSH_TIMEOUT):
+        self.block_size = block_size
+        self.flush_timeout = flush_timeout
+
+    def queue(self):
+        if self.block_size > 1:
+            return BlockQueue(Queue(), self.block_size, self.flush_timeout)
+        return Queue()
+
+    def start(self, target, args=(), tmpdir=None):
+        p = Process(target=_run, args=(target, args, tmpdir))
+        p.start()
+        return p
+
+
+class ThreadEngine(object):
+    """
+    Executes every node of a physical plan as a thread of the calling process.
+
+    Tuples are exchanged through in-memory queues, i.e., no fork and no pickling.
+    Suited for plans dominated by I/O-bound wrappers and light operators.
+    Tuples are exchanged in blocks as well, to amortize locking.
+    """
+    name = 'threads'
+
+    def __init__(self, block_size=BLOCK_SIZE, flush_timeout=FLUSH_TIMEOUT):
+        self.block_size = block_size
+        self.flush_timeout = flush_timeout
+
+    def queue(self):
+        if self.block_size > 1:
+            return BlockQueue(ThreadQueue(), self.block_size, self.flush_timeout)
+        return ThreadQueue()
+
+    def start(self, target, args=(), tmpdir=None):
+        # The temporary directory is process-wide: threads do not change it. Operators are given the
+        # temporary directory of the query explicitly (see NodeOperator).
+        t = Thread(target=target, args=args)
+        t.daemon = True
+        t.start()
+        return t
+
+
+ENGINES = {
+    ProcessEngine.name: ProcessEngine(),
+    ThreadEngine.name: ThreadEngine()
+}
+
+
+def get_engine(engine=None):
+    """
+    Returns the execution engine for the given name (or engine object)
+
+    :param engine: 'processes' (default) or 'threads', or an engine object,
+                   e.g., ProcessEngine(block_size=100) to configure the tuple transport
+    :return: execution engine
+    """
+    if engine is None:
+        return ENGINES[ProcessEngine.name]
+    if isinstance(engine, str):
+        if engine not in ENGINES:
+            raise ValueError("No such execution engine: " + engine + ". Supported engines: " + ", ".join(ENGINES))
+        return ENGINES[engine]
+    return engine
+
+
+class ExecutionContext(object):
+    """
+    Execution context of a single query.
+
+    It is used as the execution engine of the plan of the query: every worker is started
+    through the context, which keeps track of it. When the query finishes, is cancelled or
+    times out, close() reaps all the workers and removes the temporary files of the query.
+
+    Worker processes terminate the workers they started themselves (e.g., the right plans
+    instantiated by dependent operators) when they are terminated. Threads cannot be
+    terminated, they are left to finish on their own.
+
+    :param engine: execution engine (name or object) used to start the workers
+    :param timeout: wall-clock timeout (in seconds) of the query, None for no timeout
+    :param max_workers: maximum number of concurrent worker processes of the query, None for no limit.
+                        Further workers are started as threads of the calling process.
+    :param pool: WorkerPool that admitted the query, if any. Its workers are given back when the context is closed.
+    :param memory_budget: main memory (in bytes) for the hash tables of the join and optional operators of the query,
+                          None for no limit. Operators spill their coldest partitions to disk when it is exceeded.
+    :param bindjoin_cache: number of right tuples of the dependent joins of the query that are cached, or a
+                           BindJoinCache shared with other queries. None for no cache.
+
+    The operators and wrappers of the query share the stopped event of the context: it is set when no more
+    results are needed (e.g., the LIMIT is reached), or when the query is closed or cancelled, so that they stop
+    reading their inputs and fetching pages from the sources, also when they run as threads.
+    """
+    def __init__(self, engine=None, timeout=None, max_workers=None, pool=None, memory_budget=None,
+                 bindjoin_cache=None):
+        self.engine = get_engine(engine)
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.pool = pool
+        self.memory = None
+        if memory_budget is not None and memory_budget > 0:
+            self.memory = MemoryBudget(memory_budget)
+        self.bindjoin_cache = None
+        if isinstance(bindjoin_cache, BindJoinCache):
+            self.bindjoin_cache = bindjoin_cache
+        elif bindjoin_cache is not None and bindjoin_cache > 0:
+            self.bindjoin_cache = BindJoinCache(bindjoin_cache)
+        self.tmpdir = tempfile.mkdtemp(prefix='awudima-')
+        self.workers = []
+        self.stopped = Event()
+        self.cancelled = False
+        self.reason = None
+        self.pid = os.getpid()
+        self.lock = Lock()
+        self.timer = None
+        if timeout is not None and timeout > 0:
+            self.timer = Timer(timeout, self.cancel, ('timeout',))
+            self.timer.daemon = True
+            self.timer.start()
+
+    def __getstate__(self):
+        # Workers, lock and timer belong to the process that created the context.
+        state = self.__dict__.copy()
+        state['workers'] = []
+        state['lock'] = None
+        state['timer'] = None
+        state['pool'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = Lock()
+
+    def queue(self):
+        return self.engine.queue()
+
+    def start(self, target, args=(), tmpdir=None):
+        if os.getpid() != self.pid:
+            # Copy of the context inherited by a worker process: it keeps track of the workers of that process only.
+            self.pid = os.getpid()
+            self.workers = []
+            self.lock = Lock()
+            self.timer = None
+            self.pool = None
+
+        with self.lock:
+            if self.cancelled:
+                # No workers are started once the query is cancelled: callers put the EOF of their output.
+                return None
+            engine = self.engine
+            if self.max_workers is not None and isinstance(engine, ProcessEngine) \
+                    and len(self.alive_workers()) >= self.max_workers:
+                engine = ENGINES[ThreadEngine.name]
+            worker = engine.start(target, args, self.tmpdir)
+            self.workers.append(worker)
+            return worker
+
+    def alive_workers(self):
+        return [w for w in self.workers if w.is_alive()]
+
+    def stop(self):
+        """
+        Signals the operators and wrappers of the query that no more results are needed.
+        """
+        self.stopped.set()
+
+    def cancel(self, reason='cancelled'):
+        """
+        Cancels the query: its workers are terminated right away.
+
+        :param reason: 'cancelled' or 'timeout'
+        """
+        if self.cancelled:
+            return
+        self.reason = reason
+        self.cancelled = True
+        self.close(grace_period=0)
+
+    def close(self, grace_period=REAP_GRACE_PERIOD):
+        """
+        Reaps the workers of the query: workers still running after the grace period are terminated.
+        """
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.stop()
+
+        with self.lock:
+            workers = list(self.workers)
+            pool = self.pool
+            self.pool = None
+
+        deadline = time() + grace_period
+        for w in workers:
+            if not isinstance(w, Process):
+                continue
+            try:
+                w.join(max(deadline - time(), 0))
+                if w.is_alive():
+                    w.terminate()
+                    w.join(1)
+            except Exception as e:
+                print("Exception while reaping worker process", w.pid, e)
+
+        rmtree(self.tmpdir, ignore_errors=True)
+
+        if pool is not None:
+            pool.release(self)
+
+
+class WorkerPool(object):
+    """
+    Bounded pool of workers shared by the queries of a long-running process, e.g., the SPARQL endpoint.
+
+    Operators are long-lived pipeline stages: all the workers of a query must run at the same time, otherwise
+    the plan deadlocks. Hence, workers are pooled as slots: an admitted query reserves max_workers slots for its
+    worker processes (further workers of the query run as threads) until its execution context is closed.
+    Queries that do not fit wait for their turn (first come, first served) in a bounded waiting queue.
+
+    :param size: total number of worker slots
+    :param max_workers: default number of worker slots (i.e., parallelism) of a query
+    :param max_waiting: maximum number of queries waiting for admission, None for no limit
+    :param engine: execution engine (name or object) of the admitted queries
+    :param timeout: default wall-clock timeout (in seconds) of the admitted queries
+    :param memory_budget: default memory budget (in bytes) of the hash tables of the admitted queries
+    :param bindjoin_cache: default size (in right tuples) of the bind join cache of the admitted queries,
+                           or a BindJoinCache shared by them
+    """
+    def __init__(self, size=None, max_workers=8, max_waiting=None, engine=None, timeout=None, memory_budget=None,
+                 bindjoin_cache=None):
+        if size is None:
+            size = 4 * (os.cpu_count() or 1) * max_workers
+        self.size = size
+        self.max_workers = max_workers
+        self.max_waiting = max_waiting
+        self.engine = get_engine(engine)
+        self.timeout = timeout
+        self.memory_budget = memory_budget
+        self.bindjoin_cache = bindjoin_cache
+
+        self.free = size
+        self.running = 0
+        self.waiting = deque()
+        self.condition = Condition()
+
+    def admit(self, wait_timeout=None, max_workers=None, timeout=None, memory_budget=None, bindjoin_cache=None):
+        """
+        Admits a new query, waiting for free workers if needed.
+
+        :param wait_timeout: maximum time (in seconds) to wait for admission, None to wait as long as needed
+        :param max_workers: number of worker slots of the query (capped by the size of the pool)
+        :param timeout: wall-clock timeout (in seconds) of the query
+        :param memory_budget: memory budget (in bytes) of the hash tables of the query
+        :param bindjoin_cache: size (in right tuples) of the bind join cache of the query, or a shared BindJoinCache
+        :return: ExecutionContext of the admitted query, or None if the pool is busy
+        """
+        slots = min(max_workers or self.max_workers, self.size)
+        if timeout is None:
+            timeout = self.timeout
+        if memory_budget is None:
+            memory_budget = self.memory_budget
+        if bindjoin_cache is None:
+            bindjoin_cache = self.bindjoin_cache
+        deadline = None if wait_timeout is None else time() + wait_timeout
+
+        with self.condition:
+            if self.max_waiting is not None and len(self.waiting) >= self.max_waiting and \
+                    (len(self.waiting) > 0 or self.free < slots):
+                return None
+
+            ticket = object()
+            self.waiting.append(ticket)
+            try:
+                while self.waiting[0] is not ticket or self.free < slots:
+                    remaining = None
+                    if deadline is not None:
+                        remaining = deadline - time()
+                        if remaining <= 0:
+                            return None
+                    self.condition.wait(remaining)
+            finally:
+                self.waiting.remove(ticket)
+                # the next query in line might fit as well
+                self.condition.notify_all()
+
+            self.free -= slots
+            self.running += 1
+
+        try:
+            return ExecutionContext(self.engine, timeout, slots, self, memory_budget, bindjoin_cache)
+        except Exception:
+            # e.g., the temporary directory of the query cannot be created: give the slots back
+            with self.condition:
+                self.free += slots
+                self.running -= 1
+                self.condition.notify_all()
+            raise
+
+    def release(self, context):
+        with self.condition:
+            self.free += context.max_workers
+            self.running -= 1
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {'size': self.size,
+                    'free': self.free,
+                    'running': self.running,
+                    'waiting': len(self.waiting)}
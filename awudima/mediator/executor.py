@@ -1,9 +1,15 @@
 __author__ = 'Kemele M. Endris'
 
 from multiprocessing import Queue
+from queue import Empty, SimpleQueue
+import json
 
 from awudima.mediator.decomposer.QueryDecomposer import AwudimaDecomposer
 from awudima.mediator.planner.QueryPlanner import AwudimaPlanner
+from awudima.mediator.engine import ExecutionContext
+from awudima.operators.MemoryBudget import MemoryBudget
+from awudima.mediator.cache import ResultCache, PlanCache, BindJoinCache
+from awudima.mediator import writers
 from awudima.pyrdfmt import Federation
 import logging
 
@@ -18,50 +24,149 @@ logger.addHandler(handler)
 
 class AwudimaFQP(object):
 
-    def __init__(self, federation: Federation):
+    def __init__(self, federation: Federation, result_cache: ResultCache = None, plan_cache: PlanCache = None):
+        """
+        :param federation: Federation to execute queries over
+        :param result_cache: ResultCache shared by the queries, None to disable caching of results
+        :param plan_cache: PlanCache shared by the queries, None to decompose every query from scratch
+        """
         self.federation = federation
+        self.result_cache = result_cache
+        self.plan_cache = plan_cache
 
-    def execute(self, sparql_query: str, keep_in_memory=False, pushdownssqjoins=False):
+    def execute(self, sparql_query: str, keep_in_memory=False, pushdownssqjoins=False, engine='processes',
+                timeout=None, max_workers=None, context=None, use_cache=True, memory_budget=None,
+                bindjoin_cache=None):
         """
 
         Execute a federated sparql query over a semantic data lake
 
         :param sparql_query:
         :param pushdownssqjoins:
+        :param engine: execution engine of the physical plan: 'processes' (one OS process per plan node)
+                       or 'threads' (one thread per plan node, in-memory queues)
+        :param timeout: wall-clock timeout (in seconds) of the query. The query is cancelled when it expires.
+        :param max_workers: maximum number of concurrent worker processes of the query
+        :param context: ExecutionContext to run the query with, e.g., as admitted by a WorkerPool.
+                        If given, engine, timeout and max_workers are those of the context.
+        :param use_cache: if False, cached results are bypassed, i.e., the query is executed and its results cached again
+        :param memory_budget: main memory (in bytes) for the hash tables of the join and optional operators of the query.
+                              Defaults to the memory budget of the federation (if any), or of the given context.
+        :param bindjoin_cache: number of right tuples of the dependent joins of the query that are cached, or a
+                               BindJoinCache shared with other queries. Defaults to the cache of the given context.
         :return: yields SPARQL JSON Results
         """
+        if use_cache:
+            resultset = self.get_cached(sparql_query)
+            if resultset is not None:
+                if context is not None:
+                    context.close()
+                return resultset
+
+        if memory_budget is None:
+            memory_budget = getattr(self.federation, 'memory_budget', None)
+        if context is None:
+            context = ExecutionContext(engine, timeout, max_workers, memory_budget=memory_budget,
+                                       bindjoin_cache=bindjoin_cache)
+        else:
+            if context.memory is None and memory_budget is not None and memory_budget > 0:
+                context.memory = MemoryBudget(memory_budget)
+            if context.bindjoin_cache is None and isinstance(bindjoin_cache, BindJoinCache):
+                context.bindjoin_cache = bindjoin_cache
+            elif context.bindjoin_cache is None and bindjoin_cache is not None and bindjoin_cache > 0:
+                context.bindjoin_cache = BindJoinCache(bindjoin_cache)
         try:
-            mc = AwudimaDecomposer(sparql_query, self.federation, pushdownssqjoins=pushdownssqjoins)
-            decompositions = mc.decompose()
+            decompositions = self.decompose(sparql_query, pushdownssqjoins)
         except Exception as e:
             print("Exception while decomposing the given query: ", sparql_query)
             print(e)
             logger.info("Exception while decomposing the given query: " + str(sparql_query))
             logger.error(e)
+            context.close()
             return None
 
         try:
-            mwp = AwudimaPlanner(sparql_query, decompositions, self.federation, pushdownjoins=pushdownssqjoins)
+            mwp = AwudimaPlanner(sparql_query, decompositions, self.federation, pushdownjoins=pushdownssqjoins,
+                                 memory_budget=context.memory.limit if context.memory is not None else None)
             plan = mwp.create_physical_plan()
         except Exception as e:
             print("Exception while creating physical plan for the given query: ", sparql_query)
             print(e)
             logger.info("Exception while creating physical plan for  the given query: " + str(sparql_query))
             logger.error(e)
+            context.close()
             return None
 
-        out = Queue()
+        out = context.queue()
 
         try:
+            plan.engine = context
             plan.execute(out)
         except Exception as e:
             print("Exception while executing the plan for the given query: ", sparql_query)
             print(e)
             logger.info("Exception while executing the plan for  the given query: " + str(sparql_query))
             logger.error(e)
+            context.cancel()
+            return None
+
+        resultset = self.ResultSet(sparql_query, out, decompositions, plan, keep_in_memory, context)
+        if self.result_cache is not None:
+            resultset.cache_results(self.result_cache, self.result_cache.key(sparql_query, self.federation))
+        return resultset
+
+    def decompose(self, sparql_query: str, pushdownssqjoins=False):
+        """
+        Decomposes the given query, i.e., selects the sources and creates the logical plan of the query.
+        If a PlanCache is given, the decomposition of the template of the query is reused (or cached).
+
+        :param sparql_query:
+        :param pushdownssqjoins:
+        :return: decomposed query
+        """
+        if self.plan_cache is None:
+            mc = AwudimaDecomposer(sparql_query, self.federation, pushdownssqjoins=pushdownssqjoins)
+            return mc.decompose()
+
+        template = self.plan_cache.template(sparql_query)
+        decomposed_query = self.plan_cache.get(template, self.federation, pushdownssqjoins)
+        if decomposed_query is not None:
+            return decomposed_query
+
+        query = template.parse()
+        mc = AwudimaDecomposer(query, self.federation, pushdownssqjoins=pushdownssqjoins)
+        decomposed_query = mc.decompose()
+        if decomposed_query is None:
+            return None
+        return self.plan_cache.put(template, self.federation, pushdownssqjoins, query, decomposed_query)
+
+    def get_cached(self, sparql_query: str):
+        """
+        Returns the cached results of the given query, if any.
+
+        :param sparql_query:
+        :return: ResultSet over the cached results, or None if they are not cached
+        """
+        if self.result_cache is None:
+            return None
+        try:
+            cached = self.result_cache.get(self.result_cache.key(sparql_query, self.federation))
+        except Exception as e:
+            print("Exception while reading cached results of the given query: ", sparql_query)
+            print(e)
+            logger.error(e)
+            return None
+        if cached is None:
             return None
 
-        return self.ResultSet(sparql_query, out, decompositions, plan, keep_in_memory)
+        vars, rows = cached
+        queue = SimpleQueue()
+        for r in rows:
+            queue.put(r)
+        queue.put('EOF')
+        resultset = self.ResultSet(sparql_query, queue, None, None, True)
+        resultset.set_vars(vars)
+        return resultset
 
     def get_sources_selected(self, sparql_query: str, pushdownssqjoins=False):
         try:
@@ -78,8 +183,7 @@ class AwudimaFQP(object):
 
     def get_decompose_query(self, sparql_query: str, pushdownssqjoins=False):
         try:
-            mc = AwudimaDecomposer(sparql_query, self.federation, pushdownssqjoins=pushdownssqjoins)
-            decomposed_query = mc.decompose()
+            decomposed_query = self.decompose(sparql_query, pushdownssqjoins)
             return decomposed_query
         except Exception as e:
             print("Exception while getting decomposed query: ", sparql_query)
@@ -90,8 +194,7 @@ class AwudimaFQP(object):
 
     def get_physical_plan(self, sparql_query: str, pushdownssqjoins=False):
         try:
-            mc = AwudimaDecomposer(sparql_query, self.federation, pushdownssqjoins=pushdownssqjoins)
-            decompositions = mc.decompose()
+            decompositions = self.decompose(sparql_query, pushdownssqjoins)
         except Exception as e:
             print("Exception while decomposing the given query: ", sparql_query)
             print(e)
@@ -100,7 +203,8 @@ class AwudimaFQP(object):
             return None
 
         try:
-            mwp = AwudimaPlanner(sparql_query, decompositions, self.federation, pushdownjoins=pushdownssqjoins)
+            mwp = AwudimaPlanner(sparql_query, decompositions, self.federation, pushdownjoins=pushdownssqjoins,
+                                 memory_budget=getattr(self.federation, 'memory_budget', None))
             plan = mwp.create_physical_plan()
             return plan
         except Exception as e:
@@ -112,14 +216,18 @@ class AwudimaFQP(object):
 
     class ResultSet(object):
 
-        def __init__(self, sparql_query, queue: Queue, decomposition, plan, keep_in_memory=False):
+        def __init__(self, sparql_query, queue, decomposition, plan, keep_in_memory=False, context=None):
             self.queue = queue
+            self.context = context
             self.sparql_query = sparql_query
             self.decomposition = decomposition
             self.plan = plan
             self.keep_in_memory = keep_in_memory
 
             self.__retrieved_results = -1
+            self.__vars = None
+            self.__cache = None
+            self.__cache_key = None
             self.__retrieval_status = "Not Started"
             self.__result_buffer = {
                 "head": {
@@ -149,12 +257,7 @@ class AwudimaFQP(object):
 
                 self.__retrieved_results = len(res)
 
-                if len(self.decomposition.args) == 0:
-                    from awudima.pysparql import queryParser
-                    query = queryParser.parse(self.sparql_query)
-                    self.__result_buffer['head']['vars'] = query.getVars()
-                else:
-                    self.__result_buffer['head']['vars'] = [str(var)[1:] for var in self.decomposition.args]
+                self.__result_buffer['head']['vars'] = self.get_vars()
             return self.__retrieved_results
 
         @property
@@ -165,15 +268,15 @@ class AwudimaFQP(object):
                 self.__result_buffer['results']['bindings'] = res
                 self.__retrieved_results = len(res)
 
-                if len(self.decomposition.args) == 0:
-                    from awudima.pysparql import queryParser
-                    query = queryParser.parse(self.sparql_query)
-                    self.__result_buffer['head']['vars'] = query.getVars()
-                else:
-                    self.__result_buffer['head']['vars'] = [str(var)[1:] for var in self.decomposition.args]
+                self.__result_buffer['head']['vars'] = self.get_vars()
 
             if self.__retrieval_status == 'Interrupted':
                 message = "Data retrieval has been interrupted because of some Exception!"
+            elif self.__retrieval_status == 'Cancelled':
+                if self.context is not None and self.context.reason == 'timeout':
+                    message = "Data retrieval has been cancelled because the query timed out. The results in this ResultSet are partial results!"
+                else:
+                    message = "Data retrieval has been cancelled. The results in this ResultSet are partial results!"
             elif self.__retrieval_status == "Started":
                 message = "Data retrieval has not been finished yet. The results in this ResultSet are partial results!"
 
@@ -184,8 +287,145 @@ class AwudimaFQP(object):
 
             return self.__result_buffer
 
+        def set_vars(self, vars):
+            self.__vars = vars
+
+        def cache_results(self, cache, key):
+            """
+            Caches the results under the given key once they are all retrieved.
+            """
+            self.__cache = cache
+            self.__cache_key = key
+
+        def get_vars(self):
+            if self.__vars is None:
+                if len(self.decomposition.args) == 0:
+                    from awudima.pysparql import queryParser
+                    query = queryParser.parse(self.sparql_query)
+                    self.__vars = query.getVars()
+                else:
+                    self.__vars = [str(var)[1:] for var in self.decomposition.args]
+            return self.__vars
+
+        def _chunks(self, chunk_size):
+            # Groups the results in chunks of up to chunk_size rows.
+            # A chunk is also yielded as soon as no more results are queued, so that first rows are not held back.
+            results = self.get()
+            try:
+                chunk = []
+                for r in results:
+                    if r is None:
+                        continue
+                    chunk.append(r)
+                    if len(chunk) >= chunk_size or self.queue.empty():
+                        yield chunk
+                        chunk = []
+                if len(chunk) > 0:
+                    yield chunk
+            finally:
+                results.close()
+
+        def _stream(self, document):
+            # Yields the chunks of a document. The query is cancelled if the document is abandoned before the results
+            # are retrieved (e.g., the client disconnects after the header), so that its workers and slots are released.
+            try:
+                for chunk in document:
+                    yield chunk
+            finally:
+                document.close()
+                if self.__retrieval_status in ['Not Started', 'Started']:
+                    self.cancel()
+
+        def stream_json(self, chunk_size=100):
+            """
+            Serializes the results as SPARQL JSON, incrementally: the head first, then the bindings as they arrive.
+
+            :param chunk_size: maximum number of bindings per chunk
+            :return: yields chunks (str) of the SPARQL JSON document
+            """
+            return self._stream(self._json(chunk_size))
+
+        def _json(self, chunk_size):
+            yield '{"head": {"vars": ' + json.dumps(self.get_vars()) + '}, "results": {"bindings": ['
+            first = True
+            for chunk in self._chunks(chunk_size):
+                yield ('' if first else ', ') + ', '.join(json.dumps(r) for r in chunk)
+                first = False
+
+            message = "All results are retrieved from resultset!"
+            if self.status == 'Interrupted':
+                message = "Data retrieval has been interrupted because of some Exception!"
+            elif self.status == 'Cancelled':
+                message = "Data retrieval has been cancelled" + \
+                          (" because the query timed out" if self.context is not None and self.context.reason == 'timeout' else "") + \
+                          ". The results in this ResultSet are partial results!"
+            yield ']}, "message": ' + json.dumps(message) + ', "query": ' + json.dumps(str(self.sparql_query)) + '}'
+
+        def stream_tsv(self, chunk_size=100):
+            """
+            Serializes the results in the SPARQL TSV format, incrementally.
+
+            :return: yields chunks (str) of the TSV document
+            """
+            return self._stream(self._tsv(chunk_size))
+
+        def _tsv(self, chunk_size):
+            vars = self.get_vars()
+            yield writers.tsv_header(vars)
+            for chunk in self._chunks(chunk_size):
+                yield writers.tsv_rows(vars, chunk)
+
+        def stream_csv(self, chunk_size=100):
+            """
+            Serializes the results in the SPARQL CSV format, incrementally.
+
+            :return: yields chunks (str) of the CSV document
+            """
+            return self._stream(self._csv(chunk_size))
+
+        def _csv(self, chunk_size):
+            vars = self.get_vars()
+            yield writers.csv_header(vars)
+            for chunk in self._chunks(chunk_size):
+                yield writers.csv_rows(vars, chunk)
+
+        def stream_arrow(self, chunk_size=10000):
+            """
+            Serializes the results in the Arrow IPC streaming format (one record batch per chunk). Requires pyarrow.
+
+            :return: yields chunks (bytes) of the Arrow stream
+            """
+            return self._stream(self._arrow(chunk_size))
+
+        def _arrow(self, chunk_size):
+            writer = writers.ArrowStreamWriter(self.get_vars())
+            yield writer.header()
+            for chunk in self._chunks(chunk_size):
+                yield writer.write(chunk)
+            yield writer.close()
+
+        def cancel(self):
+            """
+            Cancels the retrieval of results: the workers of the query are terminated.
+            """
+            if self.context is not None:
+                self.context.cancel()
+            if self.__retrieval_status in ['Not Started', 'Started']:
+                self.__retrieval_status = 'Cancelled'
+
+        def _next(self):
+            # Waits for the next result, unless the query is cancelled (or times out) meanwhile
+            if self.context is None:
+                return self.queue.get()
+            while not self.context.cancelled:
+                try:
+                    return self.queue.get(True, 0.5)
+                except Empty:
+                    pass
+            return 'EOF'
+
         def get(self):
-            if self.__retrieval_status in ['Finished', 'Interrupted']:
+            if self.__retrieval_status in ['Finished', 'Interrupted', 'Cancelled']:
                 if self.keep_in_memory:
                     if 'results' in self.__result_buffer:
                         for r in self.__result_buffer['results']['bindings']:
@@ -195,27 +435,34 @@ class AwudimaFQP(object):
             else:
                 try:
                     self.__retrieval_status = 'Started'
-                    r = self.queue.get()
+                    r = self._next()
 
                     i = 0
                     self.__retrieved_results = 0
 
-                    if len(self.decomposition.args) == 0:
-                        from awudima.pysparql import queryParser
-                        query = queryParser.parse(self.sparql_query)
-                        self.__result_buffer['head']['vars'] = query.getVars()
-                    else:
-                        self.__result_buffer['head']['vars'] = [str(var)[1:] for var in self.decomposition.args]
+                    self.__result_buffer['head']['vars'] = self.get_vars()
+                    rows = [] if self.__cache is not None else None
                     while r != 'EOF':
                         self.__retrieved_results = i + 1
                         if self.keep_in_memory:
                             self.__result_buffer['results']['bindings'].append(r)
+                        if rows is not None:
+                            if len(rows) < self.__cache.max_rows:
+                                rows.append(r)
+                            else:
+                                # results larger than the cache are not cached
+                                rows = None
 
                         yield r
-                        r = self.queue.get()
+                        r = self._next()
                         i += 1
 
-                    self.__retrieval_status = "Finished"
+                    if self.context is not None and self.context.cancelled:
+                        self.__retrieval_status = 'Cancelled'
+                    else:
+                        self.__retrieval_status = "Finished"
+                        if rows is not None:
+                            self.__cache.put(self.__cache_key, self.get_vars(), rows)
                 except Exception as ex:
                     print("Exception while retrieving results for the given query: ", self.sparql_query)
                     print(ex)
@@ -223,3 +470,10 @@ class AwudimaFQP(object):
                     logger.error(ex)
                     self.__retrieval_status = "Interrupted"
                     yield
+                finally:
+                    # reaps the workers of the query, also when the results are abandoned before the EOF
+                    if self.context is not None:
+                        if self.__retrieval_status == 'Finished':
+                            self.context.close()
+                        else:
+                            self.cancel()
@@ -3,6 +3,7 @@ __author__ = "Kemele M. Endris"
 
 from awudima.mediator.PhysicalPlanOperators import *
 from awudima.operators.nonblocking.Xgjoin import Xgjoin
+from awudima.operators.blocking.HybridHashJoin import HybridHashJoin
 from awudima.operators.nonblocking.NestedHashJoinFilter import NestedHashJoinFilter
 from awudima.operators.nonblocking.NestedHashOptionalFilter import NestedHashOptionalFilter as NestedHashOptional
 from awudima.operators.nonblocking.Xunion import Xunion
@@ -14,6 +15,7 @@ from awudima.operators.nonblocking.Xask import Xask
 from awudima.operators.nonblocking.Xoffset import Xoffset
 from awudima.operators.nonblocking.Xlimit import Xlimit
 from awudima.operators.nonblocking.Xgoptional import Xgoptional
+from awudima.operators.modifiers.Xorderby import Xorderby
 from awudima.pysparql import Optional
 from awudima.mediator.utilities import *
 from awudima.pysparql import Service, UnionBlock, JoinBlock
@@ -21,11 +23,13 @@ from awudima.mediator.LogicalPlan import Node, Leaf
 
 
 class AwudimaPlanner(object):
-    def __init__(self, original_query: str, decomposed_query, config, pushdownjoins=True):
+    def __init__(self, original_query: str, decomposed_query, config, pushdownjoins=True, memory_budget=None):
         self.original_query = original_query
         self.query = decomposed_query
         self.config = config
         self.pushdownjoins = pushdownjoins
+        # memory budget (in bytes) of the hash tables of the query, if any
+        self.memory_budget = memory_budget
 
     def create_physical_plan(self):
         # _ = self.create_logical_plan()
@@ -34,9 +38,23 @@ class AwudimaPlanner(object):
 
         if operatorTree is None:
             return []
+
+        # Number of tuples needed by the limit (and offset) operators, -1 for all.
+        # Tuples removed by the distinct operator are not known in advance.
+        limit = -1
+        if self.query.limit != -1 and not self.query.distinct:
+            limit = int(self.query.limit) + max(int(self.query.offset), 0)
+
+        # The limit (and offset) of the query is evaluated by the sources, if possible.
+        pushed_offset = self.pushdown_limit(operatorTree)
+
+        # Adds the order by operator to the plan, before the projection (the conditions may not be projected).
+        if self.query.order_by and self.query.query_type != 2:
+            operatorTree = NodeOperator(Xorderby(self.query.order_by, limit), operatorTree.vars, self.config, operatorTree)
+
         # Adds the project operator to the plan.
         if self.query.query_type == 0:
-            operatorTree = NodeOperator(Xproject(self.query.args, self.query.limit), operatorTree.vars, self.config, operatorTree)
+            operatorTree = NodeOperator(Xproject(self.query.args, limit), operatorTree.vars, self.config, operatorTree)
         elif self.query.query_type == 1:
             operatorTree = NodeOperator(Xconstruct(self.query.args, self.query.prefs, self.query.limit), operatorTree.vars, self.config, operatorTree)
         else:
@@ -44,10 +62,10 @@ class AwudimaPlanner(object):
 
         # Adds the distinct operator to the plan.
         if (self.query.distinct):
-            operatorTree = NodeOperator(Xdistinct(None), operatorTree.vars, self.config, operatorTree)
+            operatorTree = NodeOperator(Xdistinct(None, ordered=len(self.query.order_by) > 0), operatorTree.vars, self.config, operatorTree)
 
         # Adds the offset operator to the plan.
-        if (self.query.offset != -1):
+        if (self.query.offset != -1) and not pushed_offset:
             operatorTree = NodeOperator(Xoffset(None, self.query.offset), operatorTree.vars, self.config, operatorTree)
 
         # Adds the limit operator to the plan.
@@ -57,6 +75,57 @@ class AwudimaPlanner(object):
 
         return operatorTree
 
+    def pushdown_limit(self, operatorTree):
+        """
+        Pushes the LIMIT (and OFFSET) of the query down to the sources, if every result of the sources is a result
+        of the query, i.e., the plan has no operator other than unions, and the query has no ORDER BY.
+
+        The OFFSET is pushed down to a single SPARQL endpoint only: the MySQL and MongoDB wrappers drop rows with
+        null values, and the union of several sources needs the first LIMIT + OFFSET results of each of them.
+        With DISTINCT, the limit is pushed down to a single SPARQL endpoint only, since its subquery projects the
+        variables of the query (DISTINCT is pushed down to the sources by the translation of the subqueries).
+
+        :param operatorTree: plan of the body of the query
+        :return: True if the OFFSET of the query is evaluated by the source
+        """
+        if self.query.order_by:
+            return False
+        if self.query.query_type == 2:
+            # ASK: one result is enough.
+            (limit, offset) = (1, -1)
+        elif self.query.limit != -1:
+            (limit, offset) = (int(self.query.limit), int(self.query.offset))
+        else:
+            return False
+
+        leaves = self.union_leaves(operatorTree)
+        if not leaves:
+            return False
+
+        if len(leaves) == 1 and leaves[0].datasource.dstype == DataSourceType.SPARQL_ENDPOINT \
+                and self.query.body.show(" ").count("SERVICE") == 1:
+            leaves[0].max_results = limit
+            leaves[0].offset = offset
+            return offset > 0
+
+        if self.query.distinct:
+            return False
+        for leaf in leaves:
+            leaf.max_results = limit + max(offset, 0)
+        return False
+
+    def union_leaves(self, tree):
+        # Leaf operators of a plan with no operator other than unions, None otherwise.
+        if isinstance(tree, LeafOperator):
+            return [tree]
+        if isinstance(tree, NodeOperator) and isinstance(tree.operator, Xunion):
+            left = self.union_leaves(tree.left)
+            right = self.union_leaves(tree.right)
+            if left is None or right is None:
+                return None
+            return left + right
+        return None
+
     def includePhysicalOperatorsQuery(self):
         return self.includePhysicalOperatorsUnionBlock(self.query.body)
 
@@ -71,7 +140,8 @@ class AwudimaPlanner(object):
             left = r.pop(0)
             right = r.pop(0)
             all_variables = left.vars | right.vars
-            n = NodeOperator(Xunion(left.vars, right.vars), all_variables, self.config, left, right)
+            # Duplicates are filtered out by the union already, if the query is DISTINCT.
+            n = NodeOperator(Xunion(left.vars, right.vars, self.query.distinct), all_variables, self.config, left, right)
             r.append(n)
 
         if len(r) == 1:
@@ -273,13 +343,13 @@ class AwudimaPlanner(object):
 
                 if "SQL" in l.datasource.dstype.value and 'SPARQL' in r.datasource.dstype.value:
                     if lowSelectivityLeft and lowSelectivityRight:
-                        n = NodeOperator(Xgjoin(join_variables), all_variables, self.config, l, r, consts, self.query)
+                        n = self.make_non_selective_join(join_variables, all_variables, l, r, consts)
                     else:
                         n = NodeOperator(NestedHashJoinFilter(join_variables), all_variables, self.config, l, r, consts, self.query)
                         dependent_join = True
                 elif "SQL" in r.datasource.dstype.value and 'SPARQL' in l.datasource.dstype.value:
                     if lowSelectivityLeft and lowSelectivityRight:
-                        n = NodeOperator(Xgjoin(join_variables), all_variables, self.config, l, r, consts, self.query)
+                        n = self.make_non_selective_join(join_variables, all_variables, l, r, consts)
                     else:
                         n = NodeOperator(NestedHashJoinFilter(join_variables), all_variables, self.config, r, l, consts, self.query)
                 else:
@@ -290,7 +360,7 @@ class AwudimaPlanner(object):
                     elif not lowSelectivityLeft and not lowSelectivityRight:
                         n = NodeOperator(NestedHashJoinFilter(join_variables), all_variables, self.config, l, r, consts, self.query)
                     elif lowSelectivityLeft and lowSelectivityRight:
-                        n = NodeOperator(Xgjoin(join_variables), all_variables, self.config, l, r, consts, self.query)
+                        n = self.make_non_selective_join(join_variables, all_variables, l, r, consts)
                     dependent_join = True
         elif isinstance(r, NodeOperator) and r.operator.__class__.__name__ == "Xunion" and \
                 isinstance(l, NodeOperator) and l.operator.__class__.__name__ == "Xunion":
@@ -344,7 +414,7 @@ class AwudimaPlanner(object):
                 dependent_join = True
         elif lowSelectivityLeft and lowSelectivityRight and isinstance(l, LeafOperator) and isinstance(r, LeafOperator):
             # both are non-selective and both are Independent Operators
-            n = NodeOperator(Xgjoin(join_variables), all_variables, self.config, r, l, consts, self.query)
+            n = self.make_non_selective_join(join_variables, all_variables, r, l, consts)
 
         if n is None:
             n = NodeOperator(Xgjoin(join_variables), all_variables, self.config, l, r, consts, self.query)
@@ -367,6 +437,13 @@ class AwudimaPlanner(object):
                     n.right.tree.service.limit = 10000  # Fixed value, this can be learnt in the future
         return n
 
+    def make_non_selective_join(self, join_variables, all_variables, l, r, consts):
+        # Xgjoin keeps all the tuples of both (large) inputs in its tables. Under a memory budget,
+        # the hybrid hash join is used instead: it only keeps the smaller input, and partitions both on disk.
+        if self.memory_budget is not None:
+            return NodeOperator(HybridHashJoin(join_variables), all_variables, self.config, l, r, consts, self.query)
+        return NodeOperator(Xgjoin(join_variables), all_variables, self.config, l, r, consts, self.query)
+
     def make_mulder_joins(self, l, r):
         join_variables = l.vars & r.vars
         all_variables = l.vars | r.vars
@@ -470,7 +547,7 @@ class AwudimaPlanner(object):
                 dependent_join = True
         elif lowSelectivityLeft and lowSelectivityRight and isinstance(l, LeafOperator) and isinstance(r,   LeafOperator):
             # both are non-selective and both are Independent Operators
-            n = NodeOperator(Xgjoin(join_variables), all_variables, self.config, r, l, consts, self.query)
+            n = self.make_non_selective_join(join_variables, all_variables, r, l, consts)
 
         if n is None:
             n = NodeOperator(Xgjoin(join_variables), all_variables, self.config, l, r, consts, self.query)
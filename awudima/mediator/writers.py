@@ -0,0 +1,147 @@
+"""
+Serializations of the bindings of a ResultSet, other than SPARQL JSON:
+
+ - SPARQL 1.1 Query Results TSV and CSV formats
+ - Arrow IPC streaming format (columnar, binary), if pyarrow is installed
+
+A binding value is either a SPARQL JSON term, i.e., a dict with 'type' and 'value' (and 'xml:lang' or 'datatype'),
+or a string, as produced by the SPARQL endpoint wrapper: the value itself, with the '^^<datatype>' or '@lang'
+suffix of typed or language tagged literals.
+"""
+
+__author__ = 'Kemele M. Endris'
+
+import io
+import re
+
+MIME_JSON = 'application/sparql-results+json'
+MIME_TSV = 'text/tab-separated-values'
+MIME_CSV = 'text/csv'
+MIME_ARROW = 'application/vnd.apache.arrow.stream'
+
+_iri = re.compile(r'^[A-Za-z][A-Za-z0-9+.\-]*:[^\s<>"{}|\\^`]*$')
+_datatype_suffix = re.compile(r'^(.*)\^\^<([^<>]*)>$', re.DOTALL)
+_lang_suffix = re.compile(r'^(.*)@([A-Za-z]+(-[A-Za-z0-9]+)*)$', re.DOTALL)
+
+
+def arrow_available():
+    try:
+        import pyarrow
+        return True
+    except ImportError:
+        return False
+
+
+def _term(value):
+    # returns (type, value, lang, datatype) of a binding value
+    if isinstance(value, dict):
+        ttype = value.get('type', 'literal')
+        if ttype == 'typed-literal':
+            ttype = 'literal'
+        return ttype, str(value.get('value', '')), value.get('xml:lang'), value.get('datatype')
+
+    value = str(value)
+    if value.startswith('_:'):
+        return 'bnode', value[2:], None, None
+    m = _datatype_suffix.match(value)
+    if m:
+        return 'literal', m.group(1), None, m.group(2)
+    m = _lang_suffix.match(value)
+    if m:
+        return 'literal', m.group(1), m.group(2), None
+    if _iri.match(value):
+        return 'uri', value, None, None
+    return 'literal', value, None, None
+
+
+def _lexical(value):
+    # lexical form of a binding value, blank nodes keep their '_:' prefix
+    ttype, v, lang, datatype = _term(value)
+    if ttype == 'bnode' and not v.startswith('_:'):
+        v = '_:' + v
+    return v
+
+
+def _escape_tsv(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r').replace('\t', '\\t')
+
+
+def tsv_term(value):
+    """
+    :return: the binding value in the TSV format, i.e., an RDF term in Turtle syntax, or '' if unbound
+    """
+    if value is None:
+        return ''
+    ttype, v, lang, datatype = _term(value)
+    if ttype == 'uri':
+        return '<' + v + '>'
+    if ttype == 'bnode':
+        return '_:' + (v[2:] if v.startswith('_:') else v)
+    v = '"' + _escape_tsv(v) + '"'
+    if lang:
+        return v + '@' + lang
+    if datatype:
+        return v + '^^<' + datatype + '>'
+    return v
+
+
+def csv_term(value):
+    """
+    :return: the binding value in the CSV format, i.e., the lexical form of the term (quoted if needed), or ''
+    """
+    if value is None:
+        return ''
+    v = _lexical(value)
+    if any(c in v for c in ',"\r\n'):
+        return '"' + v.replace('"', '""') + '"'
+    return v
+
+
+def tsv_header(vars):
+    return '\t'.join('?' + v for v in vars) + '\n'
+
+
+def tsv_rows(vars, rows):
+    return ''.join('\t'.join(tsv_term(r.get(v)) for v in vars) + '\n' for r in rows)
+
+
+def csv_header(vars):
+    return ','.join(vars) + '\r\n'
+
+
+def csv_rows(vars, rows):
+    return ''.join(','.join(csv_term(r.get(v)) for v in vars) + '\r\n' for r in rows)
+
+
+class ArrowStreamWriter(object):
+    """
+    Writes bindings as record batches of the Arrow IPC streaming format.
+
+    Every variable is a (nullable) string column with the lexical form of the term, as in the CSV format.
+    """
+    def __init__(self, vars):
+        import pyarrow
+        self.pa = pyarrow
+        self.vars = vars
+        self.schema = pyarrow.schema([(v, pyarrow.string()) for v in vars])
+        self.sink = io.BytesIO()
+        self.writer = pyarrow.ipc.new_stream(self.sink, self.schema)
+
+    def _take(self):
+        data = self.sink.getvalue()
+        self.sink.seek(0)
+        self.sink.truncate()
+        return data
+
+    def header(self):
+        return self._take()
+
+    def write(self, rows):
+        columns = [self.pa.array([None if r.get(v) is None else _lexical(r.get(v)) for r in rows], type=self.pa.string())
+                   for v in self.vars]
+        self.writer.write_batch(self.pa.record_batch(columns, schema=self.schema))
+        return self._take()
+
+    def close(self):
+        self.writer.close()
+        return self._take()
@@ -0,0 +1,91 @@
+'''
+Implements the block transport used between the nodes of a physical plan.
+
+Producers put tuples one by one, as before, but they are buffered and sent
+through the underlying queue as blocks (lists) of tuples, so that a block is
+pickled and written to the pipe only once. Consumers get tuples one by one:
+a received block is unpacked locally.
+
+A block is sent when it is full, when "EOF" is put, when flush() is called,
+or when its first tuple has been waiting for flush_timeout seconds. Blocks
+start with one tuple and double up to block_size, so the first results of
+a query are not delayed by batching.
+'''
+from collections import deque
+from multiprocessing import Queue
+from threading import Lock, Timer
+
+# Maximum number of tuples sent in a single block.
+BLOCK_SIZE = 1000
+
+# Maximum time (in seconds) a buffered tuple waits before its block is sent.
+FLUSH_TIMEOUT = 0.05
+
+
+class BlockQueue(object):
+
+    def __init__(self, queue=None, block_size=BLOCK_SIZE, flush_timeout=FLUSH_TIMEOUT):
+        if queue is None:
+            queue = Queue()
+        self.queue = queue
+        self.block_size = block_size
+        self.flush_timeout = flush_timeout
+        self._init_buffers()
+
+    def _init_buffers(self):
+        # Producer side
+        self.buffer = []
+        self.limit = 1
+        self.lock = Lock()
+        self.timer = None
+        # Consumer side
+        self.pending = deque()
+
+    def __getstate__(self):
+        # Buffers are local to the process (producer or consumer) using them.
+        state = self.__dict__.copy()
+        for k in ['buffer', 'limit', 'lock', 'timer', 'pending']:
+            del state[k]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_buffers()
+
+    def __getattr__(self, name):
+        # Exposes the underlying queue (e.g., _reader and watch() for the input multiplexer).
+        if name == 'queue':
+            raise AttributeError(name)
+        return getattr(self.queue, name)
+
+    def put(self, tuple, block=True, timeout=None):
+        with self.lock:
+            self.buffer.append(tuple)
+            if tuple == "EOF" or len(self.buffer) >= self.limit:
+                self._flush()
+            elif self.timer is None:
+                self.timer = Timer(self.flush_timeout, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        # Sends the buffered tuples, if any.
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if len(self.buffer) > 0:
+            self.queue.put(self.buffer)
+            self.buffer = []
+            self.limit = min(self.limit * 2, self.block_size)
+
+    def get(self, block=True, timeout=None):
+        if len(self.pending) == 0:
+            self.pending.extend(self.queue.get(block, timeout))
+        return self.pending.popleft()
+
+    def empty(self):
+        return len(self.pending) == 0 and self.queue.empty()
@@ -5,6 +5,15 @@ from multiprocessing import Queue
 class Join(object):
     __metaclass__ = abc.ABCMeta
 
+    # MemoryBudget of the query, shared by the hash tables of its operators (None for no limit).
+    memory = None
+
+    # Event set when no more results are needed, shared by the operators and wrappers of the query.
+    stopped = None
+
+    # Temporary directory of the query, where the files in secondary memory are created (None for the default).
+    tmpdir = None
+
     @abc.abstractmethod
     def execute(self, left, right, out, processqueue=Queue()):
 
@@ -0,0 +1,62 @@
+'''
+Implements the extraction of the join keys of the tuples, shared by the hash-based operators.
+
+The key of a tuple is a tuple with a value per join variable (in sorted
+order of the variables), i.e., it is hashable and unambiguous: unlike the
+concatenation of the values, ('ab', 'c') is not the same key as ('a', 'bc').
+The value of a variable is its lexical form, with the language tag of
+language tagged literals ('@lang'), or None if the variable is unbound.
+
+Key functions are compiled once per list of join variables, specialized
+for the number and names of the variables, and shared by the operators.
+'''
+from threading import Lock
+
+_functions = {}
+_lock = Lock()
+
+
+def value(val):
+    # Lexical form of a value, as it is compared by the hash-based operators.
+    if val is None or val.__class__ is str:
+        return val
+    if isinstance(val, dict):
+        v = val['value']
+        if isinstance(v, bytes):
+            v = v.decode('utf-8')
+        if "xml:lang" in val:
+            return v + '@' + val['xml:lang']
+        return v
+    return str(val)
+
+
+def key_function(vars):
+    """
+    Returns the key function of the given join variables.
+
+    :param vars: join variables (names without '?')
+    :return: function that returns the join key of a tuple (dict), i.e., a tuple of the values of the variables
+    """
+    vars = tuple(sorted(vars))
+    f = _functions.get(vars)
+    if f is not None:
+        return f
+
+    with _lock:
+        f = _functions.get(vars)
+        if f is None:
+            f = _compile(vars)
+            _functions[vars] = f
+    return f
+
+
+def _compile(vars):
+    # Values that are strings (e.g., as produced by the SPARQL endpoint wrappers) are taken as they are, inline.
+    lines = ['def key(t, _str=str, _value=value):']
+    for i, var in enumerate(vars):
+        lines.append('    v%d = t.get(%r)' % (i, var))
+    lines.append('    return (' + ''.join(['v%d if v%d.__class__ is _str else _value(v%d), ' % (i, i, i)
+                                            for i in range(len(vars))]) + ')')
+    namespace = {'value': value}
+    exec('\n'.join(lines), namespace)
+    return namespace['key']
@@ -0,0 +1,100 @@
+'''
+Implements the memory accountant of the operators of a query.
+
+A MemoryBudget is the main memory (in bytes) granted to the hash tables
+of the join and optional operators of a query. It is created by the
+execution context of the query and shared by all its operators, i.e.,
+by all its worker processes and threads: the bytes in use are kept in
+a shared counter.
+
+Every operator reports the size of the records it inserts in (or
+removes from) its hash tables through its own MemoryAccount. Accounts
+update the shared counter in granules of GRANULE bytes, so that the
+counter (and its lock) is not touched for every tuple. When the budget
+is exceeded, operators move their coldest partitions to secondary memory.
+'''
+import sys
+from multiprocessing import Value
+
+# Bytes an account may add (or free) before it updates the shared counter.
+GRANULE = 1 << 16
+
+# Approximate size (in bytes) of a record of a hash table, without its tuple:
+# the record object, its attributes and its slot in the list of the partition.
+RECORD_OVERHEAD = 160
+
+
+def sizeof(tuple):
+    # Approximate size (in bytes) of a tuple, i.e., of the dict and its values.
+    # Variable names are shared by all the tuples of a query, they are not counted.
+    size = sys.getsizeof(tuple)
+    for val in tuple.values():
+        size += sys.getsizeof(val)
+        if isinstance(val, dict):
+            for v in val.values():
+                size += sys.getsizeof(v)
+    return size
+
+
+class MemoryBudget(object):
+
+    def __init__(self, limit):
+        # Maximum number of bytes used by the hash tables of the query.
+        self.limit = int(limit)
+        self.used = Value('q', 0)
+
+    def update(self, n):
+        with self.used.get_lock():
+            self.used.value += n
+
+    def exceeded(self, pending=0):
+        return self.used.value + pending > self.limit
+
+    def account(self):
+        return MemoryAccount(self)
+
+    def stats(self):
+        return {'limit': self.limit,
+                'used': self.used.value}
+
+
+class MemoryAccount(object):
+    '''
+    Size of the hash tables of one operator, as reported to the MemoryBudget
+    of the query. Without a budget, the account only keeps the size.
+    '''
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.size = 0
+        self.pending = 0
+
+    def add(self, n):
+        self.size += n
+        if self.budget is not None:
+            self.pending += n
+            if self.pending >= GRANULE:
+                self.flush()
+
+    def free(self, n):
+        self.size -= n
+        if self.budget is not None:
+            self.pending -= n
+            if self.pending <= -GRANULE:
+                self.flush()
+
+    def flush(self):
+        if self.budget is not None and self.pending != 0:
+            self.budget.update(self.pending)
+            self.pending = 0
+
+    def exceeded(self):
+        # True if the bytes used by the query (including those not yet reported by this account) exceed the budget.
+        if self.budget is None or self.size == 0:
+            return False
+        return self.budget.exceeded(self.pending)
+
+    def close(self):
+        # Gives back all the bytes of the operator to the budget.
+        self.free(self.size)
+        self.flush()
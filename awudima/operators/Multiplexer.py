@@ -0,0 +1,186 @@
+'''
+Implements the input multiplexer shared by the binary operators.
+
+Instead of spinning on non-blocking gets over each of their input queues,
+the operators ask the multiplexer for the next available tuple. The calling
+process (or thread) sleeps until at least one of its inputs has data.
+'''
+from multiprocessing.connection import wait
+from queue import Empty, Queue
+from threading import Event
+from time import time, sleep
+
+# Upper bound (in seconds) of a single wait on the inputs. Longer timeouts are
+# split into several waits, since poll(2) only accepts timeouts up to INT_MAX ms.
+MAX_WAIT = 3600
+
+# Bounds (in seconds) of the back-off used for inputs that are not selectable.
+MIN_BACKOFF = 0.001
+MAX_BACKOFF = 0.05
+
+# Interval (in seconds) at which a waiting multiplexer checks whether the query is stopped.
+STOP_INTERVAL = 0.5
+
+
+class ThreadQueue(Queue):
+    '''
+    In-memory queue used between operators running as threads of the same
+    process. Besides the queue.Queue interface, it wakes up the multiplexers
+    (events) watching it whenever a tuple is put.
+    '''
+
+    def __init__(self, maxsize=0):
+        super(ThreadQueue, self).__init__(maxsize)
+        self.watchers = []
+
+    def watch(self, event):
+        with self.mutex:
+            self.watchers.append(event)
+            if self._qsize() > 0:
+                event.set()
+
+    def unwatch(self, event):
+        with self.mutex:
+            if event in self.watchers:
+                self.watchers.remove(event)
+
+    def _put(self, item):
+        # Called by put() while holding the queue mutex.
+        super(ThreadQueue, self)._put(item)
+        for event in self.watchers:
+            event.set()
+
+
+class InputMultiplexer(object):
+    '''
+    Merges a set of input queues into a single stream of (key, tuple) pairs.
+
+    Inputs are identified by a key: positional inputs given to the constructor
+    get their index as key (i.e., 0 for left and 1 for right), other inputs can
+    be added at any time with add(key, queue). Inputs are served round-robin,
+    so a fast input does not starve a slow one. The "EOF" of an input is
+    returned as any other tuple, and the input is removed afterwards.
+    An input can be paused (e.g., to apply backpressure to it): it is not
+    read until it is resumed, but it still counts as an input.
+    Once the stopped event (of the query) is set, inputs without data are
+    finished: their "EOF" is returned, so that the operator exits even if
+    the workers feeding them were never started or are gone.
+    '''
+
+    def __init__(self, *queues, stopped=None):
+        self.inputs = {}
+        self.order = []
+        self.next = 0
+        self.paused = set()
+        self.event = Event()
+        self.stopped = stopped
+        for key, queue in enumerate(queues):
+            if queue is not None:
+                self.add(key, queue)
+
+    def __len__(self):
+        # Number of inputs that have not sent their EOF yet.
+        return len(self.inputs)
+
+    def add(self, key, queue):
+        self.inputs[key] = queue
+        self.order.append(key)
+        if hasattr(queue, 'watch'):
+            queue.watch(self.event)
+
+    def remove(self, key):
+        if key in self.inputs:
+            i = self.order.index(key)
+            if hasattr(self.inputs[key], 'unwatch'):
+                self.inputs[key].unwatch(self.event)
+            del self.inputs[key]
+            self.paused.discard(key)
+            del self.order[i]
+            if i < self.next:
+                self.next -= 1
+            if self.next >= len(self.order):
+                self.next = 0
+
+    def pause(self, key):
+        # Tuples of a paused input are not read. The caller must resume it while other inputs are running.
+        if key in self.inputs and key not in self.paused:
+            self.paused.add(key)
+            if hasattr(self.inputs[key], 'unwatch'):
+                self.inputs[key].unwatch(self.event)
+
+    def resume(self, key):
+        if key in self.paused:
+            self.paused.remove(key)
+            if hasattr(self.inputs[key], 'watch'):
+                self.inputs[key].watch(self.event)
+
+    def get(self, timeout=None):
+        '''
+        Returns the next (key, tuple) pair available in any of the inputs.
+        Blocks until a tuple arrives, or until timeout (in seconds) expires.
+        Returns None if the timeout expires or if there are no inputs left.
+        '''
+        deadline = None if timeout is None else time() + timeout
+        backoff = MIN_BACKOFF
+        while self.inputs:
+            self.event.clear()
+            item = self.poll()
+            if item is not None:
+                return item
+
+            if self.stopped is not None and self.stopped.is_set():
+                # The query is stopped: no more tuples are expected from the inputs.
+                key = self.order[self.next % len(self.order)]
+                self.remove(key)
+                return key, "EOF"
+
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time()
+                if remaining <= 0:
+                    return None
+
+            if self.stopped is not None:
+                remaining = STOP_INTERVAL if remaining is None else min(remaining, STOP_INTERVAL)
+            if not self.wait(remaining):
+                # Inputs are not selectable: sleep instead of spinning.
+                if remaining is not None:
+                    backoff = min(backoff, remaining)
+                sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
+        return None
+
+    def poll(self):
+        # Non-blocking round over the inputs, starting after the last served one.
+        n = len(self.order)
+        for i in range(n):
+            key = self.order[(self.next + i) % n]
+            if key in self.paused:
+                continue
+            try:
+                tuple = self.inputs[key].get(False)
+            except Empty:
+                continue
+            self.next = (self.next + i + 1) % n
+            if tuple == "EOF":
+                self.remove(key)
+            return key, tuple
+        return None
+
+    def wait(self, timeout):
+        # Sleeps until one of the inputs becomes readable.
+        # Returns False if the inputs cannot be waited on.
+        if timeout is not None:
+            timeout = min(timeout, MAX_WAIT)
+
+        queues = [queue for key, queue in self.inputs.items() if key not in self.paused]
+        if all(hasattr(queue, 'watch') for queue in queues):
+            # In-memory queues set the event when a tuple is put.
+            self.event.wait(timeout)
+            return True
+
+        readers = [getattr(queue, '_reader', None) for queue in queues]
+        if None in readers:
+            return False
+        wait(readers, timeout)
+        return True
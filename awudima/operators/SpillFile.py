@@ -0,0 +1,79 @@
+'''
+Implements the secondary memory of the operators, e.g., the RJTs flushed by Xgjoin.
+
+A SpillFile is an append-only temporary file, created in the temporary
+directory of the query. Partitions (e.g., the RJT of a resource) are
+appended to it as segments: a list of records, pickled and prefixed by
+its length. The offsets of the segments of every partition are kept in
+main memory, so a partition is read back with one sequential, buffered
+read per segment, and is never rewritten.
+'''
+import pickle
+import struct
+from tempfile import TemporaryFile
+
+# Length prefix of a segment.
+HEADER = struct.Struct('<I')
+
+# Size (in bytes) of the buffers of the spill file.
+BUFFER_SIZE = 1 << 20
+
+
+class SpillFile(object):
+
+    def __init__(self, suffix='.spill', dir=None):
+        self.suffix = suffix
+        # Temporary directory of the query (None for the default temporary directory).
+        self.dir = dir
+        self.file = None
+        self.end = 0
+        # key -> list of (offset, length) of its segments, in order of appending
+        self.segments = {}
+
+    def __contains__(self, key):
+        return key in self.segments
+
+    def __len__(self):
+        return len(self.segments)
+
+    def keys(self):
+        return self.segments.keys()
+
+    def append(self, key, records):
+        # Appends the records to the partition of the key.
+        if self.file is None:
+            self.file = TemporaryFile(suffix=self.suffix, dir=self.dir, buffering=BUFFER_SIZE)
+
+        data = pickle.dumps(records, protocol=pickle.HIGHEST_PROTOCOL)
+        self.file.seek(self.end)
+        self.file.write(HEADER.pack(len(data)))
+        self.file.write(data)
+        self.segments.setdefault(key, []).append((self.end + HEADER.size, len(data)))
+        self.end += HEADER.size + len(data)
+
+    def read(self, key):
+        # Returns the records of the partition of the key.
+        records = []
+        for offset, length in self.segments.get(key, []):
+            self.file.seek(offset)
+            records.extend(pickle.loads(self.file.read(length)))
+        return records
+
+    def scan(self, key):
+        # Yields the records of the partition of the key, one segment at a time.
+        for offset, length in self.segments.get(key, []):
+            self.file.seek(offset)
+            for record in pickle.loads(self.file.read(length)):
+                yield record
+
+    def remove(self, key):
+        # Forgets the partition of the key. Its segments are reclaimed when the file is closed.
+        self.segments.pop(key, None)
+
+    def close(self):
+        # Closes (and deletes) the file.
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.segments = {}
+        self.end = 0
@@ -5,6 +5,9 @@ from multiprocessing import Queue
 class _Union(object):
     __metaclass__ = abc.ABCMeta
 
+    # Event set when no more results are needed, shared by the operators and wrappers of the query.
+    stopped = None
+
     @abc.abstractmethod
     def execute(self, left, right, out, processqueue=Queue()):
 
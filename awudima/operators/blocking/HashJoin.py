@@ -10,6 +10,8 @@ work until all the tuples are arrived.
 from time import time
 from awudima.operators.blocking.OperatorStructures import Table, Record
 from awudima.operators.Join import Join
+from awudima.operators.JoinKey import key_function
+from awudima.operators.Multiplexer import InputMultiplexer
 from multiprocessing import Queue
 
 
@@ -30,34 +32,16 @@ class HashJoin(Join):
         self.left = []
         self.right = []
         self.qresults = out
+        self.key = key_function(self.vars)
 
-        # Initialize tuples.
-        tuple1 = None
-        tuple2 = None
+        # Multiplex both inputs: sleep until one of them sends data.
+        inputs = InputMultiplexer(qleft, qright, stopped=self.stopped)
+        sides = [self.left, self.right]
 
         # Get the tuples from the queues.
-        while (not(tuple1 == "EOF") or not(tuple2 == "EOF")):
-            # Try to get tuple from left queue.
-            if not(tuple1 == "EOF"):
-                try:
-                    tuple1 = qleft.get(False)
-                    #print tuple1
-                    self.left.append(tuple1)
-                except Exception:
-                    # This catch:
-                    # Empty: in tuple2 = self.left.get(False), when the queue is empty.
-                    pass
-
-            # Try to get tuple from right queue.
-            if not(tuple2 == "EOF"):
-                try:
-                    tuple2 = qright.get(False)
-                    #print tuple2
-                    self.right.append(tuple2)
-                except Exception:
-                    # This catch:
-                    # Empty: in tuple2 = self.right.get(False), when the queue is empty.
-                    pass
+        while len(inputs) > 0:
+            (side, tuple) = inputs.get()
+            sides[side].append(tuple)
 
         # Get the variables to join.
         if ((len(self.left) > 1) and (len(self.right) > 1)):
@@ -78,11 +62,8 @@ class HashJoin(Join):
     def insertAndProbe(self, tuple, table1, table2):
         # Insert the tuple in its corresponding partition and probe.
         #print tuple
-        # Get the attribute(s) to apply hash.
-        att = ''
-        for var in self.vars:
-            att = att + tuple[var]
-        i = hash(att) % table1.size
+        # Get the join key to apply hash.
+        i = hash(self.key(tuple)) % table1.size
 
         # Insert record in partition.
         record = Record(tuple, time(), 0)
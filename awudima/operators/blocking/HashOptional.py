@@ -9,6 +9,7 @@ work until all the tuples are arrived.
 '''
 from time import time
 from awudima.operators.Optional import Optional
+from awudima.operators.JoinKey import key_function
 from awudima.operators.blocking.OperatorStructures import Table, Record
 
 
@@ -35,6 +36,7 @@ class HashOptional(Optional):
         self.left = []
         self.right = []
         self.qresults = out
+        self.key = key_function(self.vars)
 
         # Initialize tuples.
         tuple1 = None
@@ -94,11 +96,8 @@ class HashOptional(Optional):
     def insertAndProbe(self, tuple, table1, table2):
         # Insert the tuple in its corresponding partition and probe.
 
-        # Get the attribute(s) to apply hash.
-        att = ''
-        for var in self.vars:
-            att = att + tuple[var]
-        i = hash(att) % table1.size;
+        # Get the join key to apply hash.
+        i = hash(self.key(tuple)) % table1.size
 
         # Insert record in partition.
         record = Record(tuple, time(), 0)
@@ -0,0 +1,201 @@
+'''
+Implements a Hybrid Hash Join operator.
+
+Both inputs are partitioned by the hash of their join key. Partitions are
+kept in main memory until the memory of the operator (or the memory budget
+of the query) is exceeded, then the largest partitions are moved to
+secondary memory, for both inputs (grace hash join).
+
+The input that sends its EOF first is taken as the smaller one, i.e., the
+build input: hash tables are built on its partitions in main memory, and
+the tuples of the other (probe) input are streamed against them. Probe
+tuples of partitions in secondary memory are appended to their partition,
+which is joined once both inputs are finished, building on its smaller side.
+'''
+from multiprocessing import Queue
+from awudima.operators.Join import Join
+from awudima.operators.JoinKey import key_function
+from awudima.operators.Multiplexer import InputMultiplexer
+from awudima.operators.SpillFile import SpillFile
+from awudima.operators.MemoryBudget import MemoryAccount, sizeof, RECORD_OVERHEAD
+
+# Number of partitions of the inputs.
+PARTITIONS = 16
+
+# Main memory (in bytes) of the operator, if the query has no memory budget.
+MEMORY_SIZE = 1 << 28
+
+# Number of tuples of a partition in secondary memory that are buffered before they are appended to its file.
+BLOCK_SIZE = 1000
+
+
+class HybridHashJoin(Join):
+
+    def __init__(self, vars, partitions=PARTITIONS):
+        self.vars = vars
+        self.qresults = Queue()
+        self.partitions = partitions
+        self.memorySize = MEMORY_SIZE
+        self.account = MemoryAccount()
+
+    def instantiate(self, d):
+        newvars = self.vars - set(d.keys())
+        return HybridHashJoin(newvars, self.partitions)
+
+    def instantiateFilter(self, instantiated_vars, filter_str):
+        newvars = self.vars - set(instantiated_vars)
+        return HybridHashJoin(newvars, self.partitions)
+
+    def execute(self, qleft, qright, out, processqueue=Queue()):
+        # Executes the Hybrid Hash Join.
+        self.qresults = out
+        self.key = key_function(self.vars)
+        self.account = MemoryAccount(self.memory)
+        self.spill = SpillFile('.hj', self.tmpdir)
+
+        # Tuples (and their keys) of every partition of both inputs, in main memory.
+        # Partitions in secondary memory only buffer up to BLOCK_SIZE tuples.
+        self.buffers = [[[] for i in range(self.partitions)] for side in range(2)]
+        self.sizes = [0] * self.partitions
+        self.spilled = [False] * self.partitions
+        # Hash tables of the partitions of the build input in main memory.
+        self.build = None
+        self.tables = [None] * self.partitions
+
+        # Multiplex both inputs: sleep until one of them sends data.
+        inputs = InputMultiplexer(qleft, qright, stopped=self.stopped)
+
+        # Get the tuples from the queues.
+        while len(inputs) > 0:
+            (side, tuple) = inputs.get()
+            if tuple == "EOF":
+                if self.build is None:
+                    # The first finished input is the build input.
+                    self.buildTables(side)
+                continue
+
+            try:
+                self.insert(side, tuple)
+            except Exception as e:
+                print("Exception in HybridHashJoin, while inserting the tuple", tuple, e)
+
+            if self.exceeded():
+                self.spillPartition()
+
+        # Join the partitions in secondary memory.
+        for i in range(self.partitions):
+            if self.spilled[i]:
+                self.joinSpilled(i)
+
+        self.spill.close()
+        self.account.close()
+
+        # Put EOF in queue and exit.
+        self.qresults.put("EOF")
+
+    def insert(self, side, tuple):
+        key = self.key(tuple)
+        i = hash(key) % self.partitions
+
+        if side != self.build and self.tables[i] is not None:
+            # The build partition is in main memory: probe the tuple right away.
+            self.probe(side, key, tuple, self.tables[i])
+            return
+
+        # Otherwise, keep the tuple in its partition (until the build input is finished, or in secondary memory).
+        size = sizeof(tuple) + RECORD_OVERHEAD
+        buffer = self.buffers[side][i]
+        buffer.append((key, tuple))
+        self.sizes[i] += size
+        self.account.add(size)
+        if self.spilled[i] and len(buffer) >= BLOCK_SIZE:
+            self.flushBuffer(side, i)
+
+    def probe(self, side, key, tuple, table):
+        # Join the tuple with the tuples of the other input with the same key.
+        for other in table.get(key, []):
+            if side == 0:
+                res = tuple.copy()
+                res.update(other)
+            else:
+                res = other.copy()
+                res.update(tuple)
+            self.qresults.put(res)
+
+    def buildTables(self, build):
+        # Builds the hash tables on the partitions of the build input in main memory,
+        # and probes the tuples of the probe input received so far against them.
+        self.build = build
+        probe = 1 - build
+        for i in range(self.partitions):
+            if self.spilled[i]:
+                continue
+            table = dict()
+            for (key, tuple) in self.buffers[build][i]:
+                table.setdefault(key, []).append(tuple)
+            self.tables[i] = table
+            self.buffers[build][i] = []
+
+            size = 0
+            for (key, tuple) in self.buffers[probe][i]:
+                self.probe(probe, key, tuple, table)
+                size += sizeof(tuple) + RECORD_OVERHEAD
+            self.buffers[probe][i] = []
+            self.sizes[i] -= size
+            self.account.free(size)
+
+    def exceeded(self):
+        return self.account.size > self.memorySize or self.account.exceeded()
+
+    def spillPartition(self):
+        # Moves the largest partition in main memory (of both inputs) to secondary memory.
+        # If all the partitions are in secondary memory already, their buffers are flushed.
+        candidates = [i for i in range(self.partitions) if not self.spilled[i]]
+        if not candidates:
+            for i in range(self.partitions):
+                for side in range(2):
+                    self.flushBuffer(side, i)
+            return
+
+        i = max(candidates, key=lambda i: self.sizes[i])
+        self.spilled[i] = True
+        if self.tables[i] is not None:
+            # The partition of the build input is already a hash table.
+            self.buffers[self.build][i] = [(key, tuple) for key, tuples in self.tables[i].items() for tuple in tuples]
+            self.tables[i] = None
+        for side in range(2):
+            self.flushBuffer(side, i)
+
+    def flushBuffer(self, side, i):
+        # Appends the buffered tuples of the partition i of an input to secondary memory.
+        buffer = self.buffers[side][i]
+        if not buffer:
+            return
+        self.spill.append((side, i), buffer)
+        size = sum([sizeof(tuple) + RECORD_OVERHEAD for (key, tuple) in buffer])
+        self.buffers[side][i] = []
+        self.sizes[i] -= size
+        self.account.free(size)
+
+    def joinSpilled(self, i):
+        # Joins the partition i of both inputs, building a hash table on its smaller side.
+        for side in range(2):
+            self.flushBuffer(side, i)
+        sizes = [sum([length for (offset, length) in self.spill.segments.get((side, i), [])]) for side in range(2)]
+        build = 0 if sizes[0] <= sizes[1] else 1
+
+        table = dict()
+        size = 0
+        for (key, tuple) in self.spill.scan((build, i)):
+            table.setdefault(key, []).append(tuple)
+            size += sizeof(tuple) + RECORD_OVERHEAD
+        self.account.add(size)
+
+        if table:
+            for (key, tuple) in self.spill.scan((1 - build, i)):
+                self.probe(1 - build, key, tuple, table)
+
+        self.spill.remove((0, i))
+        self.spill.remove((1, i))
+        self.account.free(size)
+
@@ -17,6 +17,7 @@ from time import time
 from queue import Empty
 
 from awudima.operators.Join import Join
+from awudima.operators.JoinKey import key_function
 from awudima.operators.GJOperatorStructures import NHJRecord
 
 WINDOW_SIZE = 20
@@ -45,6 +46,7 @@ class NestedHashJoinFilter(Join):
         self.left_queue = left_queue
         self.right_operator = right_operator
         self.qresults = out
+        self.key = key_function(self.vars)
         # print "right_operator", right_operator
         tuple1 = None
         tuple2 = None
@@ -71,7 +73,7 @@ class NestedHashJoinFilter(Join):
                         new_right_operator = self.makeInstantiation(filter_bag,
                                                                     self.right_operator)
                         # print "Here in makeInstantation with filter"
-                        # resource = self.getResource(tuple1)
+                        # resource = self.key(tuple1)
                         queue = Queue()
                         right_queues[count] = queue
                         new_right_operator.execute(queue)
@@ -83,7 +85,7 @@ class NestedHashJoinFilter(Join):
                         # print "here", len(filter_bag), filter_bag
                         new_right_operator = self.makeInstantiation(filter_bag,
                                                                     self.right_operator)
-                        # resource = self.getResource(tuple1)
+                        # resource = self.key(tuple1)
                         queue = Queue()
                         right_queues[count] = queue
                         new_right_operator.execute(queue)
@@ -109,7 +111,7 @@ class NestedHashJoinFilter(Join):
                         if tuple2 == "EOF":
                             toRemove.append(r)
                         else:
-                            resource = self.getResource(tuple2)
+                            resource = self.key(tuple2)
                             for v in self.vars:
                                 del tuple2[v]
                             # print "new tuple2", tuple2
@@ -128,43 +130,6 @@ class NestedHashJoinFilter(Join):
         self.qresults.put("EOF")
         return
 
-    def getResource(self, tuple):
-        resource = ''
-        for var in self.vars:
-            # val = tuple[var]
-            # if "^^<" in val:
-            #     val = val[:val.find('^^<')]
-            # resource = resource + val
-            if var in tuple:
-                val = tuple[var]
-                # if isinstance(val, dict) and 'value' in val:
-                #     val = val['value']
-
-                suffix = ''
-                # if 'datatype' in val:
-                #     if isinstance(val['datatype'], bytes):
-                #         suffix = "^^<" + val['datatype'].decode('utf-8') + ">"
-                #     else:
-                #         suffix = "^^<" + val['datatype'] + ">"
-                #
-                if isinstance(val, dict):
-
-                    if "xml:lang" in val:
-                        suffix = '@' + val['xml:lang']
-                    try:
-                        if isinstance(val['value'], bytes):
-                            val = val['value'].decode('utf-8') + suffix
-                        else:
-                            val = val['value'] + suffix
-                    except:
-                        val = val['value'] + suffix
-
-                # if "^^<" in val:
-                #     val = val[:val.find('^^<')]
-                resource = resource + str(val)
-
-        return resource
-
     def makeInstantiation(self, filter_bag, operators):
         filter_str = ''
         new_vars = ['?' + v for v in self.vars]  # TODO: this might be $
@@ -447,7 +412,7 @@ class NestedHashJoinFilter(Join):
     def probeAndInsert1(self, tuple, table1, table2, time):
         #print "in probeAndInsert1", tuple
         record = NHJRecord(tuple, time, 0)
-        r = self.getResource(tuple)
+        r = self.key(tuple)
         #print "resource", r, tuple
         if r in table1:
             records = table1[r]
@@ -9,6 +9,7 @@ The intermediate results are represented as queues.
 from multiprocessing import Queue
 from time import time
 from awudima.operators.Join import Join
+from awudima.operators.JoinKey import key_function
 from awudima.operators.GJOperatorStructures import NHJTable, NHJRecord
 
 
@@ -31,6 +32,7 @@ class SymmetricHashJoin(Join):
         self.left = left
         self.right = right
         self.qresults = out
+        self.key = key_function(self.vars)
 
         # Initialize tuples.
         tuple1 = None
@@ -78,11 +80,8 @@ class SymmetricHashJoin(Join):
     def insertAndProbe(self, tuple, input, table1, table2):
         # Insert the tuple in its corresponding partition and probe.
 
-        # Get the attribute(s) to apply hash.
-        att = ''
-        for var in self.vars:
-            att = att + tuple[var]
-        i = hash(att) % table1.size
+        # Get the join key to apply hash.
+        i = hash(self.key(tuple)) % table1.size
 
         # Insert record in partition.
         record = NHJRecord(tuple, time(), 0)
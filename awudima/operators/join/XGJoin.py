@@ -19,6 +19,7 @@ from tempfile import NamedTemporaryFile
 from os import remove
 
 from awudima.operators.Join import Join
+from awudima.operators.JoinKey import key_function
 from awudima.operators.GJOperatorStructures import Record, RJTTail, FileDescriptor
 
 
@@ -60,6 +61,7 @@ class Xgjoin(Join):
         self.left = left
         self.right = right
         self.qresults = out
+        self.key = key_function(self.vars)
 
         # Initialize tuples.
         tuple1 = None
@@ -128,35 +130,8 @@ class Xgjoin(Join):
     def stage1(self, tuple, tuple_rjttable, other_rjttable):
         #print " Stage 1: While one of the sources is sending data."
         if tuple != "EOF":
-            # Get the resource associated to the tuples.
-            resource = ''
-            for var in self.vars:
-                if var in tuple:
-                    val = tuple[var]
-                    # if isinstance(val, dict) and 'value' in val:
-                    #     val = val['value']
-
-                    suffix = ''
-                    # if 'datatype' in val:
-                    #     if isinstance(val['datatype'], bytes):
-                    #         suffix = "^^<" + val['datatype'].decode('utf-8') + ">"
-                    #     else:
-                    #         suffix = "^^<" + val['datatype'] + ">"
-                    #
-                    if isinstance(val, dict):
-
-                        if "xml:lang" in val:
-                            suffix = '@' + val['xml:lang']
-                        try:
-                            if isinstance(val['value'], bytes):
-                                val = val['value'].decode('utf-8') + suffix
-                            else:
-                                val = val['value'] + suffix
-                        except:
-                            val = val['value'] + suffix
-                    # if "^^<" in val:
-                    #     val = val[:val.find('^^<')]
-                    resource = resource + str(val)
+            # Get the join key of the tuple.
+            resource = self.key(tuple)
 
             # Probe the tuple against its RJT table.
             probeTS = self.probe(tuple, resource, tuple_rjttable)
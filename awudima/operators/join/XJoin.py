@@ -13,6 +13,7 @@ from threading import Timer
 from random import randint
 from os import remove
 from awudima.operators.Join import Join
+from awudima.operators.JoinKey import key_function
 from awudima.operators.GJOperatorStructures import NHJTable, NHJPartition, NHJRecord, NHJFileDescriptor, isOverlapped
 
 
@@ -46,6 +47,7 @@ class XJoin(Join):
         self.left     = left
         self.right    = right
         self.qresults = out
+        self.key      = key_function(self.vars)
 
         # Initialize tuples.
         tuple1 = None
@@ -109,11 +111,8 @@ class XJoin(Join):
     def stage1(self, tuple, input, table1, table2):
         # Stage 1: While both sources are sending data.
 
-        # Get the attribute(s) to apply hash.
-        att = ''
-        for var in self.vars:
-            att = att + tuple[var]
-        i = hash(att) % table1.size
+        # Get the join key to apply hash.
+        i = hash(self.key(tuple)) % table1.size
 
         # Insert record in partition.
         #record = Record(tuple, time(), 0)
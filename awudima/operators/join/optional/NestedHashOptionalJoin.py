@@ -13,6 +13,7 @@ from time import time
 import string
 from queue import Empty
 from awudima.operators.Optional import Optional
+from awudima.operators.JoinKey import key_function
 from awudima.operators.GJOperatorStructures import NHJRecord
 
 
@@ -37,6 +38,7 @@ class NestedHashOptionalJoin(Optional):
         self.left_queue = left_queue
         self.right_operator = right_operator
         self.qresults = out
+        self.key = key_function(self.vars)
 
         tuple1 = None
         tuple2 = None
@@ -61,7 +63,7 @@ class NestedHashOptionalJoin(Optional):
                         new_right_operator = self.makeInstantiation(tuple1,
                                                                     self.right_operator)
                         # print "new op: "+str(new_right_operator)
-                        resource = self.getResource(tuple1)
+                        resource = self.key(tuple1)
                         queue = Queue()
                         right_queues[resource] = queue
                         # print "new_right_operator.__class__", new_right_operator.__class__
@@ -113,12 +115,6 @@ class NestedHashOptionalJoin(Optional):
         self.qresults.put("EOF")
         # return
 
-    def getResource(self, tuple):
-        resource = ''
-        for var in self.vars:
-            resource = resource + tuple[var]
-        return resource
-
     def makeInstantiation(self, tuple, operator):
         # print "making instantiation", tuple, operator
         d = {}
@@ -137,7 +133,7 @@ class NestedHashOptionalJoin(Optional):
     def probeAndInsert1(self, tuple, table1, table2, time):
         # print "probeAndInsert1", tuple
         record = Record(tuple, time, 0)
-        r = self.getResource(tuple)
+        r = self.key(tuple)
         if r in table1:
             records = table1[r]
             for t in records:
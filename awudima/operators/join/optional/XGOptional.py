@@ -9,6 +9,7 @@ The intermediate results are represented as queues.
 from multiprocessing import Queue
 from time import time
 from awudima.operators.Optional import Optional
+from awudima.operators.JoinKey import key_function
 from awudima.operators.GJOperatorStructures import Record, RJTTail
 
 
@@ -39,6 +40,7 @@ class Xgoptional(Optional):
         self.left = left
         self.right = right
         self.qresults = out
+        self.key = key_function(self.vars)
 
         # Initialize tuples.
         tuple1 = None
@@ -82,37 +84,8 @@ class Xgoptional(Optional):
     def stage1(self, tuple, tuple_rjttable, other_rjttable, vars):
         # Stage 1: While one of the sources is sending data.
         #print "stage 1"
-        # Get the resource associated to the tuples.
-        resource = ''
-        for var in self.vars:
-            if var in tuple:
-                val = tuple[var]
-                # if isinstance(val, dict) and 'value' in val:
-                #     val = val['value']
-
-                suffix = ''
-                # if 'datatype' in val:
-                #     if isinstance(val['datatype'], bytes):
-                #         suffix = "^^<" + val['datatype'].decode('utf-8') + ">"
-                #     else:
-                #         suffix = "^^<" + val['datatype'] + ">"
-                #
-                if isinstance(val, dict):
-
-                    if "xml:lang" in val:
-                        suffix = '@' + val['xml:lang']
-                    try:
-                        if isinstance(val['value'], bytes):
-                            val = val['value'].decode('utf-8') + suffix
-                        else:
-                            val = val['value'] + suffix
-                    except:
-                        val = val['value'] + suffix
-                # if "^^<" in val:
-                #     val = val[:val.find('^^<')]
-                resource = resource + str(val)
-
-            #resource = resource + tuple[var]
+        # Get the join key of the tuple.
+        resource = self.key(tuple)
 
         #print "probe"
         # Probe the tuple against its RJT table.
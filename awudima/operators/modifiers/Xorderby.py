@@ -4,95 +4,205 @@ Created on Mar 03, 2014
 Implements the Xorderby operator.
 The intermediate results are represented in a queue.
 
+Tuples are sorted once, by a composite key with the sort key of every
+ORDER BY condition, in the order of the SPARQL specification: unbound
+variables, blank nodes, IRIs and literals; numerical and dateTime literals
+are compared by value. Tuples with the same key keep their input order.
+
+If the tuples exceed the memory of the operator (or the memory budget of
+the query), sorted runs are written to secondary memory and merged at the
+end (external merge sort). If only the first k tuples are needed (ORDER BY
+with LIMIT), only the k smallest tuples are kept, in a heap.
+
 @author: Maribel Acosta Deibe
 '''
 from multiprocessing import Queue
 import datetime
-
-data_types = {
-    'integer': (int, 'numerical'),
-    'decimal': (float, 'numerical'),
-    'float': (float, 'numerical'),
-    'double': (float, 'numerical'),
-    'string': (str, str),
-    'boolean': (bool, bool),
-    'dateTime': (datetime, datetime),
-    'nonPositiveInteger': (int, 'numerical'),
-    'negativeInteger': (int, 'numerical'),
-    'long': (int, 'numerical'),
-    'int': (int, 'numerical'),
-    'short': (int, 'numerical'),
-    'byte': (bytes, bytes),
-    'nonNegativeInteger': (int, 'numerical'),
-    'unsignedLong': (int, 'numerical'),
-    'unsignedInt': (int, 'numerical'),
-    'unsignedShort': (int, 'numerical'),
-    'unsignedByte': (bytes, bytes),  # TODO: this is not correct
-    'positiveInteger': (int, 'numerical')
-}
+import heapq
+import re
+from awudima.operators.SpillFile import SpillFile
+from awudima.operators.MemoryBudget import MemoryAccount, sizeof, RECORD_OVERHEAD
+from awudima.operators.nonblocking.Xfilter import datatype, xsd_datetime
+from awudima.pysparql import Argument
+
+# Main memory (in bytes) of the operator, if the query has no memory budget.
+MEMORY_SIZE = 1 << 28
+
+# Number of tuples of a sorted run in a segment of the spill file, i.e., read at once when the runs are merged.
+BLOCK_SIZE = 1000
+
+# Maximum number of tuples kept by the top-k sort; if more tuples are needed, all of them are sorted.
+MAX_TOP_K = 100000
+
+_iri = re.compile(r'^[A-Za-z][A-Za-z0-9+.\-]*:[^\s<>"{}|\\^`]*$')
+
+_epoch = datetime.datetime(1970, 1, 1)
+
+# Ranks of the terms, and of the literals.
+UNBOUND, BNODE, IRI, LITERAL = 0, 1, 2, 3
+NUMERICAL, DATETIME, OTHER = 0, 1, 2
+
+
+class Descending(object):
+    # Value compared in reverse order, for the DESC conditions with values that cannot be negated (e.g., strings).
+    __slots__ = ['value']
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __getstate__(self):
+        return self.value
+
+    def __setstate__(self, value):
+        self.value = value
+
+
+def term_key(val):
+    '''
+    Sort key of a value (as in the tuples of the operators) in ascending order.
+
+    :param val: value of a variable: a string (with the '^^<datatype>' or '@lang' suffix of literals),
+                a SPARQL JSON term (dict), or None or '' if the variable is unbound
+    :return: (rank, literal rank, value, suffix)
+    '''
+    if val is None or val == '':
+        return (UNBOUND, 0, '', '')
+    if isinstance(val, dict):
+        ttype = val.get('type', 'literal')
+        value = str(val.get('value', ''))
+        if ttype == 'bnode':
+            return (BNODE, 0, value, '')
+        if ttype == 'uri':
+            return (IRI, 0, value, '')
+        if 'datatype' in val:
+            return literal_key(value, val['datatype'])
+        return (LITERAL, OTHER, value, val.get('xml:lang', ''))
+
+    val = str(val)
+    if val.startswith('_:'):
+        return (BNODE, 0, val[2:], '')
+    pos = val.find('^^')
+    if pos > -1:
+        return literal_key(val[:pos], val[pos + 2:])
+    if _iri.match(val):
+        return (IRI, 0, val, '')
+    return (LITERAL, OTHER, val, '')
+
+
+def literal_key(value, dt):
+    # Sort key of a typed literal: numerical and dateTime literals are compared by value.
+    types = datatype('^^' + dt)
+    try:
+        if types is not None and types[1] == 'numerical':
+            return (LITERAL, NUMERICAL, types[0](value), '')
+        if types is not None and types[0] == xsd_datetime:
+            return (LITERAL, DATETIME, (xsd_datetime(value) - _epoch) // datetime.timedelta(microseconds=1), '')
+    except Exception:
+        pass
+    return (LITERAL, OTHER, value, dt)
+
+
+def descending_key(key):
+    (rank, literal_rank, value, suffix) = key
+    if isinstance(value, str):
+        value = Descending(value)
+    else:
+        value = -value
+    return (-rank, -literal_rank, value, Descending(suffix))
 
 
 class Xorderby(object):
 
-    def __init__(self, args):
+    # MemoryBudget of the query, shared by the operators (None for no limit).
+    memory = None
+
+    # Temporary directory of the query, where the files in secondary memory are created (None for the default).
+    tmpdir = None
+
+    def __init__(self, args, limit=-1):
         self.input = Queue()
         self.qresults = Queue()
-        self.args = args  # List of type Argument.
+        self.args = args  # List of type Argument (or of Expression with an Argument, e.g., str(?x)).
+        # Number of tuples that are needed (e.g., LIMIT + OFFSET), -1 for all.
+        self.limit = int(limit)
+        self.memorySize = MEMORY_SIZE
+        self.account = MemoryAccount()
         # print "self.args", self.args
 
-    def execute(self, left, dummy, out):
+    def execute(self, left, dummy, out, processqueue=Queue()):
         # Executes the Xorderby.
         self.left = left
         self.qresults = out
-        results = []
-        results_copy = []
-
-        # Read all the results.
-        tuple = self.left.get(True)
-        # print "tuple", tuple
-        tuple_id = 0
-        while (tuple != "EOF"):
-            results_copy.append(tuple)
-            res = {}
-            res.update(tuple)
-            # print "tuple", tuple
-            for arg in self.args:
-                res.update({arg.name[1:]: self.extractValue(tuple[arg.name[1:]])})
-            res.update({'__id__': tuple_id})
-            results.append(res)
-            tuple_id = tuple_id + 1
-            tuple = self.left.get(True)
+        self.conditions = [self.condition(arg) for arg in self.args]
 
-        # Sorting.
-        self.args.reverse()
-        # print "en order by ",self.args
-        for arg in self.args:
-            order_by = "lambda d: (d['" + arg.name[1:] + "'])"
-            results = sorted(results, key=eval(order_by), reverse=arg.desc)
-
-        # Add results to output queue.
-        for tuple in results:
-            self.qresults.put(results_copy[tuple['__id__']])
+        if 0 < self.limit <= MAX_TOP_K:
+            # Top-k: only the k smallest records are kept.
+            for (key, seq, tuple) in heapq.nsmallest(self.limit, self.records()):
+                self.qresults.put(tuple)
+        else:
+            for (key, seq, tuple) in self.sort():
+                self.qresults.put(tuple)
 
         # Put EOF in queue and exit.
         self.qresults.put("EOF")
         return
 
-    def extractValue(self, val):
-        pos = val.find("^^")
-
-        # Handles when the literal is typed.
-        if (pos > -1):
-            for t in data_types.keys():
-                if (t in val[pos]):
-                    (python_type, general_type) = data_types[t]
-
-                    if (general_type == bool):
-                        return val[:pos]
-
-                    else:
-                        return python_type(val[:pos])
+    def condition(self, arg):
+        # (variable, descending) of an ORDER BY condition.
+        while not isinstance(arg, Argument):
+            arg = arg.left
+        return (arg.name[1:], arg.desc)
+
+    def key(self, tuple):
+        # Composite key of a tuple, with the key of every condition.
+        key = ()
+        for (var, desc) in self.conditions:
+            k = term_key(tuple.get(var))
+            key += descending_key(k) if desc else k
+        return key
+
+    def records(self):
+        # Records (key, sequence number, tuple) of the input. Sequence numbers keep the sort stable.
+        seq = 0
+        tuple = self.left.get(True)
+        while tuple != "EOF":
+            yield (self.key(tuple), seq, tuple)
+            seq += 1
+            tuple = self.left.get(True)
 
-        # Handles non-typed literals.
+    def sort(self):
+        # Sorts the records in main memory, or in sorted runs in secondary memory when the memory is exceeded.
+        self.account = MemoryAccount(self.memory)
+        spill = SpillFile('.run', self.tmpdir)
+        runs = 0
+        buffer = []
+        for record in self.records():
+            buffer.append(record)
+            self.account.add(sizeof(record[2]) + RECORD_OVERHEAD)
+            if self.account.size > self.memorySize or self.account.exceeded():
+                self.writeRun(spill, runs, buffer)
+                runs += 1
+                buffer = []
+                self.account.free(self.account.size)
+
+        buffer.sort()
+        if runs == 0:
+            for record in buffer:
+                yield record
         else:
-            return str(val)
+            # Merge the sorted runs, and the records in main memory.
+            for record in heapq.merge(buffer, *[spill.scan(run) for run in range(runs)]):
+                yield record
+        spill.close()
+        self.account.close()
+
+    def writeRun(self, spill, run, buffer):
+        buffer.sort()
+        for i in range(0, len(buffer), BLOCK_SIZE):
+            spill.append(run, buffer[i:i + BLOCK_SIZE])
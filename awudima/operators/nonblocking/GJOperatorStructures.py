@@ -23,13 +23,15 @@ class Record(object):
 class RJTTail(object):
     '''
     Represents the tail of a RJT.
-    It is composed by a list of records and rjtprobeTS 
-    (timestamp when the last tuple in the RJT was probed).
+    It is composed by a list of records, rjtprobeTS
+    (timestamp when the last tuple in the RJT was probed) and
+    the size (in bytes) of the records.
     '''
     def __init__(self, record, rjtProbeTS):
         self.records = [record]
         self.rjtProbeTS = rjtProbeTS
         self.flushTS = float("inf")
+        self.size = 0
         
     def updateRecords(self, record):
         self.records.append(record)
@@ -41,7 +43,7 @@ class RJTTail(object):
 class FileDescriptor(object):
     '''
     Represents the description of a file, that contains a RJT in sec mem.
-    It is composed by the name of the file, the associated resource, 
+    It is composed by the file (SpillFile) the RJT is appended to,
     the current size (number of tuples), and the timestamp of the last
     RJTTail that have been flushed.
     '''
@@ -23,6 +23,38 @@ class Record(object):
         return "(" + str(self.tuple) + ", " + str(self.ats) + ", " + str(self.dts) + ")"
 
 
+class Window(object):
+    '''
+    Represents the number of join keys that a dependent operator sends
+    to the source in a single (instantiated) request.
+    The size is adapted to the requests that are finished: it grows
+    while the source answers fast, and shrinks when the source is slow
+    or when the answer does not fit in one page of results.
+    '''
+
+    def __init__(self, size, minsize, maxsize, latency, results):
+        self.size = size
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.latency = latency  # Target response time (in seconds) of a request
+        self.results = results  # Results of a page, i.e., of a single round trip to the source
+
+    def adapt(self, latency, keys, results):
+        size = self.size
+        if results >= self.results:
+            # Several pages: keep the results of the next requests in one page.
+            size = min(size, keys * self.results // results)
+        elif latency > self.latency:
+            size = size // 2
+        elif keys >= self.size:
+            # Only full windows are taken as evidence to grow.
+            size = self.size * 2
+        self.size = max(self.minsize, min(self.maxsize, size))
+
+    def __repr__(self):
+        return "Window(" + str(self.size) + ")"
+
+
 class Partition(object):
     '''
     Represents a bucket of the hash table.
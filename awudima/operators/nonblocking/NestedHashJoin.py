@@ -12,6 +12,7 @@ from multiprocessing import Queue
 from time import time
 from queue import Empty
 from awudima.operators.Join import Join
+from awudima.operators.JoinKey import key_function
 
 from awudima.operators.nonblocking.NHJFOperatorStructures import Record
 
@@ -33,6 +34,7 @@ class NestedHashJoin(Join):
         self.left_queue = left_queue
         self.right_operator = right_operator
         self.qresults = out
+        self.key = key_function(self.vars)
         #print "right_operator", right_operator
         tuple1 = None
         tuple2 = None
@@ -53,7 +55,7 @@ class NestedHashJoin(Join):
                         new_right_operator = self.makeInstantiation(tuple1,
                                                                     self.right_operator)
                         #print "new op: "+str(new_right_operator)
-                        resource = self.getResource(tuple1)
+                        resource = self.key(tuple1)
                         queue = Queue()
                         right_queues[resource] = queue
                         #print "new_right_operator.__class__", new_right_operator.__class__
@@ -96,12 +98,6 @@ class NestedHashJoin(Join):
         self.qresults.put("EOF")
         return
 
-    def getResource(self, tuple):
-        resource = ''
-        for var in self.vars:
-            resource = resource + tuple[var]
-        return resource
-
     def makeInstantiation(self, tuple, operator):
         d = {}
         for var in self.vars:
@@ -117,7 +113,7 @@ class NestedHashJoin(Join):
     def probeAndInsert1(self, tuple, table1, table2, time):
 
         record = Record(tuple, time, 0)
-        r = self.getResource(tuple)
+        r = self.key(tuple)
         if r in table1:
             records = table1[r]
             for t in records:
@@ -11,17 +11,37 @@ Date: January 29th, 2014
 
 '''
 from multiprocessing import Queue
+from itertools import product
 from time import time
-from queue import Empty
+from awudima.pyrml import DataSourceType
 from awudima.operators.Join import Join
-from awudima.operators.nonblocking.NHJFOperatorStructures import Record
+from awudima.operators.JoinKey import key_function
+from awudima.operators.Multiplexer import InputMultiplexer
+from awudima.operators.SpillFile import SpillFile
+from awudima.operators.MemoryBudget import MemoryAccount, sizeof, RECORD_OVERHEAD
+from awudima.operators.nonblocking.NHJFOperatorStructures import Record, Window
 from awudima.operators.nonblocking.NestedHashJoin import NestedHashJoin
 
+# Number of join keys sent to the source in a request: initial, minimum and maximum size of the window.
 WINDOW_SIZE = 20
+MIN_WINDOW_SIZE = 5
+MAX_WINDOW_SIZE = 1000
+
+# Target response time (in seconds) of a request. Slower requests shrink the window.
+TARGET_LATENCY = 2.0
+
+# Results of a page, i.e., of a single round trip to the source (the limit of the wrappers).
+PAGE_SIZE = 10000
+
+# Maximum length (in characters) of the join keys of a request, below the URL length limits of the endpoints.
+MAX_INSTANTIATION_LENGTH = 4000
 
 
 class NestedHashJoinFilter(Join):
 
+    # Bind join cache of the query (set by the plan), i.e., right tuples already fetched by join key.
+    cache = None
+
     def __init__(self, vars):
         self.left_table = dict()
         self.right_table = dict()
@@ -31,6 +51,13 @@ class NestedHashJoinFilter(Join):
         self.right_operator = None
         self.qresults = Queue()
 
+        # Partitions flushed to secondary memory, by table, and the last time each resource was probed.
+        self.spill_left = SpillFile('.nhj')
+        self.spill_right = SpillFile('.nhj')
+        self.probeTS = dict()
+        # Size (in bytes) of the tables in main memory, reported to the memory budget of the query (if any).
+        self.account = MemoryAccount()
+
     def instantiate(self, d):
         newvars = self.vars - set(d.keys())
         return NestedHashJoin(newvars)
@@ -43,196 +70,205 @@ class NestedHashJoinFilter(Join):
         self.left_queue = left_queue
         self.right_operator = right_operator
         self.qresults = out
+        self.key = key_function(self.vars)
+        self.account = MemoryAccount(self.memory)
+        # Partitions are flushed to the temporary directory of the query.
+        self.spill_left.dir = self.spill_right.dir = self.tmpdir
+        # Join variables, in the order of the VALUES blocks.
+        self.join_vars = sorted(self.vars)
+        # SPARQL endpoints are instantiated with VALUES blocks, other sources with FILTER expressions.
+        self.values = getattr(getattr(right_operator, 'datasource', None), 'dstype', None) == DataSourceType.SPARQL_ENDPOINT
+        self.window = Window(WINDOW_SIZE, MIN_WINDOW_SIZE, MAX_WINDOW_SIZE, TARGET_LATENCY, PAGE_SIZE)
+        # Maximum number of requests running at a time: the left input is not read while they are running.
+        self.max_in_flight = getattr(right_operator, 'max_in_flight', None)
+        if self.cache is not None:
+            self.fingerprint = self.cache.fingerprint(right_operator)
         # print "right_operator", right_operator
-        tuple1 = None
-        tuple2 = None
-        right_queues = dict()
+        # Multiplex the left input and the queues of the instantiated right
+        # operators: sleep until one of them sends data.
+        inputs = InputMultiplexer(self.left_queue, stopped=self.stopped)
+        # Bindings of the join keys that are not sent yet. Every join key is sent once: only the
+        # first tuple of a resource is instantiated (see probeAndInsert1).
         filter_bag = []
+        length = 0
+        keys = []
+        # Bindings of the join keys with blank nodes (FILTER expressions), if the source is instantiated with VALUES.
+        bnode_bag = []
+        bnode_length = 0
+        bnode_keys = []
+        # Requests that are running: start time, number of join keys, number of results and join keys.
+        requests = dict()
+        # Right tuples of the join keys of the running requests, to be cached when their request is finished.
+        fetched = dict()
         count = 0
-        while not (tuple1 == "EOF") or (len(right_queues) > 0):
-
-            try:
-                tuple1 = self.left_queue.get(False)
-                # Try to get and process tuple from left queue
-                if not (tuple1 == "EOF"):
-                    # tuple1 = self.left_queue.get(False)
-                    # print "tuple1: "+str(tuple1)
-                    instance = self.probeAndInsert1(tuple1, self.right_table,
-                                                    self.left_table, time())
-                    # print "sali de probe and insert 1 con tuple", tuple1
-                    if instance:  # the join variables have not been used to
-                        # instanciate the right_operator
-                        filter_bag.append(tuple1)
-                    # print "filter_bag", len(filter_bag)
-
-                    if len(filter_bag) >= WINDOW_SIZE:
-                        new_right_operator = self.makeInstantiation(filter_bag,
-                                                                    self.right_operator)
-                        # print "Here in makeInstantation with filter"
-                        # resource = self.getResource(tuple1)
-                        queue = Queue()
-                        right_queues[count] = queue
-                        new_right_operator.execute(queue)
-                        filter_bag = []
-                        count = count + 1
+        while len(inputs) > 0:
+            (r, tuple) = inputs.get()
 
-                else:
-                    if len(filter_bag) > 0:
-                        # print "here", len(filter_bag), filter_bag
-                        new_right_operator = self.makeInstantiation(filter_bag,
-                                                                    self.right_operator)
-                        # resource = self.getResource(tuple1)
-                        queue = Queue()
-                        right_queues[count] = queue
-                        new_right_operator.execute(queue)
+            if r == 0:
+                # Process tuple from left queue
+                try:
+                    if not (tuple == "EOF"):
+                        instance = self.probeAndInsert1(tuple, self.right_table,
+                                                        self.left_table, time())
+                        # print "sali de probe and insert 1 con tuple", tuple
+                        if instance:  # the join variables have not been used to
+                            # instanciate the right_operator
+                            resource = self.key(tuple)
+                            cached = None if self.cache is None else self.cache.get(self.fingerprint, resource)
+                            if cached is not None:
+                                # The join key was fetched already: the right tuples are taken from the cache.
+                                for t in cached:
+                                    self.probeAndInsert2(resource, t, self.left_table, self.right_table, time())
+                            elif self.values and self.hasBlankNode(tuple):
+                                # Blank nodes cannot be sent in VALUES blocks: their join keys are sent
+                                # in FILTER expressions, in requests of their own.
+                                binding = self.makeBinding(tuple, False)
+                                bnode_bag.append(binding)
+                                bnode_length += len(binding)
+                                bnode_keys.append(resource)
+                            else:
+                                binding = self.makeBinding(tuple, self.values)
+                                filter_bag.append(binding)
+                                length += len(binding)
+                                keys.append(resource)
+                        # print "filter_bag", len(filter_bag)
+
+                    if len(filter_bag) >= self.window.size or length >= MAX_INSTANTIATION_LENGTH or \
+                            (tuple == "EOF" and len(filter_bag) > 0):
+                        count = count + 1
+                        self.request(count, filter_bag, keys, self.values, inputs, requests, fetched)
                         filter_bag = []
+                        length = 0
+                        keys = []
+                    if len(bnode_bag) >= self.window.size or bnode_length >= MAX_INSTANTIATION_LENGTH or \
+                            (tuple == "EOF" and len(bnode_bag) > 0):
                         count = count + 1
+                        self.request(count, bnode_bag, bnode_keys, False, inputs, requests, fetched)
+                        bnode_bag = []
+                        bnode_length = 0
+                        bnode_keys = []
+                except Exception as e:
+                    # print "Unexpected error:", sys.exc_info()[0]
+                    # print e
+                    pass
 
-            except Empty:
-                pass
-            except Exception as e:
-                # print "Unexpected error:", sys.exc_info()[0]
-                # print e
-                pass
-
-            toRemove = []  # stores the queues that have already received all its tuples
-            # print "right_queues", right_queues
-            for r in right_queues:
+            elif tuple == "EOF":
+                # The request r is finished: adapt the window to its response time and results.
+                (start, n, results, resources) = requests.pop(r)
+                self.window.adapt(time() - start, n, results)
+                inputs.resume(0)
+                if self.cache is not None:
+                    # Wrappers stop fetching pages once the query is stopped: the response may be truncated.
+                    truncated = self.stopped is not None and self.stopped.is_set()
+                    for resource in resources:
+                        tuples = fetched.pop(resource, [])
+                        if not truncated:
+                            self.cache.put(self.fingerprint, resource, tuples)
+
+            else:
+                # Process tuple from the queue of the right operator r
+                requests[r][2] += 1
                 try:
-                    q = right_queues[r]
-                    tuple2 = None
-                    while tuple2 != "EOF":
-                        tuple2 = q.get(False)
-
-                        if tuple2 == "EOF":
-                            toRemove.append(r)
-                        else:
-                            resource = self.getResource(tuple2)
-                            for v in self.vars:
-                                del tuple2[v]
-                            # print "new tuple2", tuple2
-                            self.probeAndInsert2(resource, tuple2, self.left_table, self.right_table, time())
+                    resource = self.key(tuple)
+                    for v in self.vars:
+                        del tuple[v]
+                    # print "new tuple2", tuple
+                    self.probeAndInsert2(resource, tuple, self.left_table, self.right_table, time())
+                    if resource in fetched:
+                        fetched[resource].append(tuple)
                 except Exception:
                     # This catch:
-                    # Empty: in tuple2 = self.right.get(False), when the queue is empty.
-                    # TypeError: in att = att + tuple[var], when the tuple is "EOF".
+                    # TypeError: in att = att + tuple[var].
                     # print "Unexpected error:", sys.exc_info()
                     pass
 
-            for r in toRemove:
-                if r in right_queues:
-                    del right_queues[r]
+        # Produce the results of the partitions flushed to secondary memory.
+        self.probeSpilled()
+
         # Put EOF in queue and exit.
         self.qresults.put("EOF")
         return
 
-    def getResource(self, tuple):
-        resource = ''
-        for var in self.vars:
-            # val = tuple[var]
-            # if "^^<" in val:
-            #     val = val[:val.find('^^<')]
-            # resource = resource + val
-            if var in tuple:
-                val = tuple[var]
-                # if isinstance(val, dict) and 'value' in val:
-                #     val = val['value']
-
-                suffix = ''
-                # if 'datatype' in val:
-                #     if isinstance(val['datatype'], bytes):
-                #         suffix = "^^<" + val['datatype'].decode('utf-8') + ">"
-                #     else:
-                #         suffix = "^^<" + val['datatype'] + ">"
-                #
-                if isinstance(val, dict):
-
-                    if "xml:lang" in val:
-                        suffix = '@' + val['xml:lang']
-                    try:
-                        if isinstance(val['value'], bytes):
-                            val = val['value'].decode('utf-8') + suffix
-                        else:
-                            val = val['value'] + suffix
-                    except:
-                        val = val['value'] + suffix
-
-                # if "^^<" in val:
-                #     val = val[:val.find('^^<')]
-                resource = resource + str(val)
-
-        return resource
-
-    def makeInstantiation(self, filter_bag, operators):
-        filter_str = ''
+    def request(self, r, filter_bag, keys, values, inputs, requests, fetched):
+        # Sends the request r for the join keys of the filter bag to the right operator.
+        new_right_operator = self.makeInstantiation(filter_bag, self.right_operator, values)
+        # print "Here in makeInstantation with filter"
+        queue = self.right_operator.engine.queue()
+        inputs.add(r, queue)
+        requests[r] = [time(), len(filter_bag), 0, keys]
+        if self.cache is not None:
+            for resource in keys:
+                fetched[resource] = []
+        new_right_operator.execute(queue)
+        if self.max_in_flight is not None and len(requests) >= self.max_in_flight:
+            inputs.pause(0)
+
+    def makeInstantiation(self, filter_bag, operators, values=False):
         new_vars = ['?' + v for v in self.vars]  # TODO: this might be $
         filter_str = " . ".join(map(str, operators.tree.service.filters))
         # print "making instantiation join filter", filter_bag
-        # When join variables are more than one: FILTER ( )
         if len(self.vars) >= 1:
-            filter_str += ' . FILTER (__expr__)'
-
-            or_expr = []
-            for tuple in filter_bag:
-                and_expr = []
-                for var in self.vars:
-                    # aux = "?" + var + "==" + tuple[var]
-                    v = tuple[var]
-                    if isinstance(v, dict):
-                        suffix = ''
-                        if v['type'] == 'uri':
-                            v = "<" + v['value'] + ">"
-                            v = "?" + var + "=" + v
-                            and_expr.append(v)
-                        elif v['type'] == 'bnode':   # this could be a problem (semantically), since scope of blank nodes is within a data source
-                            v = v['value']
-                            v = "?" + var + "=" + v
-                            and_expr.append(v)
-                        else:
-                            if 'datatype' in v:
-                                if isinstance(v['datatype'], bytes):
-                                    suffix = "^^<" + v['datatype'].decode('utf-8') + ">"
-                                else:
-                                    suffix = "^^<" + v['datatype'] + ">"
-
-                            if "xml:lang" in v:
-                                suffix = '@' + v['xml:lang']
-                            try:
-                                if isinstance(v['value'], bytes):
-                                    vf = v['value'].decode('utf-8') + suffix
-                                else:
-                                    vf = v['value'] + suffix
-                            except:
-                                vf = v['value'] + suffix
-
-                            v = "(?" + var + "=" + vf + ' || ' + "?" + var + '="' + v['value'].decode('utf-8') + '")'
-                            and_expr.append(v)
-
-                    else:
-                        if v.find("http") == 0:  # uris must be passed between < .. >
-                            v = "<" + v + ">"
-                            v = "?" + var + "=" + v
-                            and_expr.append(v)
-                        else:
-                            if '^^<' not in v:
-                                v = '"' + v + '"'
-                                vf = "?" + var + "=" + v  # + " || " + "?" + var + "=" + v + "^^<http://www.w3.org/2001/XMLSchema#string>)"
-                                and_expr.append(vf)
-                            else:
-                                loc = v.find('^^<')
-                                vf = '"' + v[:loc] + '"' + v[loc:]
-                                v = "(?" + var + "=" + vf + ' || ' + "?" + var + '="' + v[:loc] + '")'
-                                and_expr.append(v)
-                if len(and_expr) > 1:
-                    or_expr.append('(' + ' && '.join(and_expr) + ')')
-                else:
-                    or_expr.append(' && '.join(and_expr))
-            filter_str = filter_str.replace('__expr__', ' || '.join(or_expr))
+            if values:
+                # VALUES (?v1 ... ?vn) { (t1 ... tn) ... }
+                filter_str += ' . VALUES (' + ' '.join(['?' + var for var in self.join_vars]) + ') { ' + \
+                              ' '.join(filter_bag) + ' }'
+            else:
+                # FILTER (?v1=t1 && ... && ?vn=tn || ...)
+                filter_str += ' . FILTER (' + ' || '.join(filter_bag) + ')'
         new_operator = operators.instantiateFilter(set(new_vars), filter_str)
         # print "type(new_operator)", type(new_operator)
 
         return new_operator
 
+    def hasBlankNode(self, tuple):
+        # True if a join variable of the tuple is bound to a blank node.
+        return any(isinstance(tuple[var], dict) and tuple[var]['type'] == 'bnode' for var in self.join_vars)
+
+    def makeBinding(self, tuple, values=False):
+        # Instantiation of the join variables with the values of the tuple: rows of a VALUES
+        # block, or a condition of a FILTER expression. Blank nodes can only be sent in FILTER expressions.
+        terms = [self.makeTerms(tuple[var]) for var in self.join_vars]
+        if values:
+            return ' '.join(['(' + ' '.join(row) + ')' for row in product(*terms)])
+
+        and_expr = []
+        for var, alternatives in zip(self.join_vars, terms):
+            if not alternatives:
+                alternatives = [tuple[var]['value']]
+            expr = ' || '.join(["?" + var + "=" + t for t in alternatives])
+            and_expr.append('(' + expr + ')' if len(alternatives) > 1 else expr)
+        if len(and_expr) > 1:
+            return '(' + ' && '.join(and_expr) + ')'
+        return and_expr[0]
+
+    def makeTerms(self, v):
+        # RDF terms that match a value: typed literals are matched with and without their datatype.
+        if isinstance(v, dict):
+            value = v['value']
+            if isinstance(value, bytes):
+                value = value.decode('utf-8')
+            if v['type'] == 'uri':
+                return ["<" + value + ">"]
+            if v['type'] == 'bnode':
+                return []
+            value = '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+            if "xml:lang" in v:
+                return [value + '@' + v['xml:lang']]
+            if 'datatype' in v:
+                datatype = v['datatype']
+                if isinstance(datatype, bytes):
+                    datatype = datatype.decode('utf-8')
+                return [value + "^^<" + datatype + ">", value]
+            return [value]
+
+        if v.find("http") == 0:  # uris must be passed between < .. >
+            return ["<" + v + ">"]
+        loc = v.find('^^<')
+        if loc < 0:
+            return ['"' + v.replace('\\', '\\\\').replace('"', '\\"') + '"']
+        value = '"' + v[:loc].replace('\\', '\\\\').replace('"', '\\"') + '"'
+        return [value + v[loc:], value]
+
     def makeInstantiationX(self, filter_bag, operators):
         filter_str = ''
 
@@ -444,9 +480,10 @@ class NestedHashJoinFilter(Join):
 
     def probeAndInsert1(self, tuple, table1, table2, time):
         #print "in probeAndInsert1", tuple
-        record = Record(tuple, time, 0)
-        r = self.getResource(tuple)
+        record = Record(tuple, time, float("inf"))
+        r = self.key(tuple)
         #print "resource", r, tuple
+        self.probeTS[r] = time
         if r in table1:
             records = table1[r]
             for t in records:
@@ -456,14 +493,17 @@ class NestedHashJoinFilter(Join):
                 x.update(tuple)
                 self.qresults.put(x)
         p = table2.get(r, [])
-        i = (p == [])
+        # The right operator was already instantiated with the resource, if its partition was flushed.
+        i = (p == [] and r not in self.spill_left)
         p.append(record)
         table2[r] = p
+        self.insertedRecord(record)
         return i
 
     def probeAndInsert2(self, resource, tuple, table1, table2, time):
         #print "probeAndInsert2", resource, tuple
-        record = Record(tuple, time, 0)
+        record = Record(tuple, time, float("inf"))
+        self.probeTS[resource] = time
         if resource in table1:
             records = table1[resource]
             for t in records:
@@ -475,3 +515,51 @@ class NestedHashJoinFilter(Join):
         p = table2.get(resource, [])
         p.append(record) 
         table2[resource] = p
+        self.insertedRecord(record)
+
+    def insertedRecord(self, record):
+        # Account the record and, if the memory budget of the query is exceeded, flush the coldest partitions.
+        self.account.add(sizeof(record.tuple) + RECORD_OVERHEAD)
+        if self.account.exceeded():
+            self.spill()
+
+    def spill(self):
+        # Flush the partitions of the least recently probed resources (of both tables) to secondary memory,
+        # until the tables in main memory take at most half of their current size.
+        # The departure timestamp (dts) of the flushed records is the time of the flush.
+        target = self.account.size / 2
+        resources = sorted(set(self.left_table.keys()) | set(self.right_table.keys()), key=lambda r: self.probeTS[r])
+        dts = time()
+        for resource in resources:
+            if self.account.size <= target:
+                break
+            for table, spill in [(self.left_table, self.spill_left), (self.right_table, self.spill_right)]:
+                if resource in table:
+                    records = table.pop(resource)
+                    spill.append(resource, [(record.tuple, record.ats, dts) for record in records])
+                    self.account.free(sum([sizeof(record.tuple) + RECORD_OVERHEAD for record in records]))
+            del self.probeTS[resource]
+
+    def probeSpilled(self):
+        # A pair of records of a resource was joined in main memory if, when the later one arrived, the earlier
+        # one was not flushed yet. The remaining pairs of the flushed resources are produced here.
+        resources = set(self.spill_left.keys()) | set(self.spill_right.keys())
+        for resource in resources:
+            left = [Record(tuple, ats, dts) for (tuple, ats, dts) in self.spill_left.read(resource)]
+            left.extend(self.left_table.get(resource, []))
+            right = [Record(tuple, ats, dts) for (tuple, ats, dts) in self.spill_right.read(resource)]
+            right.extend(self.right_table.get(resource, []))
+            for l in left:
+                for r in right:
+                    if l.ats <= r.ats:
+                        joined = l.dts > r.ats
+                    else:
+                        joined = r.dts > l.ats
+                    if not joined:
+                        x = l.tuple.copy()
+                        x.update(r.tuple)
+                        self.qresults.put(x)
+
+        self.spill_left.close()
+        self.spill_right.close()
+        self.account.close()
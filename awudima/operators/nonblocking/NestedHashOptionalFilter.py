@@ -12,8 +12,11 @@ Date: January 29th, 2014
 '''
 from multiprocessing import Queue
 from time import time
-from queue import Empty
 from awudima.operators.Optional import Optional
+from awudima.operators.JoinKey import key_function
+from awudima.operators.Multiplexer import InputMultiplexer
+from awudima.operators.SpillFile import SpillFile
+from awudima.operators.MemoryBudget import MemoryAccount, sizeof, RECORD_OVERHEAD
 from awudima.operators.nonblocking.NHJFOperatorStructures import Record
 
 
@@ -26,10 +29,15 @@ class NestedHashOptionalFilter(Optional):
         self.left_table = dict()
         self.right_table = dict()
         self.qresults = Queue()
-        self.bag = []
         self.vars_left = set(vars_left)
         self.vars_right = set(vars_right)
         self.vars = list(self.vars_left & self.vars_right)
+        # Partitions flushed to secondary memory, by table, and the last time each resource was probed.
+        self.spill_left = SpillFile('.nho')
+        self.spill_right = SpillFile('.nho')
+        self.probeTS = dict()
+        # Size (in bytes) of the tables in main memory, reported to the memory budget of the query (if any).
+        self.account = MemoryAccount()
 
     def instantiate(self, d):
         newvars_left = self.vars_left - set(d.keys())
@@ -46,134 +54,89 @@ class NestedHashOptionalFilter(Optional):
         self.left_queue = left_queue
         self.right_operator = right_operator
         self.qresults = out
-
-        tuple1 = None
-        tuple2 = None
-        right_queues = dict()
+        self.key = key_function(self.vars)
+        self.account = MemoryAccount(self.memory)
+        # Partitions are flushed to the temporary directory of the query.
+        self.spill_left.dir = self.spill_right.dir = self.tmpdir
+
+        # Multiplex the left input and the queues of the instantiated right
+        # operators: sleep until one of them sends data.
+        inputs = InputMultiplexer(self.left_queue, stopped=self.stopped)
         filter_bag = []
+        # Requests that are running. At most max_in_flight at a time: the left input is not read while they are running.
+        requests = set()
+        max_in_flight = getattr(right_operator, 'max_in_flight', None)
         count = 0
-        while (not(tuple1 == "EOF") or (len(right_queues) > 0)):
-
-            try:
-                tuple1 = self.left_queue.get(False)
-                #print "tuple1", tuple1
-                # Try to get and process tuple from left queue
-                if not(tuple1 == "EOF"):
-                    #tuple1 = self.left_queue.get(False)
-                    #print "tuple1: "+str(tuple1)
-                    self.bag.append(tuple1)
-                    instance = self.probeAndInsert1(tuple1, self.right_table, self.left_table, time())
-                    #print "sali de probe and insert 1 con tuple", tuple1
-                    if instance: # the join variables have not been used to instanciate the right_operator
-                        filter_bag.append(tuple1)
-                    #print "filter_bag", len(filter_bag)
-
-                    if len(filter_bag) >= WINDOW_SIZE:
+        while len(inputs) > 0:
+            (r, tuple) = inputs.get()
+
+            if r == 0:
+                # Process tuple from left queue
+                try:
+                    if not(tuple == "EOF"):
+                        instance = self.probeAndInsert1(tuple, self.right_table, self.left_table, time())
+                        #print "sali de probe and insert 1 con tuple", tuple
+                        if instance: # the join variables have not been used to instanciate the right_operator
+                            filter_bag.append(tuple)
+                        #print "filter_bag", len(filter_bag)
+
+                    if len(filter_bag) >= WINDOW_SIZE or (tuple == "EOF" and len(filter_bag) > 0):
                         new_right_operator = self.makeInstantiation(filter_bag,  self.right_operator)
                         #print "Here in makeInstantation with filter"
-                        #resource = self.getResource(tuple1)
-                        queue = Queue()
-                        right_queues[count] = queue
-                        new_right_operator.execute(queue)
-                        filter_bag = []
+                        queue = self.right_operator.engine.queue()
                         count = count + 1
-            
-                else:
-                    if len(filter_bag) > 0:
-                        #print "here", len(filter_bag), filter_bag
-                        new_right_operator = self.makeInstantiation(filter_bag, self.right_operator)
-                        #resource = self.getResource(tuple1)
-                        queue = Queue()
-                        right_queues[count] = queue
+                        inputs.add(count, queue)
+                        requests.add(count)
                         new_right_operator.execute(queue)
                         filter_bag = []
-                        count = count + 1
+                        if max_in_flight is not None and len(requests) >= max_in_flight:
+                            inputs.pause(0)
+                except Exception as e:
+                    #print "Unexpected error:", sys.exc_info()[0]
+                    #print e
+                    pass
 
-            except Empty:
-                pass
-            except Exception as e:
-                #print "Unexpected error:", sys.exc_info()[0]
-                #print e
-                pass
+            elif tuple == "EOF":
+                # The request r is finished.
+                requests.discard(r)
+                inputs.resume(0)
 
-            toRemove = [] # stores the queues that have already received all its tuples
-            #print "right_queues", right_queues
-            for r in right_queues:
+            else:
+                # Process tuple from the queue of the right operator r
                 try:
-                    q = right_queues[r]
-                    tuple2 = None
-                    while tuple2 != "EOF":
-                        tuple2 = q.get(False)
-                        
-                        if tuple2 == "EOF":
-                            toRemove.append(r)
-                        else:
-                            resource = self.getResource(tuple2)
-                            for v in self.vars:
-                                del tuple2[v]
-                            #print "new tuple2", tuple2
-                            self.probeAndInsert2(resource, tuple2, self.left_table, self.right_table, time())
+                    resource = self.key(tuple)
+                    for v in self.vars:
+                        del tuple[v]
+                    #print "new tuple2", tuple
+                    self.probeAndInsert2(resource, tuple, self.left_table, self.right_table, time())
                 except Exception:
                     # This catch:
-                    # Empty: in tuple2 = self.right.get(False), when the queue is empty.
-                    # TypeError: in att = att + tuple[var], when the tuple is "EOF".
+                    # TypeError: in att = att + tuple[var].
                     #print "Unexpected error:", sys.exc_info()
                     pass
 
-            for r in toRemove:
-                del right_queues[r]
+        # Produce the results of the partitions flushed to secondary memory.
+        self.probeSpilled()
 
-        # This is the optional: Produce tuples that haven't matched already.    
-        for tuple in self.bag:
-            res_right = {}
-            for var in self.vars_right:
-                res_right.update({var: ''})
-            res = res_right
-            res.update(tuple)
-            self.qresults.put(res)
+        # This is the optional: Produce the left tuples of the resources without right tuples.
+        for resource in set(self.left_table.keys()) | set(self.spill_left.keys()):
+            if resource in self.right_table or resource in self.spill_right:
+                continue
+            left = [tuple for (tuple, ats, dts) in self.spill_left.read(resource)]
+            left.extend([record.tuple for record in self.left_table.get(resource, [])])
+            for tuple in left:
+                res = dict.fromkeys(self.vars_right, '')
+                res.update(tuple)
+                self.qresults.put(res)
+
+        self.spill_left.close()
+        self.spill_right.close()
+        self.account.close()
 
         # Put EOF in queue and exit.
         self.qresults.put("EOF")
         return
 
-    def getResource(self, tuple):
-        resource = ''
-        for var in self.vars:
-            # val = tuple[var]
-            # if "^^<" in val:
-            #     val = val[:val.find('^^<')]
-            #
-            # resource = resource + val
-
-            if var in tuple:
-                val = tuple[var]
-                # if isinstance(val, dict) and 'value' in val:
-                #     val = val['value']
-
-                suffix = ''
-                # if 'datatype' in val:
-                #     if isinstance(val['datatype'], bytes):
-                #         suffix = "^^<" + val['datatype'].decode('utf-8') + ">"
-                #     else:
-                #         suffix = "^^<" + val['datatype'] + ">"
-                #
-                if isinstance(val, dict):
-
-                    if "xml:lang" in val:
-                        suffix = '@' + val['xml:lang']
-                    try:
-                        if isinstance(val['value'], bytes):
-                            val = val['value'].decode('utf-8') + suffix
-                        else:
-                            val = val['value'] + suffix
-                    except:
-                        val = val['value'] + suffix
-                # if "^^<" in val:
-                #     val = val[:val.find('^^<')]
-                resource = resource + str(val)
-
-        return resource
-
     def makeInstantiation(self, filter_bag, operator):
         filter_str = ''
         filter_str = " . ".join(map(str, operator.tree.service.filters))
@@ -252,9 +215,10 @@ class NestedHashOptionalFilter(Optional):
 
     def probeAndInsert1(self, tuple, table1, table2, time):
         #print "in probeAndInsert1", tuple
-        record = Record(tuple, time, 0)
-        r = self.getResource(tuple)
+        record = Record(tuple, time, float("inf"))
+        r = self.key(tuple)
         #print "resource", r, tuple
+        self.probeTS[r] = time
         if r in table1:
             records = table1[r]
             for t in records:
@@ -263,21 +227,19 @@ class NestedHashOptionalFilter(Optional):
                 x = t.tuple.copy()
                 x.update(tuple)
                 self.qresults.put(x)
-                # Delete tuple from bag.
-                try:
-                    self.bag.remove(tuple)
-                except ValueError:
-                    pass
 
         p = table2.get(r, [])
-        i = (p == [])
+        # The right operator was already instantiated with the resource, if its partition was flushed.
+        i = (p == [] and r not in self.spill_left)
         p.append(record)
         table2[r] = p
+        self.insertedRecord(record)
         return i
 
     def probeAndInsert2(self, resource, tuple, table1, table2, time):
         #print "probeAndInsert2", resource, tuple
-        record = Record(tuple, time, 0)
+        record = Record(tuple, time, float("inf"))
+        self.probeTS[resource] = time
         if resource in table1:
             records = table1[resource]
             for t in records:
@@ -286,12 +248,51 @@ class NestedHashOptionalFilter(Optional):
                 x = t.tuple.copy()
                 x.update(tuple)
                 self.qresults.put(x)
-                # Delete tuple from bag.
-                try:
-                    self.bag.remove(t.tuple)
-                except ValueError:
-                    pass
 
         p = table2.get(resource, [])
         p.append(record) 
         table2[resource] = p
+        self.insertedRecord(record)
+
+    def insertedRecord(self, record):
+        # Account the record and, if the memory budget of the query is exceeded, flush the coldest partitions.
+        self.account.add(sizeof(record.tuple) + RECORD_OVERHEAD)
+        if self.account.exceeded():
+            self.spill()
+
+    def spill(self):
+        # Flush the partitions of the least recently probed resources (of both tables) to secondary memory,
+        # until the tables in main memory take at most half of their current size.
+        # The departure timestamp (dts) of the flushed records is the time of the flush.
+        target = self.account.size / 2
+        resources = sorted(set(self.left_table.keys()) | set(self.right_table.keys()), key=lambda r: self.probeTS[r])
+        dts = time()
+        for resource in resources:
+            if self.account.size <= target:
+                break
+            for table, spill in [(self.left_table, self.spill_left), (self.right_table, self.spill_right)]:
+                if resource in table:
+                    records = table.pop(resource)
+                    spill.append(resource, [(record.tuple, record.ats, dts) for record in records])
+                    self.account.free(sum([sizeof(record.tuple) + RECORD_OVERHEAD for record in records]))
+            del self.probeTS[resource]
+
+    def probeSpilled(self):
+        # A pair of records of a resource was joined in main memory if, when the later one arrived, the earlier
+        # one was not flushed yet. The remaining pairs of the flushed resources are produced here.
+        resources = set(self.spill_left.keys()) | set(self.spill_right.keys())
+        for resource in resources:
+            left = [Record(tuple, ats, dts) for (tuple, ats, dts) in self.spill_left.read(resource)]
+            left.extend(self.left_table.get(resource, []))
+            right = [Record(tuple, ats, dts) for (tuple, ats, dts) in self.spill_right.read(resource)]
+            right.extend(self.right_table.get(resource, []))
+            for l in left:
+                for r in right:
+                    if l.ats <= r.ats:
+                        joined = l.dts > r.ats
+                    else:
+                        joined = r.dts > l.ats
+                    if not joined:
+                        x = l.tuple.copy()
+                        x.update(r.tuple)
+                        self.qresults.put(x)
@@ -9,6 +9,9 @@ The intermediate results are represented as queues.
 from multiprocessing import Queue
 from time import time
 from awudima.operators.Join import Join
+from awudima.operators.JoinKey import key_function
+from awudima.operators.Multiplexer import InputMultiplexer
+from awudima.operators.MemoryBudget import MemoryAccount, sizeof, RECORD_OVERHEAD
 from awudima.operators.nonblocking.NHJFOperatorStructures import Table, Record
 
 
@@ -19,6 +22,7 @@ class SymmetricHashJoin(Join):
         self.right_table = Table()
         self.qresults    = Queue()
         self.vars        = vars
+        self.account     = MemoryAccount()
 
     def instantiate(self, d):
         newvars = self.vars - set(d.keys())
@@ -29,47 +33,33 @@ class SymmetricHashJoin(Join):
         self.left     = left
         self.right    = right
         self.qresults = out
+        self.key      = key_function(self.vars)
+        self.account  = MemoryAccount(self.memory)
 
-        # Initialize tuples.
-        tuple1 = None
-        tuple2 = None
+        # Multiplex both inputs: sleep until one of them sends data.
+        inputs = InputMultiplexer(self.left, self.right, stopped=self.stopped)
 
         # Get the tuples from the queues.
-        while (not(tuple1 == "EOF") or not(tuple2 == "EOF")):
-
-            # Try to get and process tuple from left queue.
-            if not(tuple1 == "EOF"):
-                try:
-                    tuple1 = self.left.get(False)
+        while len(inputs) > 0:
+            (side, tuple) = inputs.get()
+            if tuple == "EOF":
+                continue
+
+            try:
+                if side == 0:
+                    # Process tuple from left queue.
                     #print "Tuples in right table", len(self.right_table.partitions[0].records)
-                    self.insertAndProbe(tuple1, self.left, self.left_table, self.right_table)
-                except Exception:
-                    # This catch:
-                    # Empty: in tuple2 = self.left.get(False), when the queue is empty.
-                    # TypeError: in att = att + tuple[var], when the tuple is "EOF".
-                    pass
-
-            # Try to get and process tuple from right queue.
-            if not(tuple2 == "EOF"):
-                try:
-                    tuple2 = self.right.get(False)
-                    self.insertAndProbe(tuple2, self.right, self.right_table, self.left_table)
-                except Exception:
-                    # This catch:
-                    # Empty: in tuple2 = self.right.get(False), when the queue is empty.
-                    # TypeError: in att = att + tuple[var], when the tuple is "EOF".
-                    pass
-
-#            # Process tuples.
-#            if (not(tuple1 == None) and not(tuple1 == "EOF")):
-#                #print "Tuples in right table", len(self.right_table.partitions[0].records)
-#                self.insertAndProbe(tuple1, self.left, self.left_table, self.right_table)
-#            if (not(tuple2 == None) and not(tuple2 == "EOF")):
-#                self.insertAndProbe(tuple2, self.right, self.right_table, self.left_table)
-#
-
+                    self.insertAndProbe(tuple, self.left, self.left_table, self.right_table)
+                else:
+                    # Process tuple from right queue.
+                    self.insertAndProbe(tuple, self.right, self.right_table, self.left_table)
+            except Exception:
+                # This catch:
+                # TypeError: in att = att + tuple[var].
+                pass
 
         # Put EOF in queue and exit.
+        self.account.close()
         self.qresults.put("EOF")
         return
 
@@ -77,15 +67,13 @@ class SymmetricHashJoin(Join):
     def insertAndProbe(self, tuple, input, table1, table2):
         # Insert the tuple in its corresponding partition and probe.
 
-        # Get the attribute(s) to apply hash.
-        att = ''
-        for var in self.vars:
-            att = att + tuple[var]
-        i = hash(att) % table1.size;
+        # Get the join key to apply hash.
+        i = hash(self.key(tuple)) % table1.size
 
         # Insert record in partition.
         record = Record(tuple, time(), 0)
         table1.insertRecord(i, record)
+        self.account.add(sizeof(tuple) + RECORD_OVERHEAD)
 
         # Probe the record against its partition in the other table.
         self.probe(record, table2.partitions[i], self.vars)
@@ -0,0 +1,349 @@
+'''
+Implements the evaluation of FILTER expressions of the Xfilter over blocks of tuples.
+
+The values of the variables of a block are parsed once into columns (numpy
+arrays): the lexical forms, and the numerical or dateTime values of the typed
+literals. Tests of a variable and a constant (or of two variables), and the
+logical connectives over them, are evaluated for the whole block with
+array operations, with the same result as the closures of the Xfilter.
+
+Rows that the columns cannot represent (e.g., JSON terms, unbound
+variables, values that are compared after a cast to another type) are
+evaluated by the closure of the Xfilter, tuple by tuple.
+'''
+import operator
+from awudima.pysparql import Expression, Argument
+from awudima.operators.nonblocking.Xfilter import datatype, xsd_datetime, test_operators
+
+# Kinds of the values of a column.
+OTHER = 0
+STRING = 1
+INT = 2
+FLOAT = 3
+DATETIME = 4
+
+# Integers that are exactly represented as floats, i.e., that are compared with floats as Python does.
+MAX_EXACT_INT = 1 << 53
+
+
+def numpy_available():
+    try:
+        import numpy
+        return True
+    except ImportError:
+        return False
+
+
+def kind(general_type, python_type):
+    # Kind of the values of a datatype, as returned by extractValue.
+    if general_type == 'numerical':
+        return INT if python_type == int else FLOAT
+    if general_type == str or general_type == bool:
+        # extractValue returns the lexical form of booleans.
+        return STRING
+    if python_type == xsd_datetime:
+        return DATETIME
+    return OTHER
+
+
+class Column(object):
+    '''
+    Values of a variable in a block of tuples: the kind of every row, and the lexical forms (strings),
+    integers, floats and datetimes of the rows of that kind.
+    '''
+
+    def __init__(self, np, values):
+        n = len(values)
+        self.kinds = np.zeros(n, dtype=np.int8)
+
+        # Values other than strings (e.g., JSON terms, or None if the variable is unbound) are not represented.
+        strings = [v if v.__class__ is str else '' for v in values]
+        if hasattr(np, 'strings'):
+            (lexical, sep, suffix) = np.strings.partition(np.array(strings, dtype=str), '^^')
+        else:
+            (lexical, sep, suffix) = np.char.partition(np.array(strings, dtype=str), '^^').T
+        self.strings = lexical
+
+        # Plain literals and URIs are strings, typed literals have the kind of their datatype.
+        represented = np.array([v.__class__ is str for v in values], dtype=bool)
+        typed = sep != ''
+        self.kinds[represented & ~typed] = STRING
+        typed &= represented
+        while typed.any():
+            # Rows of the datatype of the first typed row left (a column has usually few datatypes).
+            s = str(suffix[np.argmax(typed)])
+            rows = typed & (suffix == s)
+            dt = datatype('^^' + s) if s else None
+            self.kinds[rows] = OTHER if dt is None else kind(dt[1], dt[0])
+            typed &= ~rows
+
+        self.ints = self.convert(np, INT, np.int64, parse_integers, int)
+        self.floats = self.convert(np, FLOAT, np.float64, parse_decimals, float)
+        self.datetimes = self.convert(np, DATETIME, 'datetime64[us]', parse_datetimes, xsd_datetime)
+
+    def convert(self, np, k, dtype, parse, cast):
+        # Values of the rows of kind k. Rows that are not parsed by the array operations are cast one by one,
+        # and rows that cannot be cast (or represented) are not represented.
+        rows = np.flatnonzero(self.kinds == k)
+        res = np.zeros(len(self.kinds), dtype=dtype)
+        if len(rows) == 0:
+            return res
+        (values, parsed) = parse(np, self.strings[rows])
+        res[rows[parsed]] = values[parsed]
+        for i in rows[~parsed]:
+            try:
+                res[i] = cast(str(self.strings[i]))
+            except Exception:
+                self.kinds[i] = OTHER
+        return res
+
+
+def codepoints(np, strings):
+    # Unicode code points of an array of strings, a row per string, padded with 0.
+    width = int(np.char.str_len(strings).max()) if len(strings) else 0
+    if width == 0:
+        return np.zeros((len(strings), 1), dtype=np.int32)
+    strings = np.ascontiguousarray(strings.astype('<U%d' % width))
+    return strings.view(np.uint32).reshape(len(strings), width).astype(np.int32)
+
+
+def digits(np, strings):
+    '''
+    Parses the decimal numbers of at most 15 digits, with an optional '-' sign and an optional decimal point.
+
+    :param np: numpy module
+    :param strings: array of strings
+    :return: (mantissa, scale, point, parsed), i.e., the number is mantissa / 10**scale, and point is True if the
+             string has a decimal point
+    '''
+    cp = codepoints(np, strings)
+    (n, width) = cp.shape
+    position = np.arange(width)
+    length = (cp != 0).sum(axis=1)
+    inside = position < length[:, None]
+
+    negative = cp[:, 0] == 45
+    isdigit = (cp >= 48) & (cp <= 57)
+    ispoint = cp == 46
+    ndigits = (isdigit & inside).sum(axis=1)
+    npoints = (ispoint & inside).sum(axis=1)
+    parsed = np.all(~inside | isdigit | ispoint | ((position == 0) & negative[:, None]), axis=1)
+    parsed &= (npoints <= 1) & (ndigits >= 1) & (ndigits <= 15)
+
+    # Digits after the decimal point (if any), and the weight of every digit.
+    points = np.where(npoints > 0, np.argmax(ispoint, axis=1), length)
+    scale = np.where(npoints > 0, length - points - 1, 0)
+    exponent = np.cumsum((isdigit & inside)[:, ::-1], axis=1)[:, ::-1] - 1
+    weights = 10 ** np.clip(exponent, 0, 15)
+    mantissa = np.where(isdigit & inside & parsed[:, None], (cp - 48) * weights, 0).sum(axis=1)
+    mantissa = np.where(negative, -mantissa, mantissa)
+    return (mantissa, scale, npoints > 0, parsed)
+
+
+def parse_integers(np, strings):
+    # Integers as int() parses them, for the strings of digits (and sign) without decimal point.
+    (mantissa, scale, point, parsed) = digits(np, strings)
+    return (mantissa, parsed & ~point)
+
+
+def parse_decimals(np, strings):
+    # Floats as float() parses them: mantissa and 10**scale are exact floats, so is the rounding of their quotient.
+    (mantissa, scale, point, parsed) = digits(np, strings)
+    return (mantissa.astype(np.float64) / (10.0 ** scale), parsed)
+
+
+def parse_datetimes(np, strings):
+    '''
+    Parses the dateTimes without timezone, or in UTC ('Z'), without fractions of seconds,
+    i.e., of the form YYYY-MM-DDTHH:MM:SS[Z].
+
+    :param np: numpy module
+    :param strings: array of strings
+    :return: (values, parsed), the values as datetime64[us]
+    '''
+    cp = codepoints(np, strings)
+    n = len(strings)
+    if cp.shape[1] < 20:
+        cp = np.hstack([cp, np.zeros((n, 20 - cp.shape[1]), dtype=np.int64)])
+    cp = cp[:, :21]
+    parsed = np.ones(n, dtype=bool) if cp.shape[1] == 20 else cp[:, 20] == 0
+    parsed &= (cp[:, 19] == 0) | (cp[:, 19] == 90)
+    for (i, c) in [(4, 45), (7, 45), (10, 84), (13, 58), (16, 58)]:
+        parsed &= cp[:, i] == c
+
+    d = cp - 48
+    parsed &= np.all((d[:, [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]] >= 0) &
+                     (d[:, [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]] <= 9), axis=1)
+
+    def field(i, width):
+        value = np.zeros(n, dtype=np.int64)
+        for j in range(i, i + width):
+            value = value * 10 + d[:, j]
+        return value
+    (year, month, day) = (field(0, 4), field(5, 2), field(8, 2))
+    (hour, minute, second) = (field(11, 2), field(14, 2), field(17, 2))
+    parsed &= (year >= 1) & (month >= 1) & (month <= 12) & (hour < 24) & (minute < 60) & (second < 60)
+
+    # Days of the month (of the rows that are parsed so far).
+    month = np.where(parsed, month, 1)
+    months = np.where(parsed, (year - 1970) * 12 + month - 1, 0)
+    start = months.astype('datetime64[M]').astype('datetime64[D]')
+    end = (months + 1).astype('datetime64[M]').astype('datetime64[D]')
+    parsed &= (day >= 1) & (day <= (end - start).astype(np.int64))
+
+    seconds = ((np.where(parsed, day, 1) - 1) * 24 + hour) * 3600 + minute * 60 + second
+    values = start.astype('datetime64[us]') + np.where(parsed, seconds * 1000000, 0).astype('timedelta64[us]')
+    return (values, parsed)
+
+
+class VectorFilter(object):
+    '''
+    Evaluates the expression of a FILTER over blocks of tuples. Every node of the expression is compiled into a
+    function of the columns of a block that returns three masks: its value, the rows where its evaluation
+    raises an error, and the rows that are evaluated by the Xfilter (unknown).
+    '''
+
+    def __init__(self, expr):
+        import numpy
+        self.np = numpy
+        self.vars = set()
+        self.node = self.compileNode(expr)
+
+    def vectorizable(self):
+        return self.node is not None
+
+    def filter(self, tuples, evaluate):
+        '''
+        Returns the tuples of a block that satisfy the expression, in order.
+
+        :param tuples: block of tuples (dicts)
+        :param evaluate: closure of the Xfilter, that evaluates the expression for a tuple
+        :return: list of the tuples where the expression evaluates to true
+        '''
+        np = self.np
+        columns = dict([(var, Column(np, [t.get(var) for t in tuples])) for var in self.vars])
+        (value, error, unknown) = self.node(columns)
+        # Errors evaluate to false, as in the Xfilter.
+        passed = value & ~error & ~unknown
+        if not unknown.any():
+            return [tuples[i] for i in np.flatnonzero(passed).tolist()]
+
+        res = []
+        for i in np.flatnonzero(passed | unknown):
+            tuple = tuples[i]
+            if unknown[i]:
+                try:
+                    (val, _) = evaluate(tuple)
+                except Exception:
+                    val = False
+                if not val:
+                    continue
+            res.append(tuple)
+        return res
+
+    def compileNode(self, expr):
+        if not isinstance(expr, Expression):
+            return None
+
+        if expr.op in ['&&', '||']:
+            left, right = self.compileNode(expr.left), self.compileNode(expr.right)
+            if left is None or right is None:
+                return None
+            connective = operator.and_ if expr.op == '&&' else operator.or_
+
+            def evaluate(columns):
+                (lvalue, lerror, lunknown), (rvalue, rerror, runknown) = left(columns), right(columns)
+                # An error in either operand is raised by the closures, i.e., the FILTER is false.
+                return (connective(lvalue, rvalue), lerror | rerror, lunknown | runknown)
+            return evaluate
+
+        if expr.op == '!':
+            # Only the negation of tests and connectives, i.e., of booleans.
+            left = self.compileNode(expr.left)
+            if left is None:
+                return None
+
+            def evaluate(columns):
+                (value, error, unknown) = left(columns)
+                return (~value, error, unknown)
+            return evaluate
+
+        if expr.op in test_operators and isinstance(expr.left, Argument) and isinstance(expr.right, Argument) \
+                and not expr.left.constant:
+            if expr.right.constant:
+                return self.compileConstantTest(test_operators[expr.op], expr.left.name[1:], expr.right)
+            return self.compileTest(test_operators[expr.op], expr.left.name[1:], expr.right.name[1:])
+        return None
+
+    def compileConstantTest(self, test, var, constant):
+        # Test of a variable and a constant (unquoted, as in compileConstantTest of the Xfilter).
+        name = constant.name
+        if name.__class__ is not str:
+            return None
+        if name[0] == '"' or name[0] == "'":
+            name = name[1:-1]
+        np = self.np
+        self.vars.add(var)
+
+        # The constant as compared with the values of every kind, or None if the cast raises an error.
+        constants = {STRING: name}
+        for (k, cast) in [(INT, int), (FLOAT, float), (DATETIME, xsd_datetime)]:
+            try:
+                constants[k] = cast(name)
+            except Exception:
+                constants[k] = None
+        if constants[INT] is not None and abs(constants[INT]) >= 1 << 63:
+            del constants[INT]
+        if constants[DATETIME] is not None:
+            constants[DATETIME] = np.datetime64(constants[DATETIME], 'us')
+
+        def evaluate(columns):
+            column = columns[var]
+            n = len(column.kinds)
+            value = np.zeros(n, dtype=bool)
+            error = np.zeros(n, dtype=bool)
+            unknown = column.kinds == OTHER
+            for (k, values) in [(STRING, column.strings), (INT, column.ints), (FLOAT, column.floats),
+                                (DATETIME, column.datetimes)]:
+                rows = column.kinds == k
+                if not rows.any():
+                    continue
+                if k not in constants:
+                    unknown |= rows
+                elif constants[k] is None:
+                    error |= rows
+                else:
+                    value[rows] = test(values[rows], constants[k])
+            return (value, error, unknown)
+        return evaluate
+
+    def compileTest(self, test, left, right):
+        # Test of two variables: values of the same kind, or integers and floats, are compared.
+        np = self.np
+        self.vars.update([left, right])
+
+        def evaluate(columns):
+            lcolumn, rcolumn = columns[left], columns[right]
+            n = len(lcolumn.kinds)
+            value = np.zeros(n, dtype=bool)
+            unknown = np.ones(n, dtype=bool)
+            same = lcolumn.kinds == rcolumn.kinds
+            for (k, lvalues, rvalues) in [(STRING, lcolumn.strings, rcolumn.strings),
+                                          (INT, lcolumn.ints, rcolumn.ints),
+                                          (FLOAT, lcolumn.floats, rcolumn.floats),
+                                          (DATETIME, lcolumn.datetimes, rcolumn.datetimes)]:
+                rows = same & (lcolumn.kinds == k)
+                if rows.any():
+                    value[rows] = test(lvalues[rows], rvalues[rows])
+                    unknown[rows] = False
+            for (lk, rk) in [(INT, FLOAT), (FLOAT, INT)]:
+                rows = (lcolumn.kinds == lk) & (rcolumn.kinds == rk)
+                if rows.any():
+                    ints = lcolumn.ints if lk == INT else rcolumn.ints
+                    rows &= (ints >= -MAX_EXACT_INT) & (ints <= MAX_EXACT_INT)
+                    lvalues = lcolumn.ints if lk == INT else lcolumn.floats
+                    rvalues = rcolumn.ints if rk == INT else rcolumn.floats
+                    value[rows] = test(lvalues[rows], rvalues[rows])
+                    unknown[rows] = False
+            return (value, np.zeros(n, dtype=bool), unknown)
+        return evaluate
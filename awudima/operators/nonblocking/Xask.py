@@ -3,6 +3,9 @@ from multiprocessing import Queue
 
 class Xask(object):
 
+    # Event set when no more results are needed, shared by the operators and wrappers of the query.
+    stopped = None
+
     def __init__(self, vars):
         self.input = Queue()
         self.qresults = Queue()
@@ -18,6 +21,9 @@ class Xask(object):
             self.qresults.put("EOF")
             return
         else:
+            # One tuple is enough: the operators and wrappers of the query stop producing tuples.
+            if self.stopped is not None:
+                self.stopped.set()
             self.qresults.put(True)
             self.qresults.put("EOF")
             return
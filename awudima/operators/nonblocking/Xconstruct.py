@@ -4,6 +4,9 @@ from multiprocessing import Queue
 
 class Xconstruct(object):
 
+    # Event set when no more results are needed, shared by the operators and wrappers of the query.
+    stopped = None
+
     def __init__(self, triples, prefixes, limit=-1):
         self.input = Queue()
         self.qresults = Queue()
@@ -35,6 +38,9 @@ class Xconstruct(object):
             self.qresults.put(".\n".join(result) + '.')
             i += 1
             if 0 < self.limit <= i:
+                # The operators and wrappers of the query stop producing tuples.
+                if self.stopped is not None:
+                    self.stopped.set()
                 break
 
             tuple = self.left.get(True)
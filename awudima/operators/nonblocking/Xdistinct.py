@@ -2,36 +2,164 @@
 Created on Dec 11, 2013
 
 Implements the Xdistinct operator.
-The intermediate results are represented in a queue. 
+The intermediate results are represented in a queue.
+
+Tuples are identified by a 128-bit fingerprint (BLAKE2b digest) of their
+canonical form. The table of the tuples already produced keeps the canonical
+form next to the fingerprint, and tuples with the same fingerprint are
+compared by it, so that a collision never drops a tuple; without verification
+(verify=False) only the 16 bytes of the fingerprint are kept. The fingerprints are
+partitioned by their first byte. When the memory of the operator (or the
+memory budget of the query) is exceeded, the largest partition is moved to
+secondary memory, and the tuples of that partition are appended to it:
+they are produced once the input is finished, partition by partition.
+If the input is ordered (ORDER BY), partitions are kept in main memory,
+so that the tuples are produced in order.
 
 @author: Maribel Acosta Deibe
 '''
 from multiprocessing import Queue
+from hashlib import blake2b
+from awudima.operators.SpillFile import SpillFile
+from awudima.operators.MemoryBudget import MemoryAccount, sizeof
+
+# Number of partitions of the fingerprints.
+PARTITIONS = 16
+
+# Main memory (in bytes) of the operator, if the query has no memory budget.
+MEMORY_SIZE = 1 << 28
+
+# Approximate size (in bytes) of a fingerprint in its partition, i.e., the bytes object and its slot in the dict.
+FINGERPRINT_SIZE = 100
+
+# Number of tuples of a partition in secondary memory that are buffered before they are appended to its file.
+BLOCK_SIZE = 1000
+
+# Keep the canonical form of the tuples, to verify that tuples with the same fingerprint are equal.
+VERIFY = True
+
+
+def canonical(tuple):
+    # Canonical form of a tuple: its (variable, value) pairs in order of the variables.
+    return repr(sorted(tuple.items()))
+
+
+def fingerprint(key):
+    return blake2b(key.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
 
 
 class Xdistinct(object):
-    
-    def __init__(self, vars):
+
+    # MemoryBudget of the query, shared by the hash tables of its operators (None for no limit).
+    memory = None
+
+    # Temporary directory of the query, where the files in secondary memory are created (None for the default).
+    tmpdir = None
+
+    def __init__(self, vars, partitions=PARTITIONS, verify=VERIFY, ordered=False):
         #self.input       = Queue()
         self.qresults = Queue()
         self.vars = vars
-        self.bag = {} 
-        
+        self.partitions = partitions
+        self.verify = verify
+        self.ordered = ordered
+        self.memorySize = MEMORY_SIZE
+        self.account = MemoryAccount()
+
     def execute(self, left, dummy, out, processqueue=Queue()):
         # Executes the Xdistinct.
         self.left = left
         self.qresults = out
+        self.account = MemoryAccount(self.memory)
+        self.spill = SpillFile('.dst', self.tmpdir)
+
+        # Fingerprints of the tuples produced so far, by partition: fingerprint -> canonical form (if verify) or None.
+        # Partitions in secondary memory only buffer up to BLOCK_SIZE tuples.
+        self.tables = [dict() for i in range(self.partitions)]
+        self.buffers = [[] for i in range(self.partitions)]
+        self.sizes = [0] * self.partitions
+        self.spilled = [False] * self.partitions
+
         tuple = self.left.get(True)
-        
         while not(tuple == "EOF"):
-            str_tuple = str(sorted(tuple.items()))
-            get = self.bag.get(str_tuple, False)
-            
-            if not(get):
+            key = canonical(tuple)
+            digest = fingerprint(key)
+            i = digest[0] % self.partitions
+
+            if self.spilled[i]:
+                self.buffers[i].append((digest, key if self.verify else None, tuple))
+                if len(self.buffers[i]) >= BLOCK_SIZE:
+                    self.flushBuffer(i)
+            elif self.insert(self.tables[i], digest, key):
                 self.qresults.put(tuple)
-                self.bag.update({str_tuple: True})
+                size = FINGERPRINT_SIZE + (sizeof({'': key}) if self.verify else 0)
+                self.sizes[i] += size
+                self.account.add(size)
+                if self.exceeded():
+                    self.spillPartition()
             tuple = self.left.get(True)
-            
+
+        # Produce the distinct tuples of the partitions in secondary memory.
+        for i in range(self.partitions):
+            if self.spilled[i]:
+                self.produceSpilled(i)
+
+        self.spill.close()
+        self.account.close()
+
         # Put EOF in queue and exit.
         self.qresults.put("EOF")
         return
+
+    def insert(self, table, digest, key):
+        # Inserts the fingerprint of a tuple in its table. Returns False if the tuple is already in it.
+        if digest not in table:
+            table[digest] = key if self.verify else None
+            return True
+        if not self.verify or table[digest] == key:
+            return False
+        # Different tuples with the same fingerprint: the others are kept by fingerprint and canonical form.
+        digest += key.encode('utf-8', 'surrogatepass')
+        if digest in table:
+            return False
+        table[digest] = key
+        return True
+
+    def exceeded(self):
+        if self.ordered:
+            return False
+        return self.account.size > self.memorySize or self.account.exceeded()
+
+    def spillPartition(self):
+        # Moves the largest partition in main memory to secondary memory.
+        # If all the partitions are in secondary memory already, their buffers are flushed.
+        candidates = [i for i in range(self.partitions) if not self.spilled[i]]
+        if not candidates:
+            for i in range(self.partitions):
+                self.flushBuffer(i)
+            return
+
+        i = max(candidates, key=lambda i: self.sizes[i])
+        self.spilled[i] = True
+        self.spill.append(('seen', i), list(self.tables[i].items()))
+        self.tables[i] = dict()
+        self.account.free(self.sizes[i])
+        self.sizes[i] = 0
+
+    def flushBuffer(self, i):
+        # Appends the buffered tuples of the partition i to secondary memory.
+        buffer = self.buffers[i]
+        if not buffer:
+            return
+        self.spill.append(('tuples', i), buffer)
+        self.buffers[i] = []
+
+    def produceSpilled(self, i):
+        # Produces the tuples of the partition i that were not produced before it was moved to secondary memory.
+        self.flushBuffer(i)
+        table = dict(self.spill.scan(('seen', i)))
+        for (digest, key, tuple) in self.spill.scan(('tuples', i)):
+            if self.insert(table, digest, key):
+                self.qresults.put(tuple)
+        self.spill.remove(('seen', i))
+        self.spill.remove(('tuples', i))
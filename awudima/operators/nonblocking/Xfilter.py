@@ -7,10 +7,22 @@ The intermediate results are represented in a queue.
 @author: Maribel Acosta Deibe
 '''
 from multiprocessing import Queue
+from queue import Empty
 from awudima.pysparql import Expression, Argument
 import datetime
 import operator
 
+def xsd_datetime(value):
+    # datetime of the lexical form of a xsd:dateTime (quoted or not), in UTC if it has a timezone.
+    value = str(value).strip('"\'')
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    value = datetime.datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
 unary_operators = {
         '!': operator.not_,
         '+': '',
@@ -47,7 +59,7 @@ data_types = {
         'double': (float, 'numerical'),
         'string': (str, str),
         'boolean': (bool, bool),
-        'dateTime': (datetime, datetime),
+        'dateTime': (xsd_datetime, datetime.datetime),
         'nonPositiveInteger': (int, 'numerical'),
         'negativeInteger': (int, 'numerical'),
         'long': (int, 'numerical'),
@@ -64,26 +76,67 @@ data_types = {
 
 numerical = (int, int, float)
 
+# Operators that are compiled, i.e., evaluated by closures. Expressions with other operators (e.g., REGEX) are
+# evaluated by the interpreter (evaluateComplexExpression).
+compiled_operators = set(logical_connectives) | set(arithmetic_operators) | set(unary_operators) | set(test_operators)
+
+# Maximum number of tuples of the blocks that are evaluated at once (if numpy is installed); 1 disables the blocks.
+BATCH_SIZE = 1024
+
+# (python type, general type) of the datatypes (IRIs, or typed literal suffixes) seen so far, None if not supported.
+_datatypes = {}
+
+
+def datatype(dt):
+    if dt not in _datatypes:
+        _datatypes[dt] = None
+        for t in data_types.keys():
+            if t in dt:
+                _datatypes[dt] = data_types[t]
+                break
+    return _datatypes[dt]
+
 
 class Xfilter(object):
     
-    def __init__(self, filter):
+    def __init__(self, filter, batch_size=BATCH_SIZE):
         self.input = Queue()
         self.qresults = Queue()
         self.filter = filter
+        self.evaluate = None
+        self.batch_size = batch_size
 
     def execute(self, left, dummy, out, processqueue=Queue()):
         # Executes the Xfilter.
         self.left = left
         self.qresults = out
 
+        # The filter expression is compiled once, if all its operators are supported; otherwise it is interpreted.
+        self.evaluate = self.compileExpression(self.filter.expr.op, self.filter.expr.left, self.filter.expr.right)
+        if self.evaluate is None:
+            expr = self.filter.expr
+            self.evaluate = lambda tuple: self.evaluateComplexExpression(tuple, expr.op, (expr.left, None), (expr.right, None))
+
+        # If numpy is installed, the expression is evaluated over blocks of tuples (if it can be).
+        if self.batch_size > 1:
+            from awudima.operators.nonblocking.VectorFilter import VectorFilter, numpy_available
+            if numpy_available():
+                vector = VectorFilter(self.filter.expr)
+                if vector.vectorizable():
+                    self.executeBlocks(vector)
+                    return
+
         # Apply filter tuple by tuple. 
         tuple = self.left.get(True)
 
         #print 'tuple ', tuple
 
         while tuple != "EOF":
-            (res, _) = self.evaluateComplexExpression(tuple, self.filter.expr.op, (self.filter.expr.left, None), (self.filter.expr.right, None))
+            try:
+                (res, _) = self.evaluate(tuple)
+            except Exception as e:
+                # Errors (e.g., SPARQLTypeError, unbound variables) evaluate to false.
+                res = False
             if res:
                 self.qresults.put(tuple)
 
@@ -94,6 +147,27 @@ class Xfilter(object):
         self.qresults.put("EOF")
         #return
 
+    def executeBlocks(self, vector):
+        # Apply filter block by block: a block has the tuples that are in the queue, up to batch_size.
+        eof = False
+        while not eof:
+            block = [self.left.get(True)]
+            while len(block) < self.batch_size and block[-1] != "EOF":
+                try:
+                    block.append(self.left.get(False))
+                except Empty:
+                    break
+            if block[-1] == "EOF":
+                block.pop()
+                eof = True
+
+            if block:
+                for tuple in vector.filter(block, self.evaluate):
+                    self.qresults.put(tuple)
+
+        # Put EOF in queue and exit.
+        self.qresults.put("EOF")
+
     def __repr__(self):
         return str(self.__class__) + ">>  FILTER (" + str(self.filter.expr.left) + " " + str(self.filter.expr.op) + " " + str(self.filter.expr.right) + ")"
 
@@ -192,6 +266,126 @@ class Xfilter(object):
             pass   
         return res
 
+    def compileExpression(self, operator, expr_left, expr_right):
+        '''
+        Compiles an expression into a closure that evaluates it for a tuple, i.e., the result of
+        evaluateComplexExpression: the operator is dispatched, and the constants are prepared, only once.
+
+        :param operator: operator of the expression
+        :param expr_left: left operand (Expression or Argument)
+        :param expr_right: right operand (Expression or Argument), None for unary operators
+        :return: function of a tuple that returns (value, type), or None if the expression cannot be compiled
+        '''
+        if operator not in compiled_operators or not isinstance(expr_left, (Expression, Argument)):
+            return None
+
+        left = self.compileOperand(expr_left)
+        right = None
+        constant = None
+        if isinstance(expr_right, (Expression, Argument)):
+            # Quoted constants are unquoted only when both operands are arguments (case 5 of the interpreter).
+            unquote = isinstance(expr_left, Argument)
+            right = self.compileOperand(expr_right, unquote)
+            if isinstance(expr_right, Argument) and expr_right.constant:
+                constant = self.constantValue(expr_right, unquote)
+        if left is None or (expr_right is not None and right is None):
+            return None
+
+        if operator in logical_connectives:
+            return self.compileLogicalConnective(operator, left, right)
+        elif operator in arithmetic_operators:
+            evaluateAritmethic = self.evaluateAritmethic
+            if right is None:
+                return lambda tuple: evaluateAritmethic(operator, left(tuple), None)
+            return lambda tuple: evaluateAritmethic(operator, left(tuple), right(tuple))
+        elif operator in unary_operators:
+            evaluateUnaryOperator = self.evaluateUnaryOperator
+            return lambda tuple: evaluateUnaryOperator(operator, left(tuple))
+        elif constant is not None:
+            return self.compileConstantTest(test_operators[operator], left, constant[0])
+        else:
+            return self.compileTest(test_operators[operator], left, right)
+
+    def compileOperand(self, expr, unquote=False):
+        if isinstance(expr, Expression):
+            return self.compileExpression(expr.op, expr.left, expr.right)
+
+        if not expr.constant:
+            var = expr.name[1:]
+            extractValue = self.extractValue
+            return lambda tuple: extractValue(tuple[var])
+
+        value = self.constantValue(expr, unquote)
+        return lambda tuple: value
+
+    def constantValue(self, expr, unquote=False):
+        if unquote and (expr.name[0] == '"' or expr.name[0] == "'"):
+            return (expr.name[1:-1], str)
+        return (expr.name, expr.dtype)
+
+    def compileLogicalConnective(self, operator, left, right):
+        # evaluateLogicalConnective, the EBV of booleans (e.g., results of tests) being themselves.
+        connective = logical_connectives[operator]
+        evaluateLogicalConnective = self.evaluateLogicalConnective
+
+        def evaluate(tuple):
+            res_left, res_right = left(tuple), right(tuple)
+            if res_left[0].__class__ is bool and res_right[0].__class__ is bool:
+                return (connective(res_left[0], res_right[0]), bool)
+            return evaluateLogicalConnective(operator, res_left, res_right)
+        return evaluate
+
+    def compileTest(self, test, left, right):
+        # evaluateTest, with the test operator resolved.
+        def evaluate(tuple):
+            (expr_left, type_left), (expr_right, type_right) = left(tuple), right(tuple)
+            if type(expr_left) == type(expr_right) or \
+                    (isinstance(expr_left, numerical) and isinstance(expr_right, numerical)):
+                return (test(expr_left, expr_right), bool)
+            try:
+                if isinstance(expr_left, numerical):
+                    expr_right = type(expr_left)(expr_right)
+                elif isinstance(expr_right, numerical):
+                    expr_left = type(expr_right)(expr_left)
+                elif isinstance(expr_left, datetime.datetime):
+                    expr_right = xsd_datetime(expr_right)
+                elif isinstance(expr_right, datetime.datetime):
+                    expr_left = xsd_datetime(expr_left)
+                return (test(expr_left, expr_right), bool)
+            except:
+                raise SPARQLTypeError
+        return evaluate
+
+    def compileConstantTest(self, test, left, constant):
+        # evaluateTest against a constant: the constant is converted once to the (numerical or datetime) types it is compared with.
+        constant_type = type(constant)
+        constant_numerical = isinstance(constant, numerical)
+        conversions = {}
+
+        def evaluate(tuple):
+            (expr_left, type_left) = left(tuple)
+            if type(expr_left) == constant_type or (constant_numerical and isinstance(expr_left, numerical)):
+                return (test(expr_left, constant), bool)
+            if isinstance(expr_left, numerical) or isinstance(expr_left, datetime.datetime):
+                ltyp = type(expr_left)
+                if ltyp not in conversions:
+                    try:
+                        conversions[ltyp] = xsd_datetime(constant) if ltyp == datetime.datetime else ltyp(constant)
+                    except:
+                        conversions[ltyp] = SPARQLTypeError
+                expr_right = conversions[ltyp]
+                if expr_right is SPARQLTypeError:
+                    raise SPARQLTypeError
+            else:
+                expr_right = constant
+            try:
+                if not isinstance(expr_left, numerical) and constant_numerical:
+                    expr_left = constant_type(expr_left)
+                return (test(expr_left, expr_right), bool)
+            except:
+                raise SPARQLTypeError
+        return evaluate
+
     '''
     evaluateEBV: calculates whether an argument is an Effective Boolean Value (EBV)
                  according to the definition in the SPARQL documentation 
@@ -304,6 +498,10 @@ class Xfilter(object):
                 elif isinstance(expr_right, numerical):
                     rtype = type(expr_right)
                     expr_left = rtype(expr_left)
+                elif isinstance(expr_left, datetime.datetime):
+                    expr_right = xsd_datetime(expr_right)
+                elif isinstance(expr_right, datetime.datetime):
+                    expr_left = xsd_datetime(expr_left)
                 return (test_operators[operator](expr_left, expr_right), bool)
             except:
                 print("SPARQLTypeError - in Xfilter")
@@ -328,27 +526,26 @@ class Xfilter(object):
         if isinstance(val, dict):
             value = val['value']
             if 'datatype' in val:
-                dt = val['datatype']
-                for t in data_types.keys():
-                    if t in dt:
-                        (python_type, general_type) = data_types[t]
-                        if general_type == bool:
-                            return (value, general_type)
-                        else:
-                            return (python_type(value), general_type)
+                dt = datatype(val['datatype'])
+                if dt is not None:
+                    (python_type, general_type) = dt
+                    if general_type == bool:
+                        return (value, general_type)
+                    else:
+                        return (python_type(value), general_type)
             else:
                 return (value, str)
         else:
             pos = val.find("^^")
             # Handles when the literal is typed.
             if pos > -1:
-                for t in data_types.keys():
-                    if t in val[pos:]:
-                        (python_type, general_type) = data_types[t]
-                        if general_type == bool:
-                            return (val[:pos], general_type)
-                        else:
-                            return (python_type(val[:pos]), general_type)
+                dt = datatype(val[pos:])
+                if dt is not None:
+                    (python_type, general_type) = dt
+                    if general_type == bool:
+                        return (val[:pos], general_type)
+                    else:
+                        return (python_type(val[:pos]), general_type)
             else:
                 return (str(val), str)
 
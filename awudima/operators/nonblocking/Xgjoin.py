@@ -4,21 +4,29 @@ Created on Jul 10, 2011
 Implements the Xgjoin operator.
 The intermediate results are represented as a queue.
 
+Once one of the inputs is finished, the tuples of the other input are only
+probed (semi-join reduction): they are not inserted in the RJTs, unless
+tuples of the finished input with the same join key are in secondary memory.
+Tuples without matches are dropped as soon as they arrive.
+
 @author: Maribel Acosta Deibe
 '''
-import signal
 from multiprocessing import Queue
-from queue import Empty
 from time import time
-from tempfile import NamedTemporaryFile
-from os import remove
 from awudima.operators.Join import Join
+from awudima.operators.JoinKey import key_function
+from awudima.operators.Multiplexer import InputMultiplexer
+from awudima.operators.SpillFile import SpillFile
+from awudima.operators.MemoryBudget import MemoryAccount, sizeof, RECORD_OVERHEAD
 from awudima.operators.nonblocking.GJOperatorStructures import Record, RJTTail, FileDescriptor
 
+# Reduce the input that is not finished by the join keys of the finished one.
+SEMIJOIN = True
+
 
 class Xgjoin(Join):
 
-    def __init__(self, vars):
+    def __init__(self, vars, semijoin=SEMIJOIN):
         self.left_table = dict()
         self.right_table = dict()
         self.qresults = Queue()
@@ -34,19 +42,29 @@ class Xgjoin(Join):
         self.memorySize = 100000000        # Represents the main memory size (# tuples).OLD:Represents the main memory size (in KB).
         self.fileDescriptor_left = {}
         self.fileDescriptor_right = {}
+        # RJTs flushed to secondary memory, by table
+        self.spill_left = SpillFile('.rjt')
+        self.spill_right = SpillFile('.rjt')
         self.memory_left = 0
         self.memory_right = 0
+        # Size (in bytes) of the RJTs in main memory, reported to the memory budget of the query (if any).
+        self.account = MemoryAccount()
 
         self.leftcount = 0
         self.rightcount = 0
 
+        # Semi-join reduction settings
+        self.semijoin = semijoin
+        self.finished = None      # The input that sent its EOF first (0 for left, 1 for right).
+        self.reducedcount = 0     # Tuples that were not inserted in the RJTs.
+
     def instantiate(self, d):
         newvars = self.vars - set(d.keys())
-        return Xgjoin(newvars)
+        return Xgjoin(newvars, self.semijoin)
 
     def instantiateFilter(self, instantiated_vars, filter_str):
         newvars = self.vars - set(instantiated_vars)
-        return Xgjoin(newvars)
+        return Xgjoin(newvars, self.semijoin)
 
     def execute(self, left, right, out, processqueue=Queue()):
         # Executes the Xgjoin.
@@ -54,119 +72,95 @@ class Xgjoin(Join):
         self.left = left
         self.right = right
         self.qresults = out
+        self.key = key_function(self.vars)
+        self.account = MemoryAccount(self.memory)
+        # Partitions are flushed to the temporary directory of the query.
+        self.spill_left.dir = self.spill_right.dir = self.tmpdir
 
-        # Initialize tuples.
-        tuple1 = None
-        tuple2 = None
-
-        # Create alarm to go to stage 2.
-        signal.signal(signal.SIGALRM, self.stage2)
+        # Multiplex both inputs: sleep until one of the sources sends data.
+        inputs = InputMultiplexer(self.left, self.right, stopped=self.stopped)
 
         # Get the tuples from the queues.
-        while tuple1 != "EOF" or tuple2 != "EOF":
-            # Try to get and process tuple from left queue.
-            if tuple1 != "EOF":
-                try:
-                    tuple1 = self.left.get(False)
-                    # print "tuple1", tuple1
+        while len(inputs) > 0:
+            item = inputs.get(self.timeoutSecondStage)
+            if item is None:
+                # Both sources are blocked: go to stage 2.
+                self.stage2(None, None)
+                continue
+
+            (side, tuple) = item
+            if tuple == "EOF":
+                if self.finished is None:
+                    self.finished = side
+                continue
+
+            try:
+                if side == 0:
+                    # Process tuple from left queue.
                     self.leftcount += 1
-                    signal.alarm(self.timeoutSecondStage)
-                    self.stage1(tuple1, self.left_table, self.right_table)
-                    self.memory_right += 1
-                except Empty:
-                    # Empty: in tuple1 = self.left.get(False), when the queue is empty.
-                    pass
-                except TypeError as te:
-                    print("TypeError: in resource = resource + tuple[var]", tuple, te)
-                    # TypeError: in resource = resource + tuple[var], when the tuple is "EOF".
-                    pass
-                except IOError:
-                    # IOError: when a tuple is received, but the alarm is fired.
-                    print("IOError, tuple1")
-                    self.sourcesBlocked = False
-                    pass
-
-            # Try to get and process tuple from right queue.
-            if tuple2 != "EOF":
-                try:
-                    tuple2 = self.right.get(False)
-                    # print "tuple2", tuple2
+                    if self.stage1(tuple, self.left_table, self.right_table,
+                                   self.fileDescriptor_left if self.reduce(1) else None):
+                        self.memory_right += 1
+                else:
+                    # Process tuple from right queue.
                     self.rightcount += 1
-                    signal.alarm(self.timeoutSecondStage)
-                    self.stage1(tuple2, self.right_table, self.left_table)
-                    self.memory_left += 1
-                except Empty:
-                    # Empty: in tuple2 = self.right.get(False), when the queue is empty.
-                    pass
-                except TypeError as te:
-                    print("TypeError: in resource = resource + tuple[var]", tuple, te)
-                    # TypeError: in resource = resource + tuple[var], when the tuple is "EOF".
-                    pass
-                except IOError:
-                    print("IOError: tupel2")
-                    # IOError: when a tuple is received, but the alarm is fired.
-                    self.sourcesBlocked = False
-                    pass
+                    if self.stage1(tuple, self.right_table, self.left_table,
+                                   self.fileDescriptor_right if self.reduce(0) else None):
+                        self.memory_left += 1
+            except TypeError as te:
+                # TypeError: in resource = resource + tuple[var].
+                print("TypeError: in resource = resource + tuple[var]", tuple, te)
 
             #print "(LEFT, RIGHT) = >", self.leftcount, self.rightcount, self.vars
             if (len(self.left_table) + len(self.right_table) >= self.memorySize):
                 self.flushRJT()
+            elif self.account.exceeded():
+                # The memory budget of the query is exceeded.
+                self.spill()
 
                 #print "Flushed RJT!"
-        # Turn off alarm to stage 2.
-        signal.alarm(0)
         # Perform the last probes.
         self.stage3()
         return
 
-    def stage1(self, tuple, tuple_rjttable, other_rjttable):
+    def reduce(self, side):
+        # Tuples of the other input are reduced if the input side is finished.
+        return self.semijoin and self.finished == side
+
+    def stage1(self, tuple, tuple_rjttable, other_rjttable, filedescriptor=None):
         #print " Stage 1: While one of the sources is sending data."
+        # Returns True if the tuple is inserted in the other RJT table.
         if tuple != "EOF":
-            # Get the resource associated to the tuples.
-            resource = ''
-            for var in self.vars:
-                if var in tuple:
-                    val = tuple[var]
-                    # if isinstance(val, dict) and 'value' in val:
-                    #     val = val['value']
-
-                    suffix = ''
-                    # if 'datatype' in val:
-                    #     if isinstance(val['datatype'], bytes):
-                    #         suffix = "^^<" + val['datatype'].decode('utf-8') + ">"
-                    #     else:
-                    #         suffix = "^^<" + val['datatype'] + ">"
-                    #
-                    if isinstance(val, dict):
-
-                        if "xml:lang" in val:
-                            suffix = '@' + val['xml:lang']
-                        try:
-                            if isinstance(val['value'], bytes):
-                                val = val['value'].decode('utf-8') + suffix
-                            else:
-                                val = val['value'] + suffix
-                        except:
-                            val = val['value'] + suffix
-                    # if "^^<" in val:
-                    #     val = val[:val.find('^^<')]
-                    resource = resource + str(val)
+            # Get the join key of the tuple.
+            resource = self.key(tuple)
 
             # Probe the tuple against its RJT table.
             probeTS = self.probe(tuple, resource, tuple_rjttable)
 
+            if filedescriptor is not None and resource not in filedescriptor:
+                # Semi-join reduction: the other input is finished, and its tuples with this key (if any)
+                # are in main memory and were just probed, so the tuple is not joined later.
+                self.reducedcount += 1
+                return False
+
             # Create the records.
             record = Record(tuple, probeTS, time(), float("inf"))
+            size = sizeof(tuple) + RECORD_OVERHEAD
 
             # Insert the record in the other RJT table.
             if resource in other_rjttable:
-                other_rjttable.get(resource).updateRecords(record)
-                other_rjttable.get(resource).setRJTProbeTS(probeTS)
+                tail = other_rjttable.get(resource)
+                tail.updateRecords(record)
+                tail.setRJTProbeTS(probeTS)
+                tail.size += size
                 #other_rjttable.get(resource).append(record)
             else:
                 tail = RJTTail(record, probeTS)
+                tail.size = size
                 other_rjttable[resource] = tail
                 #other_rjttable[resource] = [record]
+            self.account.add(size)
+            return True
             # print('probing:', tuple)
             # print('resource:', resource)
             # print('left:', self.left_table)
@@ -186,18 +180,12 @@ class Xgjoin(Join):
             if resources1:
                 resource = resources1.pop()
                 rjts1 = self.left_table[resource].records
-                for rjt1 in rjts1:
-                    probed = self.probeFile(rjt1, self.fileDescriptor_right, resource, 2)
-                    if probed:
-                        rjt1.probeTS = time()
+                self.probeFile(rjts1, self.fileDescriptor_right, resource, 2)
 
             elif resources2:
                 resource = resources2.pop()
                 rjts1 = self.right_table[resource].records
-                for rjt1 in rjts1:
-                    probed = self.probeFile(rjt1, self.fileDescriptor_left, resource, 2)
-                    if probed:
-                        rjt1.probeTS = time()
+                self.probeFile(rjts1, self.fileDescriptor_left, resource, 2)
 
         # End of second stage.
         self.lastSecondStageTS = time()
@@ -231,40 +219,28 @@ class Xgjoin(Join):
         common_resources = set(self.left_table.keys()) & set(self.fileDescriptor_right.keys())
         for resource in common_resources:
             rjts1 = self.left_table[resource].records
-            for rjt1 in rjts1:
-                self.probeFile(rjt1, self.fileDescriptor_right, resource, 3)
+            self.probeFile(rjts1, self.fileDescriptor_right, resource, 3)
 
         # RJTs in main (right) memory are probed against RJTs in secondary (left) memory.
         common_resources = set(self.right_table.keys()) & set(self.fileDescriptor_left.keys())
         for resource in common_resources:
             rjts1 = self.right_table[resource].records
-            for rjt1 in rjts1:
-                self.probeFile(rjt1, self.fileDescriptor_left, resource, 3)
+            self.probeFile(rjts1, self.fileDescriptor_left, resource, 3)
 
         # RJTs in secondary memory are probed to produce new results.
         common_resources = set(self.fileDescriptor_left.keys()) & set(self.fileDescriptor_right.keys())
         for resource in common_resources:
-            file1 = open(self.fileDescriptor_right[resource].file.name)
-            rjts1 = file1.readlines()
-            for rjt1 in rjts1:
-                (tuple1, probeTS1, insertTS1, flushTS1) = rjt1.split('|')
-                self.probeFile(Record(eval(tuple1), float(probeTS1), float(insertTS1), float(flushTS1)), self.fileDescriptor_left, resource, 3)
-            file1.close()
+            rjts1 = self.readRJT(self.fileDescriptor_right, resource)
+            self.probeFile(rjts1, self.fileDescriptor_left, resource, 3)
 
         for resource in common_resources:
-            file1 = open(self.fileDescriptor_left[resource].file.name)
-            rjts1 = file1.readlines()
-            for rjt1 in rjts1:
-                (tuple1, probeTS1, insertTS1, flushTS1) = rjt1.split('|')
-                self.probeFile(Record(eval(tuple1), float(probeTS1), float(insertTS1), float(flushTS1)), self.fileDescriptor_right, resource, 3)
-            file1.close()
+            rjts1 = self.readRJT(self.fileDescriptor_left, resource)
+            self.probeFile(rjts1, self.fileDescriptor_right, resource, 3)
 
         # Delete files from secondary memory.
-        for resource in self.fileDescriptor_left:
-            remove(self.fileDescriptor_left[resource].file.name)
-
-        for resource in self.fileDescriptor_right:
-            remove(self.fileDescriptor_right[resource].file.name)
+        self.spill_left.close()
+        self.spill_right.close()
+        self.account.close()
 
         # Put EOF in queue and exit.
         self.qresults.put("EOF")
@@ -288,49 +264,43 @@ class Xgjoin(Join):
 
         return probeTS
 
-    def probeFile(self, rjt1, filedescriptor2, resource, stage):
-        # Probe an RJT against its corresponding partition in secondary memory.
+    def probeFile(self, rjts1, filedescriptor2, resource, stage):
+        # Probe RJTs against their corresponding partition in secondary memory.
 
-        file2 = open(filedescriptor2[resource].file.name, 'r')
-        rjts2 = file2.readlines()
-        st = ""
+        rjts2 = self.readRJT(filedescriptor2, resource)
         probed = False
 
-        for rjt2 in rjts2:
-            (tuple2, probeTS2, insertTS2, flushTS2) = rjt2.split('|')
-            probedStage1 = False
-            probedStage2 = False
-
-            #Checking Property 2: Probed in stage 2.
-            for ss in self.secondStagesTS:
-                if (float(flushTS2) < rjt1.insertTS and rjt1.insertTS < ss and ss < rjt1.flushTS):
-                    probedStage2 = True
-                    break
-
-            # Checking Property 1: Probed in stage 1.
-            if rjt1.probeTS < float(flushTS2):
-                probedStage1 = True
-
-            # Produce result if it has not been produced.
-            if (not(probedStage1) and not(probedStage2)):
-                res = rjt1.tuple.copy()
-                res.update(eval(tuple2))
-                self.qresults.put(res)
-                probed = True
-
-            # Update probeTS of tuple2.
-            stprobeTS = "%.40r" % (time())
-            st = st + tuple2 + '|' + stprobeTS + '|' + insertTS2 + '|' + flushTS2
+        for rjt1 in rjts1:
+            for rjt2 in rjts2:
+                probedStage1 = False
+                probedStage2 = False
+
+                #Checking Property 2: Probed in stage 2.
+                for ss in self.secondStagesTS:
+                    if (rjt2.flushTS < rjt1.insertTS and rjt1.insertTS < ss and ss < rjt1.flushTS):
+                        probedStage2 = True
+                        break
+
+                # Checking Property 1: Probed in stage 1.
+                if rjt1.probeTS < rjt2.flushTS:
+                    probedStage1 = True
+
+                # Produce result if it has not been produced.
+                if (not(probedStage1) and not(probedStage2)):
+                    res = rjt1.tuple.copy()
+                    res.update(rjt2.tuple)
+                    self.qresults.put(res)
+                    probed = True
+
+        # The results produced in stage 2 are recognized by Property 2 in later probes, so probeTS is not updated
+        # (otherwise Property 1 no longer holds for the pairs already joined in stage 1).
+        return probed
 
-        file2.close()
+    def readRJT(self, filedescriptor, resource):
+        # Read an RJT from secondary memory.
 
-        # Update file2 if in stage 2.
-        if ((stage == 2) and probed):
-            file2 = open(filedescriptor2[resource].file.name, 'w')
-            file2.write(st)
-            file2.close()
-
-        return probed
+        return [Record(tuple, probeTS, insertTS, flushTS)
+                for (tuple, probeTS, insertTS, flushTS) in filedescriptor[resource].file.read(resource)]
 
     def flushRJT(self):
         # Flush an RJT to secondary memory.
@@ -341,45 +311,63 @@ class Xgjoin(Join):
 
         # Flush resource from left table.
         if least_ts1 <= least_ts2:
-            file_descriptor = self.fileDescriptor_left
             table = self.left_table
             resource_to_flush = resource_to_flush1
-            tail_to_flush = tail_to_flush1
 
         # Flush resource from right table.
         if least_ts2 < least_ts1:
-            file_descriptor = self.fileDescriptor_right
             table = self.right_table
             resource_to_flush = resource_to_flush2
-            tail_to_flush = tail_to_flush2
 
-        # Create flush timestamp.
+        if resource_to_flush not in table:
+            # Both tables are empty.
+            return
+
+        self.flushTail(table, resource_to_flush, time())
+
+    def spill(self):
+        # Flush the coldest RJTs (i.e., least recently probed) of both tables,
+        # until the RJTs in main memory take at most half of their current size.
+
+        target = self.account.size / 2
+        tails = [(tail.rjtProbeTS, -len(tail.records), i, resource)
+                 for i, table in enumerate([self.left_table, self.right_table])
+                 for resource, tail in table.items()]
+        tails.sort(key=lambda t: t[:3])
+
+        # All the RJTs are flushed with the same timestamp.
         flushTS = time()
+        for (probeTS, size, i, resource) in tails:
+            if self.account.size <= target:
+                break
+            self.flushTail(self.right_table if i else self.left_table, resource, flushTS)
+
+    def flushTail(self, table, resource_to_flush, flushTS):
+        # Flush the RJT of the resource to secondary memory, with the given flush timestamp.
+
+        if table is self.left_table:
+            file_descriptor = self.fileDescriptor_left
+            spill = self.spill_left
+        else:
+            file_descriptor = self.fileDescriptor_right
+            spill = self.spill_right
+        tail_to_flush = table[resource_to_flush]
+
+        # Flush tail in file.
+        spill.append(resource_to_flush, [(record.tuple, record.probeTS, record.insertTS, flushTS)
+                                         for record in tail_to_flush.records])
 
         # Update file descriptor
         if resource_to_flush in file_descriptor:
             lentail = file_descriptor[resource_to_flush].size
-            file = open(file_descriptor[resource_to_flush].file.name, 'a')
-            file_descriptor.update({resource_to_flush: FileDescriptor(file, len(tail_to_flush.records) + lentail, flushTS)})
+            file_descriptor[resource_to_flush].size = len(tail_to_flush.records) + lentail
+            file_descriptor[resource_to_flush].lastFlushTS = flushTS
         else:
-            file = NamedTemporaryFile(suffix=".rjt", prefix="", delete=False)
-            file_descriptor.update({resource_to_flush: FileDescriptor(file, len(tail_to_flush.records), flushTS)})
-
-        # Flush tail in file.
-        for record in tail_to_flush.records:
-            sttuple = str(record.tuple)
-            stprobeTS = "%.40r" % (record.probeTS)
-            stinsertTS = "%.40r" % (record.insertTS)
-            stflushTS = "%.40r" % (flushTS)
-
-            file.write(sttuple + '|')
-            file.write(stprobeTS + '|')
-            file.write(stinsertTS + '|')
-            file.write(stflushTS + '\n')
-        file.close()
+            file_descriptor.update({resource_to_flush: FileDescriptor(spill, len(tail_to_flush.records), flushTS)})
 
         # Delete resource from main memory.
         del table[resource_to_flush]
+        self.account.free(tail_to_flush.size)
 
     def getVictim(self, table):
         # Selects a victim from a partition in main memory to flush.
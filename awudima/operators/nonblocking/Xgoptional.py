@@ -9,6 +9,10 @@ The intermediate results are represented as queues.
 from multiprocessing import Queue
 from time import time
 from awudima.operators.Optional import Optional
+from awudima.operators.JoinKey import key_function
+from awudima.operators.Multiplexer import InputMultiplexer
+from awudima.operators.SpillFile import SpillFile
+from awudima.operators.MemoryBudget import MemoryAccount, sizeof, RECORD_OVERHEAD
 from awudima.operators.nonblocking.GJOperatorStructures import Record, RJTTail
 
 
@@ -18,11 +22,18 @@ class Xgoptional(Optional):
         self.left_table = dict()
         self.right_table = dict()
         self.qresults = Queue()
+        # Left tuples that could not be inserted in the tables, i.e., without matches.
         self.bag = []
         self.vars_left = set(vars_left)
         self.vars_right = set(vars_right)
         self.vars = list(self.vars_left & self.vars_right)
 
+        # RJTs flushed to secondary memory, by table
+        self.spill_left = SpillFile('.rjt')
+        self.spill_right = SpillFile('.rjt')
+        # Size (in bytes) of the RJTs in main memory, reported to the memory budget of the query (if any).
+        self.account = MemoryAccount()
+
     def instantiate(self, d):
         newvars_left = self.vars_left - set(d.keys())
         newvars_right = self.vars_right - set(d.keys())
@@ -39,42 +50,36 @@ class Xgoptional(Optional):
         self.left = left
         self.right = right
         self.qresults = out
+        self.key = key_function(self.vars)
+        self.account = MemoryAccount(self.memory)
+        # Partitions are flushed to the temporary directory of the query.
+        self.spill_left.dir = self.spill_right.dir = self.tmpdir
 
-        # Initialize tuples.
-        tuple1 = None
-        tuple2 = None
+        # Multiplex both inputs: sleep until one of them sends data.
+        inputs = InputMultiplexer(self.left, self.right, stopped=self.stopped)
 
         # Get the tuples from the queues.
-        while (not(tuple1 == "EOF") or not(tuple2 == "EOF")):
-            # Try to get and process tuple from left queue.
-
-            if not(tuple1 == "EOF"):
-
-                try:
-                    tuple1 = self.left.get(False)
-                    if not(tuple1 == "EOF"):
-                        self.bag.append(tuple1)
-                    self.stage1(tuple1, self.left_table, self.right_table, self.vars_right)
-                    #print  "bag after stage 1: ", self.bag
-                except Exception as e:
-                    # This catch:
-                 #   print "Exception ", e.message
-                    # Empty: in tuple2 = self.right.get(False), when the queue is empty.
-                    # TypeError: in resource = resource + tuple[var], when the tuple is "EOF".
-                    pass
-
-            # Try to get and process tuple from right queue.
-            if not(tuple2 == "EOF"):
-
-                try:
-                    tuple2 = self.right.get(False)
-                    if not(tuple2 == "EOF"):
-                        self.stage1(tuple2, self.right_table, self.left_table, self.vars_left)
-                except Exception:
-                    # This catch:
-                    # Empty: in tuple2 = self.right.get(False), when the queue is empty.
-                    # TypeError: in resource = resource + tuple[var], when the tuple is "EOF".
-                    pass
+        while len(inputs) > 0:
+            (side, tuple) = inputs.get()
+            if tuple == "EOF":
+                continue
+
+            try:
+                if side == 0:
+                    # Process tuple from left queue.
+                    self.stage1(tuple, self.left_table, self.right_table, self.vars_right)
+                else:
+                    # Process tuple from right queue.
+                    self.stage1(tuple, self.right_table, self.left_table, self.vars_left)
+            except Exception:
+                # This catch:
+                # TypeError: in resource = resource + tuple[var].
+                if side == 0:
+                    self.bag.append(tuple)
+
+            if self.account.exceeded():
+                # The memory budget of the query is exceeded.
+                self.spill()
 
         #print " Perform the last probes."
         self.stage3()
@@ -82,55 +87,30 @@ class Xgoptional(Optional):
     def stage1(self, tuple, tuple_rjttable, other_rjttable, vars):
         # Stage 1: While one of the sources is sending data.
         #print "stage 1"
-        # Get the resource associated to the tuples.
-        resource = ''
-        for var in self.vars:
-            if var in tuple:
-                val = tuple[var]
-                # if isinstance(val, dict) and 'value' in val:
-                #     val = val['value']
-
-                suffix = ''
-                # if 'datatype' in val:
-                #     if isinstance(val['datatype'], bytes):
-                #         suffix = "^^<" + val['datatype'].decode('utf-8') + ">"
-                #     else:
-                #         suffix = "^^<" + val['datatype'] + ">"
-                #
-                if isinstance(val, dict):
-
-                    if "xml:lang" in val:
-                        suffix = '@' + val['xml:lang']
-                    try:
-                        if isinstance(val['value'], bytes):
-                            val = val['value'].decode('utf-8') + suffix
-                        else:
-                            val = val['value'] + suffix
-                    except:
-                        val = val['value'] + suffix
-                # if "^^<" in val:
-                #     val = val[:val.find('^^<')]
-                resource = resource + str(val)
-
-            #resource = resource + tuple[var]
+        # Get the join key of the tuple.
+        resource = self.key(tuple)
 
         #print "probe"
         # Probe the tuple against its RJT table.
         probeTS = self.probe(tuple, resource, tuple_rjttable, vars)
         #print "creating record"
         # Create the records.
-        record = Record(tuple, probeTS, time())
+        record = Record(tuple, probeTS, time(), float("inf"))
+        size = sizeof(tuple) + RECORD_OVERHEAD
         #print "Stage 1"
         # Insert the record in the other RJT table.
-        # TODO: use RJTTail. Check ProbeTS
         if resource in other_rjttable:
-            other_rjttable.get(resource).updateRecords(record)
-            other_rjttable.get(resource).setRJTProbeTS(probeTS)
+            tail = other_rjttable.get(resource)
+            tail.updateRecords(record)
+            tail.setRJTProbeTS(probeTS)
+            tail.size += size
             #other_rjttable.get(resource).append(record)
         else:
-            tail = RJTTail(record, float("inf"))
+            tail = RJTTail(record, probeTS)
+            tail.size = size
             other_rjttable[resource] = tail
             #other_rjttable[resource] = [record]
+        self.account.add(size)
 
     #def stage2(self):
         # Stage 2: When both sources become blocked.
@@ -170,9 +150,32 @@ class Xgoptional(Optional):
     def stage3(self):
         # Stage 3: When both sources sent all the data.
         #print "stage 3"
+        # RJTs in secondary memory are probed: produce the pairs that were not joined in main memory.
+        common_resources = (set(self.spill_left.keys()) | set(self.spill_right.keys())) & \
+                           (set(self.left_table.keys()) | set(self.spill_left.keys())) & \
+                           (set(self.right_table.keys()) | set(self.spill_right.keys()))
+        for resource in common_resources:
+            rjts_right = self.readRJT(self.spill_left, self.left_table, resource)
+            rjts_left = self.readRJT(self.spill_right, self.right_table, resource)
+            for rjt1 in rjts_left:
+                for rjt2 in rjts_right:
+                    (first, last) = (rjt1, rjt2) if rjt1.insertTS < rjt2.insertTS else (rjt2, rjt1)
+                    # The pair was joined in main memory if the first record was not flushed when the last one probed.
+                    if first.flushTS > last.probeTS:
+                        continue
+                    res = rjt2.tuple.copy()
+                    res.update(rjt1.tuple)
+                    todel = []
+                    for var, val in res.items():
+                        if res[var] == '':
+                            todel.append(var)
+                    for var in todel:
+                        del res[var]
+                    self.qresults.put(res)
+
         # This is the optional: Produce tuples that haven't matched already.
         #print "Length of data in xgoptional(): ", len(self.bag)
-        for tuple in self.bag:
+        for tuple in self.unmatched():
             #print 'stage 3 loop in bag'
             res_right = {}
             for var in self.vars_right:
@@ -187,10 +190,55 @@ class Xgoptional(Optional):
                 del res[var]
             self.qresults.put(res)
 
+        # Delete files from secondary memory.
+        self.spill_left.close()
+        self.spill_right.close()
+        self.account.close()
+
         # Put EOF in queue and exit.
         self.qresults.put("EOF")
         return
 
+    def unmatched(self):
+        # Left tuples without right tuples of the same resource, in main or secondary memory.
+        for tuple in self.bag:
+            yield tuple
+
+        for resource in set(self.right_table.keys()) | set(self.spill_right.keys()):
+            if resource in self.left_table or resource in self.spill_left:
+                continue
+            for record in self.readRJT(self.spill_right, self.right_table, resource):
+                yield record.tuple
+
+    def readRJT(self, spill, table, resource):
+        # Records of the RJT of a resource, in secondary and main memory.
+
+        records = [Record(tuple, probeTS, insertTS, flushTS)
+                   for (tuple, probeTS, insertTS, flushTS) in spill.read(resource)]
+        if resource in table:
+            records.extend(table[resource].records)
+        return records
+
+    def spill(self):
+        # Flush the coldest RJTs (i.e., least recently probed) of both tables to secondary memory,
+        # until the RJTs in main memory take at most half of their current size.
+
+        target = self.account.size / 2
+        tails = [(tail.rjtProbeTS, -len(tail.records), i, resource)
+                 for i, table in enumerate([self.left_table, self.right_table])
+                 for resource, tail in table.items()]
+        tails.sort(key=lambda t: t[:3])
+
+        flushTS = time()
+        for (probeTS, size, i, resource) in tails:
+            if self.account.size <= target:
+                break
+            (table, spill) = (self.right_table, self.spill_right) if i else (self.left_table, self.spill_left)
+            tail = table.pop(resource)
+            spill.append(resource, [(record.tuple, record.probeTS, record.insertTS, flushTS)
+                                    for record in tail.records])
+            self.account.free(tail.size)
+
     def probe(self, tuple, resource, rjttable, vars):
         probeTS = time()
         # If the resource is in table, produce results.
@@ -198,11 +246,6 @@ class Xgoptional(Optional):
             if resource in rjttable:
                 rjttable.get(resource).setRJTProbeTS(probeTS)
                 list_records = rjttable[resource].records
-                # Delete tuple from bag.
-                try:
-                    self.bag.remove(tuple)
-                except ValueError:
-                    pass
 
                 for record in list_records:
                     #print "record: ", type(record.tuple), record.tuple
@@ -216,12 +259,6 @@ class Xgoptional(Optional):
                         for var in todel:
                             del res[var]
                         self.qresults.put(res)
-
-                        # Delete tuple from bag.
-                        try:
-                            self.bag.remove(record.tuple)
-                        except ValueError:
-                            pass
         except Exception as e:
             pass
         return probeTS
@@ -10,6 +10,9 @@ from multiprocessing import Queue
 
 
 class Xlimit(object):
+
+    # Event set when no more results are needed, shared by the operators and wrappers of the query.
+    stopped = None
     
     def __init__(self, vars, limit):
         self.input = Queue()
@@ -30,6 +33,10 @@ class Xlimit(object):
             count = count + 1
             tuple = self.left.get(True)
 
+        if count >= self.limit and self.stopped is not None:
+            # The operators and wrappers of the query stop producing tuples.
+            self.stopped.set()
+
         # Put EOF in queue and exit. 
         self.qresults.put("EOF")
         processqueue.put("EOF")
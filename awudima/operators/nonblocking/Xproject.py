@@ -10,6 +10,9 @@ from multiprocessing import Queue
 
 
 class Xproject(object):
+
+    # Event set when no more results are needed, shared by the operators and wrappers of the query.
+    stopped = None
     
     def __init__(self, vars, limit=-1):
         self.input = Queue()
@@ -35,6 +38,9 @@ class Xproject(object):
                 self.qresults.put(res)
                 i += 1
                 if 0 < self.limit <= i:
+                    # The operators and wrappers of the query stop producing tuples.
+                    if self.stopped is not None:
+                        self.stopped.set()
                     break
             tuple = self.left.get(True)
 
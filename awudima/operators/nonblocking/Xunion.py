@@ -4,129 +4,115 @@ Created on Jul 10, 2011
 Implements the Xunion operator.
 The intermediate results are represented in a queue.
 
+The operator merges any number of inputs: a tree of unions in the plan is
+executed by a single Xunion over the inputs of the tree. Tuples are read from
+whichever input has data, and the variables an input does not bind are padded
+with a template built once per input. Optionally (for DISTINCT queries),
+tuples already produced are filtered out by their fingerprint on the
+variables of the union (verified with their canonical form, as in Xdistinct);
+the filter is dropped if it exceeds its memory, since the distinct operator
+of the query removes the remaining duplicates.
+
 @author: Maribel Acosta Deibe
 '''
 from multiprocessing import Queue
-from queue import Empty
 from awudima.operators.Union import _Union
+from awudima.operators.Multiplexer import InputMultiplexer
+from awudima.operators.MemoryBudget import MemoryAccount, sizeof
+from awudima.operators.nonblocking.Xdistinct import fingerprint, FINGERPRINT_SIZE, VERIFY
+
+# Main memory (in bytes) of the duplicate filter, if the query has no memory budget.
+MEMORY_SIZE = 1 << 26
 
 
 class Xunion(_Union):
 
-    def __init__(self, vars_left, vars_right):
+    # MemoryBudget of the query, shared by the hash tables of its operators (None for no limit).
+    memory = None
+
+    def __init__(self, vars_left, vars_right, distinct=False):
         self.left = Queue()
         self.right = Queue()
         self.qresults = Queue()
         self.vars_left = vars_left
         self.vars_right = vars_right
+        # Filter out duplicated tuples.
+        self.distinct = distinct
+        self.memorySize = MEMORY_SIZE
         self.count = 0
 
     def instantiate(self, d):
         newvars_left = self.vars_left - set(d.keys())
         newvars_right = self.vars_right - set(d.keys())
-        #return Xunion(newvars_left, newvars_right, self.distinct)
-        return Xunion(newvars_left, newvars_right)
+        return Xunion(newvars_left, newvars_right, self.distinct)
 
     def instantiateFilter(self, instantiated_vars, filter_str):
         newvars_left = self.vars_left - set(instantiated_vars)
         newvars_right = self.vars_right - set(instantiated_vars)
-        return Xunion(newvars_left, newvars_right)
+        return Xunion(newvars_left, newvars_right, self.distinct)
 
     def execute(self, left, right, out, processqueue=Queue()):
         # Executes the Xunion.
         self.left = left
         self.right = right
-        self.qresults = out
-        #print "left", hex(id(left)), "right", hex(id(right)), "out", hex(id(out))
+        self.executeInputs([left, right], [self.vars_left, self.vars_right], out)
 
-        # Identify the kind of union to perform.
-        if self.vars_left == self.vars_right:
-            self.sameVariables()
-        else:
-            self.differentVariables()
+    def executeInputs(self, inputs, vars_inputs, out):
+        '''
+        Executes the Xunion over a list of inputs.
+
+        :param inputs: queues of the inputs
+        :param vars_inputs: variables of every input
+        :param out: output queue
+        '''
+        self.qresults = out
+        vars_union = set()
+        for vars in vars_inputs:
+            vars_union |= set(vars)
+        vars_union = sorted(vars_union)
+
+        # Empty values of the variables that are not in an input, None if the input has all of them.
+        templates = []
+        for vars in vars_inputs:
+            missing = [var for var in vars_union if var not in vars]
+            templates.append(dict.fromkeys(missing, '') if missing else None)
+
+        # Fingerprints of the tuples produced so far: fingerprint -> canonical form (if verify) or None.
+        seen = dict() if self.distinct else None
+        account = MemoryAccount(self.memory)
+
+        # Multiplex the inputs: sleep until one of them sends data.
+        multiplexer = InputMultiplexer(*inputs, stopped=self.stopped)
+
+        # Get the tuples from the queues, and concatenate with the empty values.
+        while len(multiplexer) > 0:
+            (i, tuple) = multiplexer.get()
+            if tuple == "EOF":
+                continue
+            if templates[i] is not None:
+                res = templates[i].copy()
+                res.update(tuple)
+                tuple = res
+
+            if seen is not None:
+                key = repr([tuple.get(var, '') for var in vars_union])
+                digest = fingerprint(key)
+                if digest in seen:
+                    # Duplicated tuple, unless its canonical form is different (then the distinct operator filters it).
+                    if not VERIFY or seen[digest] == key:
+                        continue
+                else:
+                    seen[digest] = key if VERIFY else None
+                    account.add(FINGERPRINT_SIZE + (sizeof({'': key}) if VERIFY else 0))
+                if account.size > self.memorySize or account.exceeded():
+                    # Stop filtering: the distinct operator of the query removes the duplicates.
+                    seen = None
+                    account.free(account.size)
+
+            self.count += 1
+            self.qresults.put(tuple)
+
+        account.close()
 
         # Put EOF in queue and exit.
         self.qresults.put("EOF")
-
-    def sameVariables(self):
-        # Executes the Xunion operator when the variables are the same.
-        
-        # Initialize tuples.
-        tuple1 = None
-        tuple2 = None
-
-        # Get the tuples from the queues.
-        while tuple1 != "EOF" or tuple2 != "EOF":
-            if tuple1 != "EOF":
-                try:
-                    tuple1 = self.left.get(False)
-                    if tuple1 != "EOF":
-                        self.count += 1
-                        self.qresults.put(tuple1)
-                except Empty:
-                    # This catch:
-                    # Empty: in tuple1 = self.left.get(False), when the queue is empty.
-                    pass
-
-            if tuple2 != "EOF":
-                try:
-                    tuple2 = self.right.get(False)
-                    if tuple2 != "EOF":
-                        self.count += 1
-                        self.qresults.put(tuple2)
-                        
-                except Empty:
-                    # This catch:
-                    # Empty: in tuple2 = self.right.get(False), when the queue is empty.
-                    pass
-
-    def differentVariables(self):
-        # Executes the Xunion operator when the variables are not the same.
-        
-        # Initialize tuples.
-        tuple1 = None
-        tuple2 = None
-        
-        # Initialize empty tuples.
-        v1 = {}
-        v2 = {}
-        
-        # Add empty values to variables of the other argument.
-        for v in self.vars_right:
-            v1.update({v: ''})
-            
-        for v in self.vars_left:
-            v2.update({v: ''})
-
-        # Get the tuples from the queues.
-        while (not(tuple1 == "EOF") or not(tuple2 == "EOF")):
-
-            # Get tuple from left queue, and concatenate with empty tuple.
-            if not(tuple1 == "EOF"):
-                try:
-                    tuple1 = self.left.get(False)
-                    if not(tuple1 == "EOF"):
-                        res = {}
-                        res.update(v1)
-                        res.update(tuple1)
-                        self.qresults.put(res)
-                        #print(tuple1)
-                except Exception:
-                    # This catch:
-                    # Empty: in tuple1 = self.left.get(False), when the queue is empty.
-                    pass
-
-            # Get tuple from right queue, and concatenate with empty tuple.
-            if not(tuple2 == "EOF"):
-                try:
-                    tuple2 = self.right.get(False)
-                    if not(tuple2 == "EOF"):
-                        res = {}
-                        res.update(v2)
-                        res.update(tuple2)
-                        self.qresults.put(res)
-                        #print(tuple2)
-                except Exception:
-                    # This catch:
-                    # Empty: in tuple2 = self.right.get(False), when the queue is empty.
-                    pass
@@ -1,4 +1,4 @@
-from awudima.pyrdfmt.federation import Federation
+from awudima.pyrdfmt.federation import Federation, FederationCache
 from awudima.pyrdfmt.rdfmt import RDFMT
 from awudima.pyrdfmt.predicate import MTPredicate
 from awudima.pyrdfmt.datasource import DataSource
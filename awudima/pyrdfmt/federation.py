@@ -1,6 +1,11 @@
 
 __author__ = "Kemele M. Endris"
 
+import os
+import json
+import hashlib
+from threading import Lock
+
 from awudima.pyrml import DataSourceType
 from awudima.pyrdfmt.sparql_endpoint import SPARQLEndpointRDFMT
 from awudima.pyrdfmt.rdfmt import RDFMT
@@ -25,12 +30,27 @@ class Federation(object):
         self.desc = desc
         self.datasources = set()
         self.rdfmts = set()
+        # main memory (in bytes) for the hash tables of the operators of a query, None for no limit
+        self.memory_budget = None
 
         self._predIdx = None
         self._mt_dict = None
         self._mt_obj = None
         self._typing_predicates = None
         self._datasources_dict = None
+        self._fingerprint = None
+
+    @property
+    def fingerprint(self):
+        """
+        :return: hash of the description of the federation, i.e., it changes whenever its sources or RDF-MTs change
+        """
+        if self._fingerprint is not None:
+            return self._fingerprint
+
+        content = json.dumps(self.to_json(), sort_keys=True, default=str)
+        self._fingerprint = hashlib.sha1(content.encode()).hexdigest()
+        return self._fingerprint
 
     @property
     def typing_predicates(self):
@@ -100,6 +120,7 @@ class Federation(object):
         self._predIdx = None
         self._mt_dict = None
         self._mt_obj = None
+        self._fingerprint = None
         if merge:
             self.rdfmts = set()
         rdfmts_dict = self.rdfmts_obj
@@ -150,6 +171,7 @@ class Federation(object):
         self._predIdx = None
         self._mt_dict = None
         self._mt_obj = None
+        self._fingerprint = None
         extractor = RDFMTExtractor()
         if merge:
             toremove = []
@@ -186,12 +208,14 @@ class Federation(object):
 
     def addSource(self, source):
         self._typing_predicates = None
+        self._fingerprint = None
         self.datasources.add(source)
 
     def addRDFMT(self, rdfmt):
         self._predIdx = None
         self._mt_dict = None
         self._mt_obj = None
+        self._fingerprint = None
         rdfmts_dict = self.rdfmts_obj
         if rdfmt.mtId in rdfmts_dict:
             rdfmts_dict[rdfmt.mtId] = rdfmts_dict[rdfmt.mtId].merge_with(rdfmt)
@@ -202,6 +226,7 @@ class Federation(object):
         self._predIdx = None
         self._mt_dict = None
         self._mt_obj = None
+        self._fingerprint = None
         # self.rdfmts.update(rdfmts)
         rdfmts_dict = self.rdfmts_obj
         for rdfmt in rdfmts:
@@ -215,13 +240,16 @@ class Federation(object):
 
         :return: json representation of the Federation
         """
-        return {
+        fed = {
             "fedId": self.fedId,
             "name": self.name,
             "desc": self.desc,
             'rdfmts': [r.to_json() for r in self.rdfmts],
             "sources": {s.dsId: s.to_json() for s in self.datasources}
         }
+        if self.memory_budget is not None:
+            fed['memory_budget'] = self.memory_budget
+        return fed
 
     def dump_to_json(self, outname):
         import json
@@ -251,6 +279,7 @@ class Federation(object):
         if 'fedId' not in fed or 'name' not in fed or 'desc' not in fed:
             return None
         federation = Federation(fed['fedId'], fed['name'], fed['desc'])
+        federation.memory_budget = fed.get('memory_budget', None)
         sourceids = {}
         if 'sources' in fed:
             sources = fed['sources']
@@ -278,6 +307,7 @@ class Federation(object):
         if 'fedId' not in fed or 'name' not in fed or 'desc' not in fed:
             return None
         federation = Federation(fed['fedId'], fed['name'], fed['desc'])
+        federation.memory_budget = fed.get('memory_budget', None)
         sourceids = {}
         if 'sources' in fed:
             sources = fed['sources']
@@ -292,3 +322,72 @@ class Federation(object):
                 federation.rdfmts.add(mt)
 
         return federation
+
+
+class FederationCache(object):
+    """Process-wide cache of the federation configured in a json file
+
+    The federation is parsed once and reused, together with its lazily built indexes.
+    It is reloaded only when the file changes: the file is hashed again when its mtime or size changes,
+    and parsed again when its hash changes.
+    """
+    def __init__(self, path):
+        """
+        :param path: path of the json file of the federation
+        """
+        self.path = path
+        self.federation = None
+        self.digest = None
+        self._stamp = None
+        self._lock = Lock()
+
+    def get(self):
+        """
+        :return: the federation configured in the file, None if the file does not exist or is not a valid federation
+        """
+        with self._lock:
+            if not os.path.exists(self.path):
+                return None
+            stat = os.stat(self.path)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            if self.federation is not None and stamp == self._stamp:
+                return self.federation
+
+            with open(self.path, 'rb') as f:
+                content = f.read()
+            digest = hashlib.sha1(content).hexdigest()
+            if self.federation is None or digest != self.digest:
+                federation = Federation.config(json.loads(content))
+                if federation is None:
+                    return None
+                federation._fingerprint = digest
+                self._warm(federation)
+                self.federation = federation
+                self.digest = digest
+            self._stamp = stamp
+            return self.federation
+
+    def set(self, federation):
+        """
+        Dumps the given federation to the file and caches it.
+
+        :param federation: Federation
+        """
+        with self._lock:
+            federation.dump_to_json(self.path)
+            with open(self.path, 'rb') as f:
+                content = f.read()
+            stat = os.stat(self.path)
+            self.digest = hashlib.sha1(content).hexdigest()
+            federation._fingerprint = self.digest
+            self._warm(federation)
+            self.federation = federation
+            self._stamp = (stat.st_mtime_ns, stat.st_size)
+
+    @staticmethod
+    def _warm(federation):
+        # builds the indexes used during query decomposition, once per federation
+        federation.predicate_rdfmts
+        federation.rdfmts_obj
+        federation.datasources_obj
+        federation.typing_predicates
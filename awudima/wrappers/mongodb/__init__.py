@@ -10,6 +10,9 @@ logger.setLevel(logging.INFO)
 
 class MongoDBWrapper:
 
+    # Event set when no more results are needed, None if the wrapper is not stopped.
+    stopped = None
+
     def __init__(self, datasource, config):
         self.datasource = datasource
         self.config = config
@@ -52,7 +55,8 @@ class MongoDBWrapper:
 
         return mongo_client
 
-    def executeQuery(self, mongo_ql, queue, sparql_result_template, limit=-1, offset=0):
+    def executeQuery(self, mongo_ql, queue, sparql_result_template, limit=-1, offset=0, max_results=-1):
+        # max_results is the number of results needed (LIMIT of the query), -1 for all
         if self.database_name is None:
             queue.put('EOF')
             return
@@ -69,11 +73,28 @@ class MongoDBWrapper:
 
         try:
             db = mongo_client.get_database(self.database_name)
+            produced = 0
             for col_name in mongo_ql['collection']:
+                if self.stopped is not None and self.stopped.is_set():
+                    break
+                if max_results != -1 and produced >= max_results:
+                    break
                 source = db_name + '<|>' + col_name
                 collection = db.get_collection(col_name)
-                result = collection.aggregate(pipeline, useCursor=True, batchSize=1000, allowDiskUse=True)
-                cardinality = self.process_result(result, queue, sparql_result_template, source)
+                skip = 0
+                while self.stopped is None or not self.stopped.is_set():
+                    stages = pipeline
+                    if max_results != -1:
+                        # Only the results that are still needed. Documents with null values are dropped,
+                        # so the next ones are asked for until enough results are produced.
+                        needed = max_results - produced
+                        stages = list(pipeline) + ([{'$skip': skip}] if skip > 0 else []) + [{'$limit': needed}]
+                    result = collection.aggregate(stages, useCursor=True, batchSize=1000, allowDiskUse=True)
+                    cardinality, rows = self.process_result(result, queue, sparql_result_template, source)
+                    produced += rows
+                    if max_results == -1 or cardinality < needed or produced >= max_results:
+                        break
+                    skip += cardinality
         except IOError as ie:
             print("IO ERROR:", ie)
             logger.error("IOError while running query: " + str(ie))
@@ -156,14 +177,19 @@ class MongoDBWrapper:
 #         # print('DONE')
 
     def process_result(self, results, queue, sparql_result_template: dict, source: str):
+        # Returns the number of documents read, and of results produced.
         if results is None:
             print("empty results")
-            return 0
+            return 0, 0
         c = 0
+        produced = 0
 
         for doc in results:
             # print("res:", doc, "\n")
             c += 1
+            if c % 1000 == 0 and self.stopped is not None and self.stopped.is_set():
+                # the rest of the cursor is not fetched
+                break
             row = {}
             res = sparql_result_template.copy()
             skip = False
@@ -193,7 +219,10 @@ class MongoDBWrapper:
             if not skip:
                 # print('wrapper:', res)
                 queue.put(res)
-        return c
+                produced += 1
+        if hasattr(queue, 'flush'):
+            queue.flush()
+        return c, produced
 
     @staticmethod
     def contact_mongo_client(pipeline, datasource, collection_name, username=None, password=None):
@@ -76,6 +76,10 @@ class MySQLClient(object):
 
 
 class MySQLWrapper:
+
+    # Event set when no more results are needed, None if the wrapper is not stopped.
+    stopped = None
+
     def __init__(self, datasource, config):
         self.datasource = datasource
         self.config = config
@@ -135,7 +139,8 @@ class MySQLWrapper:
 
         return mysql
 
-    def executeQuery(self, sql_query, queue, sparql_result_template, limit=-1, offset=0):
+    def executeQuery(self, sql_query, queue, sparql_result_template, limit=-1, offset=0, max_results=-1):
+        # limit is the size of the pages, max_results the number of results needed (LIMIT of the query), -1 for all
         if self.database_name is None:
             queue.put('EOF')
             return
@@ -147,6 +152,7 @@ class MySQLWrapper:
         cursor = mysql.cursor()
         cursor.execute("use " + self.database_name + ';')
         card = 0
+        produced = 0
         if limit == -1:
             limit = 10000
         if offset == -1:
@@ -155,18 +161,23 @@ class MySQLWrapper:
         logger.info(sql_query)
         try:
             # rs = time()
-            while True:
-                query_copy = str(sql_query) + "\n LIMIT " + str(limit) + " OFFSET " + str(offset)
+            while self.stopped is None or not self.stopped.is_set():
+                # The last page only asks for the results that are still needed (rows with null values are dropped).
+                page = limit if max_results == -1 else min(limit, max_results - produced)
+                if page <= 0:
+                    break
+                query_copy = str(sql_query) + "\n LIMIT " + str(page) + " OFFSET " + str(offset)
                 # print("_______________________")
                 # print(query_copy)
                 cursor.execute(query_copy)
-                cardinality = self.process_result(cursor, queue, sparql_result_template)
+                cardinality, rows = self.process_result(cursor, queue, sparql_result_template)
                 card += cardinality
+                produced += rows
                 # if (time()-rs) > 20:
                 #     print(card, 'results found -..')
-                if cardinality < limit:
+                if cardinality < page:
                     break
-                offset = offset + limit
+                offset = offset + page
             logger.info("Running query: " + str(sql_query) + " Non UNION DONE" + str(card))
         except IOError as ie:
             print("IO ERROR:", ie)
@@ -180,8 +191,10 @@ class MySQLWrapper:
         queue.put("EOF")
 
     def process_result(self, cursor, queue, sparql_result_tempalte: dict):
+        # Returns the number of rows read, and of results produced.
         header = [h for h in cursor.column_names]
         c = 0
+        produced = 0
         for line in cursor:
             c += 1
             row = {}
@@ -210,4 +223,8 @@ class MySQLWrapper:
                         break
             if not skip:
                 queue.put(res)
-        return c
+                produced += 1
+        # do not hold the rows of this page while the next one is fetched
+        if hasattr(queue, 'flush'):
+            queue.flush()
+        return c, produced
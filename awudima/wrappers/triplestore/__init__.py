@@ -10,12 +10,16 @@ logger.setLevel(logging.INFO)
 
 
 class RDFStore(object):
+
+    # Event set when no more results are needed, None if the wrapper is not stopped.
+    stopped = None
+
     def __init__(self, datasource, config):
         self.datasource = datasource
         self.cofig = config
 
-    def executeQuery(self, sparql_query, queue, sparql_result_template, limit=-1, offset=0):
-
+    def executeQuery(self, sparql_query, queue, sparql_result_template, limit=-1, offset=0, max_results=-1):
+        # limit is the size of the pages, max_results the number of results needed (LIMIT of the query), -1 for all
         card = 0
         if limit == -1:
             limit = 10000
@@ -26,8 +30,12 @@ class RDFStore(object):
 
         try:
             # rs = time()
-            while True:
-                query_copy = str(sparql_query) + "\n LIMIT " + str(limit) + " OFFSET " + str(offset)
+            while self.stopped is None or not self.stopped.is_set():
+                # The last page only asks for the results that are still needed.
+                page = limit if max_results == -1 else min(limit, max_results - card)
+                if page <= 0:
+                    break
+                query_copy = str(sparql_query) + "\n LIMIT " + str(page) + " OFFSET " + str(offset)
                 print("_______________________")
                 print(query_copy)
                 res, cardinality = SPARQLEndpointWrapper.contact_sparql_endpoint(query_copy, self.datasource.url)
@@ -35,9 +43,9 @@ class RDFStore(object):
                 card += cardinality
                 # if (time()-rs) > 20:
                 #     print(card, 'results found -..')
-                if cardinality < limit:
+                if cardinality < page:
                     break
-                offset = offset + limit
+                offset = offset + page
             logger.info("Running query: " + str(sparql_query) + " Non UNION DONE" + str(card))
         except IOError as ie:
             print("IO ERROR:", ie)
@@ -54,3 +62,6 @@ class RDFStore(object):
         for r in res:
             r['source'] = self.datasource.name
             queue.put(r)
+        # send the rows buffered by block queues before contacting the source again
+        if hasattr(queue, 'flush'):
+            queue.flush()
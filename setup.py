@@ -10,7 +10,7 @@ setup(name='awudima-fqp',
       author_email='kemele.endris@gmail.com',
       url='https://github.com/Awudima/',
       scripts=['./start_endpoint.sh'],
-      packages=find_packages(exclude=['docs']),
+      packages=find_packages(exclude=['docs', 'tests', 'tests.*']),
       install_requires=["ply==3.11",
                         "flask==2.0.2",
                         "requests==2.26.0",
@@ -23,6 +23,8 @@ setup(name='awudima-fqp',
                         'networkx==2.5.1',
                         'pydrill==0.3.4',
                         'SPARQLWrapper==1.8.5'],
+      extras_require={'arrow': ['pyarrow>=3.0.0'],
+                      'vector': ['numpy>=1.19.0']},
       include_package_data=True,
       license='GNU/GPL v2'
       )
\ No newline at end of file
@@ -0,0 +1,361 @@
+import os
+import random
+import re
+import threading
+import unittest
+from time import sleep
+from collections import Counter
+from unittest import mock
+
+from awudima.pyrml import DataSourceType
+from awudima.mediator.cache import BindJoinCache
+from awudima.mediator.engine import ThreadEngine
+from awudima.operators.Multiplexer import ThreadQueue
+from awudima.operators.MemoryBudget import MemoryBudget
+from awudima.operators.nonblocking.NestedHashJoinFilter import NestedHashJoinFilter
+from awudima.operators.nonblocking.NestedHashOptionalFilter import NestedHashOptionalFilter
+from awudima.operators.nonblocking.NHJFOperatorStructures import Window
+
+
+class Service(object):
+    filters = []
+
+
+class Tree(object):
+    service = Service()
+
+
+class Request(object):
+    # Instantiation of the source: produces the right tuples of the join keys of the request.
+
+    def __init__(self, source, keys):
+        self.source = source
+        self.keys = keys
+
+    def execute(self, queue):
+        def run():
+            for t in self.source.tuples:
+                value = t['k']['value'] if isinstance(t['k'], dict) else t['k']
+                if value in self.keys:
+                    queue.put(dict(t))
+            queue.put('EOF')
+        threading.Thread(target=run).start()
+
+
+class Source(object):
+    # Source instantiated with FILTER expressions on the join variable k.
+    tree = Tree()
+    engine = ThreadEngine(block_size=1)
+
+    def __init__(self, tuples):
+        self.tuples = tuples
+        self.requests = []
+
+    def instantiateFilter(self, vars, filter_str):
+        self.requests.append(filter_str)
+        return Request(self, self.keys(filter_str))
+
+    def keys(self, filter_str):
+        return set(re.findall(r'\?k="([^"]*)"', filter_str)) | set(re.findall(r'\?k=(_:\w+)', filter_str))
+
+
+class Endpoint(Source):
+    # SPARQL endpoint, instantiated with VALUES blocks.
+    class datasource(object):
+        dstype = DataSourceType.SPARQL_ENDPOINT
+
+    def keys(self, filter_str):
+        keys = super(Endpoint, self).keys(filter_str)
+        if 'VALUES' in filter_str:
+            keys |= set(re.findall(r'\("([^"]*)"\)', filter_str))
+        return keys
+
+
+def feed(queue, tuples):
+    for t in tuples:
+        queue.put(dict(t))
+    queue.put('EOF')
+
+
+def join(source, left, operator=None, cache=None):
+    left_queue, out = ThreadQueue(), ThreadQueue()
+    threading.Thread(target=feed, args=(left_queue, left)).start()
+    if operator is None:
+        operator = NestedHashJoinFilter({'k'})
+    operator.cache = cache
+    operator.execute(left_queue, source, out)
+    results = Counter()
+    t = out.get()
+    while t != 'EOF':
+        results[(str(t['k']), t['a'], t['b'])] += 1
+        t = out.get()
+    return results
+
+
+class NestedHashJoinFilterTest(unittest.TestCase):
+
+    left = [{'k': 'a', 'a': '1'}, {'k': 'b', 'a': '2'}, {'k': 'a', 'a': '3'},
+            {'k': {'type': 'bnode', 'value': '_:b0'}, 'a': '4'}]
+    right = [{'k': 'a', 'b': '5'}, {'k': {'type': 'bnode', 'value': '_:b0'}, 'b': '6'}, {'k': 'c', 'b': '7'}]
+
+    def expected(self):
+        return Counter({('a', '1', '5'): 1, ('a', '3', '5'): 1,
+                        (str({'type': 'bnode', 'value': '_:b0'}), '4', '6'): 1})
+
+    def test_filter(self):
+        source = Source(self.right)
+        self.assertEqual(join(source, self.left), self.expected())
+        self.assertTrue(all('FILTER' in r for r in source.requests))
+
+    def test_values_with_blank_nodes(self):
+        # Blank nodes are not sent in VALUES blocks, but their matches are not lost.
+        source = Endpoint(self.right)
+        self.assertEqual(join(source, self.left), self.expected())
+        self.assertTrue(any('VALUES' in r for r in source.requests))
+        self.assertFalse(any('_:b0' in r for r in source.requests if 'VALUES' in r))
+
+
+class WindowTest(unittest.TestCase):
+
+    def window(self):
+        return Window(20, 5, 1000, 2.0, 10000)
+
+    def test_grows_while_the_source_is_fast(self):
+        window = self.window()
+        window.adapt(0.1, 20, 10)
+        self.assertEqual(window.size, 40)
+        # Windows that were not full are no evidence.
+        window.adapt(0.1, 10, 10)
+        self.assertEqual(window.size, 40)
+
+    def test_shrinks_when_the_source_is_slow(self):
+        window = self.window()
+        window.adapt(3, 20, 10)
+        self.assertEqual(window.size, 10)
+        window.adapt(3, 10, 10)
+        window.adapt(3, 5, 10)
+        self.assertEqual(window.size, 5)
+
+    def test_results_fit_in_one_page(self):
+        window = self.window()
+        window.adapt(0.1, 20, 40000)
+        self.assertEqual(window.size, 5)
+        window = Window(100, 5, 1000, 2.0, 10000)
+        window.adapt(0.1, 100, 20000)
+        self.assertEqual(window.size, 50)
+
+
+class BindingTest(unittest.TestCase):
+
+    def operator(self, vars):
+        operator = NestedHashJoinFilter(set(vars))
+        operator.join_vars = sorted(vars)
+        return operator
+
+    def test_values(self):
+        operator = self.operator(['a', 'b'])
+        binding = operator.makeBinding({'a': 'http://example.org/x', 'b': '5^^<http://www.w3.org/2001/XMLSchema#int>'},
+                                       True)
+        # Typed literals are matched with and without their datatype.
+        self.assertEqual(binding, '(<http://example.org/x> "5"^^<http://www.w3.org/2001/XMLSchema#int>) '
+                                  '(<http://example.org/x> "5")')
+
+    def test_filter(self):
+        operator = self.operator(['a', 'b'])
+        binding = operator.makeBinding({'a': {'type': 'uri', 'value': 'http://example.org/x'},
+                                        'b': {'type': 'literal', 'value': 'say "hi"', 'xml:lang': 'en'}})
+        self.assertEqual(binding, '(?a=<http://example.org/x> && ?b="say \\"hi\\""@en)')
+
+    def test_blank_nodes(self):
+        operator = self.operator(['a'])
+        self.assertTrue(operator.hasBlankNode({'a': {'type': 'bnode', 'value': '_:b0'}}))
+        self.assertFalse(operator.hasBlankNode({'a': '_:b0'}))
+        self.assertEqual(operator.makeBinding({'a': {'type': 'bnode', 'value': '_:b0'}}), '?a=_:b0')
+
+
+class BatchingTest(unittest.TestCase):
+
+    def test_requests_of_the_window(self):
+        left, right = data(500, 100, 9)
+        source = Source(right)
+        self.assertEqual(join(source, left), expected(left, right))
+        # 100 join keys at most, sent once each, at least 5 per request.
+        self.assertLessEqual(len(source.requests), 20)
+        keys = [k for r in source.requests for k in source.keys(r)]
+        self.assertEqual(len(keys), len(set(keys)))
+
+    def test_values_blocks(self):
+        left, right = data(500, 100, 10)
+        source = Endpoint(right)
+        self.assertEqual(join(source, left), expected(left, right))
+        self.assertTrue(all('VALUES (?k) {' in r for r in source.requests))
+
+
+class SlowSource(Source):
+    # Source whose requests take a while: keeps track of the requests running at a time.
+
+    def __init__(self, tuples, max_in_flight):
+        super(SlowSource, self).__init__(tuples)
+        self.max_in_flight = max_in_flight
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def instantiateFilter(self, vars, filter_str):
+        request = super(SlowSource, self).instantiateFilter(vars, filter_str)
+        source = self
+
+        class SlowRequest(Request):
+            def execute(self, queue):
+                with source.lock:
+                    source.running += 1
+                    source.max_running = max(source.max_running, source.running)
+
+                def run():
+                    sleep(0.01)
+                    with source.lock:
+                        source.running -= 1
+                    Request.execute(self, queue)
+                threading.Thread(target=run).start()
+        return SlowRequest(self, request.keys)
+
+
+class InFlightTest(unittest.TestCase):
+
+    def test_requests_in_flight(self):
+        left, right = data(1000, 300, 11)
+        for max_in_flight in [1, 3]:
+            source = SlowSource(right, max_in_flight)
+            self.assertEqual(join(source, left), expected(left, right))
+            self.assertLessEqual(source.max_running, max_in_flight)
+            self.assertGreater(len(source.requests), max_in_flight)
+
+    def test_optional_requests_in_flight(self):
+        left, right = data(1000, 300, 12)
+        source = SlowSource(right, 2)
+        join(source, left, NestedHashOptionalFilter({'k', 'a'}, {'k', 'b'}))
+        self.assertLessEqual(source.max_running, 2)
+
+    def test_max_in_flight_of_the_data_source(self):
+        from awudima.pyrdfmt import Federation
+        from awudima.mediator.executor import AwudimaFQP
+        from awudima.mediator.planner.QueryPlanner import AwudimaPlanner
+        from awudima.mediator.PhysicalPlanOperators import LeafOperator, MAX_IN_FLIGHT
+
+        query = 'SELECT ?n WHERE { ?p <http://x/name> ?n }'
+        federation = Federation.load_from_json(os.path.join(os.path.dirname(__file__), 'data', 'federation.json'))
+        for params, max_in_flight in [(None, MAX_IN_FLIGHT), ('username:u;password:p', MAX_IN_FLIGHT),
+                                      ({'max_in_flight': '2'}, 2)]:
+            for ds in federation.datasources:
+                ds.params = params
+            decomposition = AwudimaFQP(federation).decompose(query)
+            plan = AwudimaPlanner(query, decomposition, federation).create_physical_plan()
+            while not isinstance(plan, LeafOperator):
+                plan = plan.left
+            self.assertEqual(plan.max_in_flight, max_in_flight)
+
+
+class BindJoinCacheTest(unittest.TestCase):
+
+    def test_get_and_put(self):
+        cache = BindJoinCache(max_tuples=10)
+        self.assertIsNone(cache.get('f', ('a',)))
+        cache.put('f', ('a',), [{'b': '1'}])
+        cache.put('f', ('c',), [])
+        self.assertEqual(cache.get('f', ('a',)), [{'b': '1'}])
+        # Join keys without right tuples are cached as well.
+        self.assertEqual(cache.get('f', ('c',)), [])
+        self.assertIsNone(cache.get('g', ('a',)))
+        self.assertEqual(cache.stats(), {'entries': 2, 'tuples': 2, 'hits': 2, 'misses': 2})
+
+    def test_eviction(self):
+        cache = BindJoinCache(max_tuples=50)
+        for i in range(20):
+            cache.put('f', (str(i),), [{'b': i}] * 5)
+        self.assertEqual(cache.stats()['tuples'], 50)
+        self.assertIsNotNone(cache.get('f', ('19',)))
+        self.assertIsNone(cache.get('f', ('0',)))
+        cache.put('f', ('big',), [{}] * 51)
+        self.assertIsNone(cache.get('f', ('big',)))
+
+    def test_ttl(self):
+        cache = BindJoinCache(ttl=0.05)
+        cache.put('f', ('a',), [])
+        sleep(0.1)
+        self.assertIsNone(cache.get('f', ('a',)))
+
+    def test_fingerprint(self):
+        class Leaf(object):
+            def __init__(self, server, query_str):
+                self.server = server
+                self.query_str = query_str
+        self.assertEqual(BindJoinCache.fingerprint(Leaf('s', 'q')), BindJoinCache.fingerprint(Leaf('s', 'q')))
+        self.assertNotEqual(BindJoinCache.fingerprint(Leaf('s', 'q')), BindJoinCache.fingerprint(Leaf('t', 'q')))
+
+    def test_repeated_join_keys(self):
+        # The join keys of a second query are answered from the cache, without contacting the source.
+        cache = BindJoinCache()
+        left, right = data(1000, 200, 13)
+        source = Source(right)
+        self.assertEqual(join(source, left, cache=cache), expected(left, right))
+        requests = len(source.requests)
+        self.assertEqual(join(source, left, cache=cache), expected(left, right))
+        self.assertEqual(len(source.requests), requests)
+        other, _ = data(1000, 400, 14)
+        self.assertEqual(join(source, other, cache=cache), expected(other, right))
+        self.assertGreater(len(source.requests), requests)
+
+    def test_truncated_responses_are_not_cached(self):
+        # Responses of a stopped query may be truncated: they are not cached.
+        cache = BindJoinCache()
+        left, right = data(200, 50, 15)
+        operator = NestedHashJoinFilter({'k'})
+        operator.stopped = threading.Event()
+        operator.stopped.set()
+        join(Source(right), left, operator, cache)
+        self.assertEqual(cache.stats()['entries'], 0)
+
+
+def data(n, keys, seed):
+    rnd = random.Random(seed)
+    left = [{'k': 'r%d' % rnd.randrange(keys), 'a': 'x' * 50 + str(i)} for i in range(n)]
+    right = [{'k': 'r%d' % rnd.randrange(keys), 'b': 'y' * 50 + str(i)} for i in range(n)]
+    return left, right
+
+
+def expected(left, right, optional=False):
+    index = {}
+    for r in right:
+        index.setdefault(r['k'], []).append(r)
+    results = Counter()
+    for l in left:
+        for r in index.get(l['k'], [{'b': ''}] if optional else []):
+            results[(l['k'], l['a'], r['b'])] += 1
+    return results
+
+
+class SpillTest(unittest.TestCase):
+    # Results with the partitions flushed to secondary memory are the results in main memory.
+
+    def run_operator(self, cls, limit, optional):
+        left, right = data(3000, 400, 2)
+        operator = cls({'k'}) if cls is NestedHashJoinFilter else cls({'k', 'a'}, {'k', 'b'})
+        if limit is not None:
+            operator.memory = MemoryBudget(limit)
+        with mock.patch.object(cls, 'spill', autospec=True, side_effect=cls.spill) as spill:
+            results = join(Source(right), left, operator)
+        self.assertEqual(results, expected(left, right, optional))
+        if limit is not None:
+            self.assertEqual(operator.memory.stats()['used'], 0)
+        return spill.call_count
+
+    def test_join(self):
+        self.assertEqual(self.run_operator(NestedHashJoinFilter, None, False), 0)
+        self.assertGreater(self.run_operator(NestedHashJoinFilter, 50000, False), 0)
+
+    def test_optional(self):
+        self.assertEqual(self.run_operator(NestedHashOptionalFilter, None, True), 0)
+        self.assertGreater(self.run_operator(NestedHashOptionalFilter, 50000, True), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import os
+import shutil
+import tempfile
+import unittest
+from time import sleep
+
+from awudima.pyrdfmt import Federation
+from awudima.mediator.cache import PlanCache, QueryTemplate, ResultCache, normalize_query
+from awudima.mediator.engine import WorkerPool
+from awudima.mediator.executor import AwudimaFQP
+
+from tests.test_streaming import resultset
+
+FEDERATION = os.path.join(os.path.dirname(__file__), 'data', 'federation.json')
+
+QUERY = 'SELECT ?s ?n WHERE { ?s <http://x/name> ?n }'
+
+
+def federation():
+    return Federation.load_from_json(FEDERATION)
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def test_normalized_queries(self):
+        self.assertEqual(normalize_query(QUERY), normalize_query('SELECT  ?s ?n\nWHERE {\n  ?s <http://x/name> ?n .\n}'))
+        self.assertNotEqual(normalize_query(QUERY), normalize_query(QUERY + ' LIMIT 10'))
+
+    def test_key_of_the_federation(self):
+        fed = federation()
+        other = federation()
+        other.desc = 'changed'
+        other._fingerprint = None
+        self.assertEqual(ResultCache.key(QUERY, fed), ResultCache.key(QUERY, federation()))
+        self.assertNotEqual(ResultCache.key(QUERY, fed), ResultCache.key(QUERY, other))
+
+    def test_get_and_put(self):
+        cache = ResultCache()
+        self.assertIsNone(cache.get('k'))
+        cache.put('k', ['s'], [{'s': '1'}])
+        self.assertEqual(cache.get('k'), (['s'], [{'s': '1'}]))
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_ttl(self):
+        cache = ResultCache(ttl=0.05)
+        cache.put('k', ['s'], [])
+        sleep(0.1)
+        self.assertIsNone(cache.get('k'))
+
+    def test_eviction(self):
+        cache = ResultCache(max_entries=2, max_rows=5)
+        cache.put('a', ['s'], [{}] * 2)
+        cache.put('b', ['s'], [{}] * 2)
+        cache.get('a')
+        cache.put('c', ['s'], [{}] * 2)
+        # b is the least recently used
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('a'))
+        cache.put('d', ['s'], [{}] * 4)
+        self.assertEqual(cache.stats()['rows'], 4)
+        # results larger than the cache are not cached
+        cache.put('e', ['s'], [{}] * 6)
+        self.assertIsNone(cache.get('e'))
+
+    def test_spill(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            cache = ResultCache(max_entries=1, spill_dir=tmpdir)
+            cache.put('a', ['s'], [{'s': '1'}])
+            cache.put('b', ['s'], [{'s': '2'}])
+            self.assertEqual(cache.stats()['spilled'], 1)
+            self.assertEqual(cache.get('a'), (['s'], [{'s': '1'}]))
+            # a is back in memory, b is spilled now
+            self.assertEqual(cache.stats()['spilled'], 1)
+            self.assertEqual(cache.get('b'), (['s'], [{'s': '2'}]))
+            cache.clear()
+            self.assertEqual(os.listdir(tmpdir), [])
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class CachedResultSetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = WorkerPool(4, max_workers=2, engine='threads')
+        self.cache = ResultCache()
+        self.fqp = AwudimaFQP(federation(), result_cache=self.cache)
+        self.key = self.cache.key(QUERY, self.fqp.federation)
+
+    def test_finished_results_are_cached(self):
+        rows = [{'x': str(i)} for i in range(10)]
+        rs = resultset(self.pool, rows)
+        rs.cache_results(self.cache, self.key)
+        self.assertEqual(list(rs.get()), rows)
+        self.assertEqual(self.cache.get(self.key), (['x'], rows))
+        cached = self.fqp.get_cached(QUERY)
+        self.assertEqual(list(cached.get()), rows)
+
+    def test_abandoned_results_are_not_cached(self):
+        rs = resultset(self.pool, [{'x': '1'}], endless=True)
+        rs.cache_results(self.cache, self.key)
+        g = rs.get()
+        next(g)
+        g.close()
+        self.assertIsNone(self.cache.get(self.key))
+        self.assertIsNone(self.fqp.get_cached(QUERY))
+
+
+TEMPLATE = 'SELECT ?n ?o WHERE { <http://x/%s> <http://x/name> ?n . <http://x/%s> <http://x/worksFor> ?o . ' \
+           '?o <http://x/label> "%s" }'
+
+
+class PlanCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = PlanCache()
+        self.fqp = AwudimaFQP(federation(), plan_cache=self.cache)
+
+    def test_templates(self):
+        first = QueryTemplate(TEMPLATE % ('p1', 'p1', 'ACME'))
+        second = QueryTemplate(TEMPLATE % ('p2', 'p2', 'Foo'))
+        self.assertEqual(first.text, second.text)
+        # Equal constants share a parameter: the join on the constant is kept.
+        self.assertEqual(first.slots, [0, 0, 1])
+        self.assertNotEqual(first.text, QueryTemplate(TEMPLATE % ('p1', 'p2', 'ACME')).text)
+
+    def test_decompositions_are_instantiated(self):
+        for (p, label) in [('p1', 'ACME'), ('p2', 'Foo'), ('p1', 'ACME')]:
+            query = TEMPLATE % (p, p, label)
+            self.assertEqual(str(self.fqp.decompose(query)), str(AwudimaFQP(self.fqp.federation).decompose(query)))
+        self.assertEqual(self.cache.stats(), {'entries': 1, 'templates': 2, 'hits': 2, 'misses': 1})
+
+    def test_instances_are_independent(self):
+        first = self.fqp.decompose(TEMPLATE % ('p1', 'p1', 'ACME'))
+        self.fqp.decompose(TEMPLATE % ('p2', 'p2', 'Foo'))
+        self.assertIn('<http://x/p1>', str(first))
+        self.assertNotIn('<http://x/p2>', str(first))
+
+    def test_key_of_the_federation(self):
+        template = self.cache.template(TEMPLATE % ('p1', 'p1', 'ACME'))
+        other = federation()
+        other.desc = 'changed'
+        other._fingerprint = None
+        self.assertNotEqual(PlanCache.key(template, self.fqp.federation), PlanCache.key(template, other))
+        self.assertNotEqual(PlanCache.key(template, self.fqp.federation, False),
+                            PlanCache.key(template, self.fqp.federation, True))
+
+
+if __name__ == '__main__':
+    unittest.main()
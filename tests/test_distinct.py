@@ -0,0 +1,114 @@
+import unittest
+from hashlib import blake2b
+from unittest import mock
+
+from awudima.operators.Multiplexer import ThreadQueue
+from awudima.operators.MemoryBudget import MemoryBudget
+from awudima.operators.nonblocking import Xdistinct as xdistinct
+from awudima.operators.nonblocking.Xdistinct import Xdistinct
+from awudima.operators.nonblocking import Xunion as xunion
+from awudima.operators.nonblocking.Xunion import Xunion
+
+
+def colliding(key):
+    # Fingerprints of two bytes: the first byte is the partition, different tuples share the second one.
+    return blake2b(key.encode('utf-8'), digest_size=1).digest() * 2
+
+
+def distinct(tuples, **kwargs):
+    memory = kwargs.pop('memory', None)
+    memorySize = kwargs.pop('memorySize', None)
+    left, out = ThreadQueue(), ThreadQueue()
+    for t in tuples:
+        left.put(dict(t))
+    left.put('EOF')
+    operator = Xdistinct(['x', 'y'], **kwargs)
+    operator.memory = memory
+    if memorySize is not None:
+        operator.memorySize = memorySize
+    operator.execute(left, None, out)
+    results = []
+    t = out.get()
+    while t != 'EOF':
+        results.append(t)
+        t = out.get()
+    return operator, results
+
+
+class XdistinctTest(unittest.TestCase):
+
+    tuples = [{'x': str(i % 700), 'y': 'v' * 20} for i in range(3000)]
+
+    def expected(self):
+        return sorted({t['x'] for t in self.tuples})
+
+    def test_in_memory(self):
+        operator, results = distinct(self.tuples)
+        self.assertEqual([t['x'] for t in results], [t['x'] for t in self.tuples[:700]])
+        self.assertFalse(any(operator.spilled))
+
+    def test_spilled(self):
+        operator, results = distinct(self.tuples, memorySize=5000)
+        self.assertTrue(any(operator.spilled))
+        self.assertEqual(sorted(t['x'] for t in results), self.expected())
+
+    def test_memory_budget(self):
+        budget = MemoryBudget(5000)
+        operator, results = distinct(self.tuples, memory=budget)
+        self.assertTrue(any(operator.spilled))
+        self.assertEqual(sorted(t['x'] for t in results), self.expected())
+        self.assertEqual(budget.stats()['used'], 0)
+
+    def test_ordered_is_not_spilled(self):
+        operator, results = distinct(self.tuples, memorySize=5000, ordered=True)
+        self.assertFalse(any(operator.spilled))
+        self.assertEqual([t['x'] for t in results], [t['x'] for t in self.tuples[:700]])
+
+    def test_collisions_are_verified(self):
+        with mock.patch.object(xdistinct, 'fingerprint', colliding):
+            operator, results = distinct(self.tuples)
+            self.assertEqual(sorted(t['x'] for t in results), self.expected())
+            operator, results = distinct(self.tuples, memorySize=5000)
+            self.assertTrue(any(operator.spilled))
+            self.assertEqual(sorted(t['x'] for t in results), self.expected())
+
+    def test_collisions_without_verification(self):
+        with mock.patch.object(xdistinct, 'fingerprint', colliding):
+            operator, results = distinct(self.tuples, verify=False)
+        self.assertLess(len(results), 700)
+
+
+class XunionTest(unittest.TestCase):
+
+    def union(self, left, right):
+        inputs = []
+        for tuples in [left, right]:
+            queue = ThreadQueue()
+            for t in tuples:
+                queue.put(dict(t))
+            queue.put('EOF')
+            inputs.append(queue)
+        out = ThreadQueue()
+        Xunion({'x'}, {'x', 'y'}, distinct=True).executeInputs(inputs, [{'x'}, {'x', 'y'}], out)
+        results = []
+        t = out.get()
+        while t != 'EOF':
+            results.append((t['x'], t['y']))
+            t = out.get()
+        return results
+
+    def test_duplicates_are_filtered(self):
+        left = [{'x': str(i % 50)} for i in range(200)]
+        right = [{'x': str(i % 50), 'y': ''} for i in range(100)] + [{'x': '1', 'y': '2'}]
+        results = self.union(left, right)
+        self.assertEqual(sorted(results), sorted([(str(i), '') for i in range(50)] + [('1', '2')]))
+
+    def test_collisions_are_verified(self):
+        left = [{'x': str(i % 500)} for i in range(1000)]
+        with mock.patch.object(xunion, 'fingerprint', colliding):
+            results = self.union(left, [])
+        self.assertEqual(sorted(set(results)), sorted((str(i), '') for i in range(500)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+import os
+import tempfile
+import threading
+import unittest
+from time import sleep, time
+from unittest import mock
+
+from awudima.mediator.engine import ExecutionContext, ProcessEngine, ThreadEngine, WorkerPool, get_engine
+from awudima.mediator.PhysicalPlanOperators import NodeOperator
+from awudima.operators.nonblocking.Xdistinct import Xdistinct
+
+
+class Leaf(object):
+    # Child node of a plan that produces the given tuples.
+
+    def __init__(self, tuples, vars):
+        self.tuples = tuples
+        self.vars = vars
+        self.engine = None
+
+    def execute(self, queue):
+        def run():
+            for t in self.tuples:
+                queue.put(dict(t))
+            queue.put('EOF')
+        if self.engine.start(run) is None:
+            queue.put('EOF')
+
+
+def results(queue):
+    # Tuples of the queue, up to its EOF (queue.Empty is raised if the producer died).
+    tuples = []
+    t = queue.get(True, 10)
+    while t != 'EOF':
+        tuples.append(t)
+        t = queue.get(True, 10)
+    return tuples
+
+
+class EngineTest(unittest.TestCase):
+
+    tuples = [{'x': str(i % 300)} for i in range(1000)]
+
+    def run_plan(self, engine):
+        node = NodeOperator(Xdistinct(None), {'x'}, None, Leaf(self.tuples, {'x'}))
+        node.engine = engine
+        out = engine.queue()
+        node.execute(out)
+        return results(out)
+
+    def test_threads(self):
+        self.assertEqual(self.run_plan(ThreadEngine()), self.tuples[:300])
+        self.assertEqual(self.run_plan(ThreadEngine(block_size=1)), self.tuples[:300])
+
+    def test_processes(self):
+        self.assertEqual(self.run_plan(ProcessEngine()), self.tuples[:300])
+
+    def test_get_engine(self):
+        self.assertIsInstance(get_engine(), ProcessEngine)
+        self.assertIsInstance(get_engine('threads'), ThreadEngine)
+        engine = ThreadEngine(block_size=10)
+        self.assertIs(get_engine(engine), engine)
+        with self.assertRaises(ValueError):
+            get_engine('fibers')
+
+
+class ExecutionContextTest(unittest.TestCase):
+
+    def test_tmpdir_of_threads(self):
+        # Operators of the threads engine flush their tables to the directory of the query, not the global one.
+        context = ExecutionContext('threads')
+        tuples = [{'x': str(i)} for i in range(2000)] * 2
+        node = NodeOperator(Xdistinct(None), {'x'}, None, Leaf(tuples, {'x'}))
+        node.engine = context
+        node.operator.memorySize = 5000
+        out = context.queue()
+        with mock.patch.object(tempfile, 'tempdir', os.path.join(context.tmpdir, 'missing')):
+            node.execute(out)
+            self.assertEqual(len(results(out)), 2000)
+        self.assertEqual(node.operator.tmpdir, context.tmpdir)
+        self.assertTrue(any(node.operator.spilled))
+        context.close()
+        self.assertFalse(os.path.exists(context.tmpdir))
+
+    def test_reap(self):
+        # Worker processes still running after the grace period are terminated.
+        context = ExecutionContext('processes')
+        worker = context.start(sleep, (60,))
+        start = time()
+        context.close(grace_period=0.1)
+        self.assertFalse(worker.is_alive())
+        self.assertLess(time() - start, 10)
+
+    def test_max_workers(self):
+        # Workers beyond max_workers are started as threads.
+        context = ExecutionContext('processes', max_workers=1)
+        first = context.start(sleep, (60,))
+        second = context.start(sleep, (0,))
+        self.assertTrue(hasattr(first, 'terminate'))
+        self.assertFalse(hasattr(second, 'terminate'))
+        context.cancel()
+        self.assertFalse(first.is_alive())
+
+    def test_cancel_plan(self):
+        # The operators of a cancelled query exit, and the operators not started yet put their EOF.
+        context = ExecutionContext('threads')
+        stopped = context.stopped
+
+        class Endless(Leaf):
+            def execute(self, queue):
+                def run():
+                    while not stopped.is_set():
+                        queue.put({'x': '1'})
+                        sleep(0.001)
+                    queue.put('EOF')
+                if self.engine.start(run) is None:
+                    queue.put('EOF')
+
+        node = NodeOperator(Xdistinct(None), {'x'}, None, Endless([], {'x'}))
+        node.engine = context
+        out = context.queue()
+        node.execute(out)
+        self.assertEqual(out.get(True, 10), {'x': '1'})
+        context.cancel()
+        self.assertEqual(results(out), [])
+        node = NodeOperator(Xdistinct(None), {'x'}, None, Endless([], {'x'}))
+        node.engine = context
+        out = context.queue()
+        node.execute(out)
+        self.assertEqual(results(out), [])
+
+    def test_cancel(self):
+        context = ExecutionContext('threads')
+        context.cancel('cancelled')
+        self.assertTrue(context.cancelled)
+        self.assertTrue(context.stopped.is_set())
+        self.assertEqual(context.reason, 'cancelled')
+        self.assertIsNone(context.start(print))
+        context.close()
+
+    def test_timeout(self):
+        context = ExecutionContext('threads', timeout=0.1)
+        self.assertTrue(context.stopped.wait(5))
+        self.assertTrue(context.cancelled)
+        self.assertEqual(context.reason, 'timeout')
+        context.close()
+
+
+
+class WorkerPoolTest(unittest.TestCase):
+
+    def test_admit_and_release(self):
+        pool = WorkerPool(4, max_workers=3, engine='threads')
+        first = pool.admit()
+        second = pool.admit(max_workers=1)
+        self.assertEqual(pool.stats(), {'size': 4, 'free': 0, 'running': 2, 'waiting': 0})
+        # The pool is busy.
+        self.assertIsNone(pool.admit(wait_timeout=0.1))
+        pool.release(first)
+        self.assertEqual(pool.stats()['free'], 3)
+        second.close()
+        self.assertEqual(pool.stats(), {'size': 4, 'free': 4, 'running': 0, 'waiting': 0})
+
+    def test_waiting_queries_are_admitted_in_order(self):
+        pool = WorkerPool(2, max_workers=2, engine='threads')
+        running = pool.admit()
+        admitted = []
+
+        def wait():
+            context = pool.admit()
+            admitted.append(context)
+            context.close()
+        waiting = threading.Thread(target=wait)
+        waiting.start()
+        while pool.stats()['waiting'] == 0:
+            sleep(0.01)
+        self.assertIsNone(pool.admit(wait_timeout=0.1))
+        running.cancel()
+        waiting.join(10)
+        self.assertEqual(len(admitted), 1)
+        self.assertEqual(pool.stats(), {'size': 2, 'free': 2, 'running': 0, 'waiting': 0})
+
+    def test_max_waiting(self):
+        pool = WorkerPool(2, max_workers=2, max_waiting=0, engine='threads')
+        context = pool.admit()
+        self.assertIsNone(pool.admit())
+        context.close()
+        self.assertIsNotNone(pool.admit())
+
+    def test_defaults_of_the_queries(self):
+        pool = WorkerPool(4, max_workers=2, engine='threads', memory_budget=1 << 20, bindjoin_cache=100)
+        context = pool.admit()
+        self.assertEqual(context.memory.limit, 1 << 20)
+        self.assertIsNotNone(context.bindjoin_cache)
+        self.assertEqual(context.max_workers, 2)
+        context.close()
+
+    def test_rollback_when_the_context_fails(self):
+        pool = WorkerPool(4, max_workers=2, engine='threads')
+        with mock.patch.object(tempfile, 'mkdtemp', side_effect=OSError('No space left on device')):
+            with self.assertRaises(OSError):
+                pool.admit()
+        self.assertEqual(pool.stats(), {'size': 4, 'free': 4, 'running': 0, 'waiting': 0})
+
+if __name__ == '__main__':
+    unittest.main()
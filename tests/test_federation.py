@@ -0,0 +1,73 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from awudima.pyrdfmt.federation import FederationCache
+
+FEDERATION = os.path.join(os.path.dirname(__file__), 'data', 'federation.json')
+
+
+class FederationCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'federation.json')
+        shutil.copy(FEDERATION, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def rewrite(self, fed, mtime=None):
+        with open(self.path, 'w') as f:
+            json.dump(fed, f)
+        if mtime is not None:
+            os.utime(self.path, ns=(mtime, mtime))
+
+    def test_parsed_once(self):
+        cache = FederationCache(self.path)
+        federation = cache.get()
+        self.assertIsNotNone(federation)
+        self.assertIs(cache.get(), federation)
+        self.assertEqual(len(federation.datasources), 2)
+
+    def test_touched_file_is_not_parsed_again(self):
+        # Same content, different mtime: the file is hashed again, but not parsed.
+        cache = FederationCache(self.path)
+        federation = cache.get()
+        digest = cache.digest
+        shutil.copyfile(FEDERATION, self.path)
+        mtime = os.stat(self.path).st_mtime_ns + 10 ** 9
+        os.utime(self.path, ns=(mtime, mtime))
+        self.assertIs(cache.get(), federation)
+        self.assertEqual(cache.digest, digest)
+
+    def test_changed_file_is_parsed_again(self):
+        cache = FederationCache(self.path)
+        federation = cache.get()
+        with open(self.path) as f:
+            fed = json.load(f)
+        fed['sources']['ds3'] = dict(fed['sources']['ds2'], name='ds3', dsId='ds3', url='http://localhost:3/sparql')
+        self.rewrite(fed, mtime=os.stat(self.path).st_mtime_ns + 10 ** 9)
+        changed = cache.get()
+        self.assertIsNot(changed, federation)
+        self.assertEqual(len(changed.datasources), 3)
+        self.assertNotEqual(changed.fingerprint, federation.fingerprint)
+
+    def test_missing_or_invalid_file(self):
+        self.assertIsNone(FederationCache(os.path.join(self.tmpdir, 'missing.json')).get())
+        self.rewrite({'name': 'no fedId'})
+        self.assertIsNone(FederationCache(self.path).get())
+
+    def test_set(self):
+        cache = FederationCache(self.path)
+        federation = cache.get()
+        other = FederationCache(os.path.join(self.tmpdir, 'other.json'))
+        other.set(federation)
+        self.assertIs(other.get(), federation)
+        self.assertEqual(FederationCache(other.path).get().fingerprint, federation.fingerprint)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import contextlib
+import io
+import random
+import unittest
+
+from awudima.operators.Multiplexer import ThreadQueue
+from awudima.operators.nonblocking.Xfilter import Xfilter
+from awudima.operators.nonblocking.VectorFilter import VectorFilter, numpy_available
+from awudima.pysparql import queryParser, Filter
+
+XSD = 'http://www.w3.org/2001/XMLSchema#'
+
+QUERY = 'SELECT * WHERE { ?x <http://p> ?a . ?x <http://q> ?b . ?x <http://r> ?s . ?x <http://t> ?t . ' \
+        '?x <http://d> ?d . ?x <http://e> ?e FILTER (%s) }'
+
+
+def parse(expression):
+    # The Filter of a query with the given FILTER expression.
+    with contextlib.redirect_stdout(io.StringIO()):
+        query = queryParser.parse(QUERY % expression)
+    filters = []
+
+    def walk(body):
+        if isinstance(body, Filter):
+            filters.append(body)
+            return
+        for child in body.triples if isinstance(getattr(body, 'triples', None), list) else []:
+            walk(child)
+        filters.extend(getattr(body, 'filters', None) or [])
+
+    walk(query.body)
+    return filters[0]
+
+
+def tuples(n, seed=1):
+    # Tuples with numerical, string, boolean and unbound values, in both result formats.
+    rnd = random.Random(seed)
+
+    def value():
+        c = rnd.random()
+        if c < 0.3:
+            return '%d^^<%sinteger>' % (rnd.randrange(-3, 12), XSD)
+        if c < 0.45:
+            return {'type': 'typed-literal', 'value': str(rnd.randrange(0, 12)), 'datatype': XSD + 'int'}
+        if c < 0.6:
+            return '%.1f^^<%sdecimal>' % (rnd.random() * 12, XSD)
+        if c < 0.75:
+            return rnd.choice(['foo', 'bar', '5', 'http://x/1'])
+        if c < 0.8:
+            return 'true^^<%sboolean>' % XSD
+        return {'type': 'literal', 'value': rnd.choice(['foo', 'x', ''])}
+
+    return [{var: value() for var in 'abst' if rnd.random() < 0.95} for i in range(n)]
+
+
+def run(operator, tuples):
+    left, out = ThreadQueue(), ThreadQueue()
+    for t in tuples:
+        left.put(t)
+    left.put('EOF')
+    with contextlib.redirect_stdout(io.StringIO()):
+        operator.execute(left, None, out)
+    results = []
+    t = out.get()
+    while t != 'EOF':
+        results.append(t)
+        t = out.get()
+    return results
+
+
+class CompiledFilterTest(unittest.TestCase):
+
+    filters = ['?a > 5', '?a >= 5 && ?b < 10.5', '?s = "foo"', '?s != "foo" || ?a = 3', '!(?a < 3)', '?a + ?b > 10',
+               'bound(?s)', '?a - 1 < ?b', '?s = ?t', '?a = "5"', '-?a < 0', 'str(?a) = "5"', '?a > 2.5']
+
+    @staticmethod
+    def outcome(evaluate, t):
+        try:
+            return evaluate(t)
+        except Exception:
+            return 'error'
+
+    def test_closures_agree_with_the_interpreter(self):
+        data = tuples(3000)
+        for expression in self.filters:
+            with self.subTest(expression=expression):
+                operator = Xfilter(parse(expression))
+                expr = operator.filter.expr
+                compiled = operator.compileExpression(expr.op, expr.left, expr.right)
+                self.assertIsNotNone(compiled)
+
+                def interpreted(t):
+                    return operator.evaluateComplexExpression(t, expr.op, (expr.left, None), (expr.right, None))
+
+                with contextlib.redirect_stdout(io.StringIO()):
+                    for t in data:
+                        self.assertEqual(self.outcome(compiled, t), self.outcome(interpreted, t), t)
+
+    def test_unsupported_operators_are_interpreted(self):
+        operator = Xfilter(parse('regex(?s, "fo")'), batch_size=1)
+        expr = operator.filter.expr
+        self.assertIsNone(operator.compileExpression(expr.op, expr.left, expr.right))
+
+        def selected(t):
+            try:
+                return operator.evaluateComplexExpression(t, expr.op, (expr.left, None), (expr.right, None))[0]
+            except Exception:
+                return False
+
+        data = tuples(500)
+        with contextlib.redirect_stdout(io.StringIO()):
+            expected = [t for t in data if selected(t)]
+        self.assertEqual(run(operator, data), expected)
+
+    def test_errors_evaluate_to_false(self):
+        operator = Xfilter(parse('?a > 5'), batch_size=1)
+        data = [{'a': '7^^<%sinteger>' % XSD}, {}, {'b': '9^^<%sinteger>' % XSD}, {'a': '3^^<%sinteger>' % XSD}]
+        self.assertEqual(run(operator, data), data[:1])
+
+
+def datetimes(n, seed=1):
+    # Tuples with xsd:dateTime values (with and without timezone, and malformed) mixed with other values.
+    rnd = random.Random(seed)
+    others = tuples(n, seed)
+
+    def value():
+        s = '%04d-%02d-%02dT%02d:%02d:%02d' % (rnd.choice([2019, 2020, 2021]), rnd.randrange(1, 13), rnd.randrange(1, 28),
+                                               rnd.randrange(24), rnd.randrange(60), rnd.randrange(60))
+        return '%s%s^^<%sdateTime>' % (s, rnd.choice(['', 'Z', '+02:00', '.5', 'bad']), XSD)
+
+    for t in others:
+        for var in 'de':
+            if rnd.random() < 0.7:
+                t[var] = value()
+            elif rnd.random() < 0.9:
+                t[var] = t.get('a', 'foo')
+    return others
+
+
+@unittest.skipUnless(numpy_available(), 'numpy is not installed')
+class VectorFilterTest(unittest.TestCase):
+
+    filters = ['?a > 5', '?a >= 5 && ?b < 10.5', '?s = "foo"', '?s != "foo" || ?a = 3', '!(?a < 3)', '?a = ?b',
+               '?a < ?b', '?s = ?t', '?s < ?t', '?a = "5"', '?a > 2.5', '?a <= "x"',
+               '?d > "2020-06-01T00:00:00Z"^^<%sdateTime>' % XSD,
+               '?d >= "2020-06-01T00:00:00" && ?d < "2021-01-01T00:00:00+02:00"', '?d = ?e', '?d < ?e',
+               '!(?d > "2020-06-01T00:00:00Z")', '?a < 3 || ?d > "2020-06-01T00:00:00"']
+
+    def test_blocks_agree_with_tuple_by_tuple(self):
+        data = datetimes(3000)
+        for expression in self.filters:
+            with self.subTest(expression=expression):
+                filter = parse(expression)
+                self.assertTrue(VectorFilter(filter.expr).vectorizable())
+                self.assertEqual(run(Xfilter(filter, batch_size=256), data), run(Xfilter(filter, batch_size=1), data))
+
+    def test_unsupported_expressions_are_not_vectorized(self):
+        for expression in ['regex(?s, "fo")', 'bound(?s)', '?a + ?b > 10', 'str(?a) = "5"']:
+            with self.subTest(expression=expression):
+                filter = parse(expression)
+                self.assertFalse(VectorFilter(filter.expr).vectorizable())
+                data = tuples(500)
+                self.assertEqual(run(Xfilter(filter), data), run(Xfilter(filter, batch_size=1), data))
+
+    def test_blocks_keep_the_order_of_the_tuples(self):
+        data = [{'a': '%d^^<%sinteger>' % (i % 10, XSD), 'x': str(i)} for i in range(1000)]
+        results = run(Xfilter(parse('?a > 5'), batch_size=64), data)
+        self.assertEqual([t['x'] for t in results], [str(i) for i in range(1000) if i % 10 > 5])
+
+
+if __name__ == '__main__':
+    unittest.main()
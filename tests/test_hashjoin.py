@@ -0,0 +1,61 @@
+import unittest
+
+from awudima.operators.MemoryBudget import MemoryBudget
+from awudima.operators.blocking.HybridHashJoin import HybridHashJoin
+from awudima.operators.nonblocking.Xgjoin import Xgjoin
+
+from tests.test_spill import data, join
+
+
+class HybridHashJoinTest(unittest.TestCase):
+
+    def test_in_memory(self):
+        left, right, expected = data(3000, 500, 5)
+        operator = HybridHashJoin({'k'})
+        self.assertEqual(join(operator, left, right), expected)
+        self.assertFalse(any(operator.spilled))
+
+    def test_spilled(self):
+        left, right, expected = data(3000, 500, 5)
+        operator = HybridHashJoin({'k'})
+        operator.memorySize = 50000
+        self.assertEqual(join(operator, left, right), expected)
+        self.assertTrue(any(operator.spilled))
+
+    def test_memory_budget(self):
+        left, right, expected = data(3000, 500, 6)
+        operator = HybridHashJoin({'k'}, partitions=4)
+        operator.memory = MemoryBudget(100000)
+        self.assertEqual(join(operator, left, right), expected)
+        self.assertTrue(any(operator.spilled))
+        self.assertEqual(operator.memory.stats()['used'], 0)
+
+    def test_skewed_inputs(self):
+        # All the tuples share a join key: a single partition holds both inputs.
+        left, right, expected = data(300, 1, 7)
+        operator = HybridHashJoin({'k'})
+        operator.memorySize = 20000
+        self.assertEqual(join(operator, left, right), expected)
+
+    def test_empty_input(self):
+        left, right, _ = data(100, 10, 8)
+        self.assertEqual(sum(join(HybridHashJoin({'k'}), left, []).values()), 0)
+        self.assertEqual(sum(join(HybridHashJoin({'k'}), [], right).values()), 0)
+
+
+class PlannerTest(unittest.TestCase):
+
+    def test_non_selective_joins_under_a_budget(self):
+        from awudima.mediator.planner.QueryPlanner import AwudimaPlanner
+
+        planner = AwudimaPlanner.__new__(AwudimaPlanner)
+        planner.config, planner.query = None, None
+        planner.memory_budget = None
+        self.assertIsInstance(planner.make_non_selective_join({'k'}, {'k'}, None, None, set()).operator, Xgjoin)
+        planner.memory_budget = 1 << 20
+        self.assertIsInstance(planner.make_non_selective_join({'k'}, {'k'}, None, None, set()).operator,
+                              HybridHashJoin)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+from awudima.operators.JoinKey import key_function, value
+
+
+class JoinKeyTest(unittest.TestCase):
+
+    def test_values(self):
+        self.assertEqual(value('http://example.org/a'), 'http://example.org/a')
+        self.assertIsNone(value(None))
+        self.assertEqual(value({'type': 'uri', 'value': 'http://example.org/a'}), 'http://example.org/a')
+        self.assertEqual(value({'type': 'literal', 'value': b'caf\xc3\xa9'}), 'caf\xe9')
+        self.assertEqual(value({'type': 'literal', 'value': 'chat', 'xml:lang': 'fr'}), 'chat@fr')
+        self.assertEqual(value(5), '5')
+
+    def test_keys(self):
+        key = key_function({'b', 'a'})
+        # Values in order of the variables.
+        self.assertEqual(key({'a': '1', 'b': '2', 'c': '3'}), ('1', '2'))
+        self.assertEqual(key({'a': {'type': 'uri', 'value': '1'}, 'b': '2'}), ('1', '2'))
+        self.assertEqual(key({'b': '2'}), (None, '2'))
+
+    def test_keys_are_unambiguous(self):
+        key = key_function(['x', 'y'])
+        self.assertNotEqual(key({'x': 'ab', 'y': 'c'}), key({'x': 'a', 'y': 'bc'}))
+
+    def test_keys_of_strings_and_terms_match(self):
+        # Sources that return strings and sources that return RDF terms are joined on the same keys.
+        key = key_function(['x'])
+        self.assertEqual(key({'x': 'http://example.org/a'}), key({'x': {'type': 'uri', 'value': 'http://example.org/a'}}))
+
+    def test_functions_are_shared(self):
+        self.assertIs(key_function(['a', 'b']), key_function({'b', 'a'}))
+        self.assertIsNot(key_function(['a']), key_function(['a', 'b']))
+        self.assertEqual(key_function([])({'a': '1'}), ())
+
+
+if __name__ == '__main__':
+    unittest.main()
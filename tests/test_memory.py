@@ -0,0 +1,88 @@
+import threading
+import unittest
+from collections import Counter
+from unittest import mock
+
+from awudima.operators.MemoryBudget import MemoryBudget, MemoryAccount, GRANULE, sizeof
+from awudima.operators.Multiplexer import ThreadQueue
+from awudima.operators.nonblocking.Xgjoin import Xgjoin
+from awudima.operators.nonblocking.Xgoptional import Xgoptional
+
+from tests.test_spill import data, feed, join
+
+
+class MemoryBudgetTest(unittest.TestCase):
+
+    def test_accounts_share_the_budget(self):
+        budget = MemoryBudget(3 * GRANULE)
+        first, second = budget.account(), budget.account()
+        first.add(2 * GRANULE)
+        self.assertFalse(first.exceeded())
+        second.add(GRANULE // 2)
+        # Bytes not reported yet are taken into account by their own account.
+        self.assertEqual(budget.stats()['used'], 2 * GRANULE)
+        second.add(GRANULE)
+        self.assertTrue(second.exceeded())
+        self.assertTrue(first.exceeded())
+        first.free(2 * GRANULE)
+        self.assertFalse(second.exceeded())
+        first.close()
+        second.close()
+        self.assertEqual(budget.stats()['used'], 0)
+
+    def test_account_without_budget(self):
+        account = MemoryAccount()
+        account.add(1 << 40)
+        self.assertFalse(account.exceeded())
+        self.assertEqual(account.size, 1 << 40)
+
+    def test_sizeof(self):
+        small = sizeof({'x': 'a'})
+        self.assertGreater(sizeof({'x': 'a' * 1000}), small + 900)
+        self.assertGreater(sizeof({'x': {'type': 'literal', 'value': 'a' * 1000}}), small + 900)
+
+
+def optional(operator, left, right):
+    left_queue, right_queue, out = ThreadQueue(), ThreadQueue(), ThreadQueue()
+    threads = [threading.Thread(target=feed, args=(left_queue, left)),
+               threading.Thread(target=feed, args=(right_queue, right))]
+    [t.start() for t in threads]
+    operator.execute(left_queue, right_queue, out)
+    results = Counter()
+    t = out.get()
+    while t != 'EOF':
+        # Unbound variables are not in the tuple.
+        results[(t['k'], t['a'], t.get('b', ''))] += 1
+        t = out.get()
+    return results
+
+
+class BudgetedOperatorsTest(unittest.TestCase):
+    # Results under a memory budget, i.e., with partitions in secondary memory, are the results in main memory.
+
+    def test_xgjoin(self):
+        left, right, expected = data(3000, 400, 3)
+        operator = Xgjoin({'k'})
+        operator.memory = MemoryBudget(100000)
+        self.assertEqual(join(operator, left, right), expected)
+        self.assertGreater(len(operator.fileDescriptor_left) + len(operator.fileDescriptor_right), 0)
+        self.assertEqual(operator.memory.stats()['used'], 0)
+
+    def test_xgoptional(self):
+        left, right, expected = data(3000, 2000, 4)
+        matched = {l for (l, a, b) in expected}
+        for l in left:
+            if l['k'] not in matched:
+                expected[(l['k'], l['a'], '')] += 1
+        for budget in [None, MemoryBudget(100000)]:
+            operator = Xgoptional({'k', 'a'}, {'k', 'b'})
+            operator.memory = budget
+            with mock.patch.object(Xgoptional, 'spill', autospec=True, side_effect=Xgoptional.spill) as spill:
+                self.assertEqual(optional(operator, left, right), expected)
+            self.assertEqual(spill.called, budget is not None)
+        self.assertEqual(budget.stats()['used'], 0)
+
+
+
+if __name__ == '__main__':
+    unittest.main()
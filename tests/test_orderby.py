@@ -0,0 +1,146 @@
+import contextlib
+import io
+import random
+import unittest
+from unittest import mock
+
+from awudima.operators.Multiplexer import ThreadQueue
+from awudima.operators.MemoryBudget import MemoryBudget
+from awudima.operators.modifiers import Xorderby as xorderby
+from awudima.operators.modifiers.Xorderby import Xorderby, term_key
+from awudima.pysparql import queryParser
+
+XSD = 'http://www.w3.org/2001/XMLSchema#'
+
+
+def conditions(order_by):
+    with contextlib.redirect_stdout(io.StringIO()):
+        query = queryParser.parse('SELECT ?a ?b WHERE { ?x <http://p> ?a . ?x <http://q> ?b } ORDER BY ' + order_by)
+    return query.order_by
+
+
+def data(n, seed=4):
+    # Tuples with an id, and values of every kind of term (some of them unbound) for ?a and ?b.
+    rnd = random.Random(seed)
+
+    def value():
+        c = rnd.random()
+        if c < 0.3:
+            return '%d^^<%sinteger>' % (rnd.randrange(50), XSD)
+        if c < 0.4:
+            return '%.1f^^<%sdecimal>' % (rnd.random() * 50, XSD)
+        if c < 0.5:
+            return '2020-%02d-01T00:00:00Z^^<%sdateTime>' % (rnd.randrange(1, 13), XSD)
+        if c < 0.7:
+            return 'http://x/%d' % rnd.randrange(50)
+        if c < 0.8:
+            return rnd.choice(['foo', 'bar', 'baz', 'a b'])
+        if c < 0.85:
+            return '_:b%d' % rnd.randrange(5)
+        if c < 0.9:
+            return None
+        return {'type': 'literal', 'value': rnd.choice(['foo', 'zz']), 'xml:lang': 'en'}
+
+    tuples = []
+    for i in range(n):
+        t = {'id': i}
+        for var in 'ab':
+            v = value()
+            if v is not None:
+                t[var] = v
+        tuples.append(t)
+    return tuples
+
+
+def expected(tuples, args):
+    # Stable sort by every condition, from the last one to the first one.
+    results = list(tuples)
+    for arg in reversed(args):
+        var = arg.name[1:]
+        results = sorted(results, key=lambda t: term_key(t.get(var)), reverse=arg.desc)
+    return [t['id'] for t in results]
+
+
+def run(operator, tuples):
+    left, out = ThreadQueue(), ThreadQueue()
+    for t in tuples:
+        left.put(t)
+    left.put('EOF')
+    operator.execute(left, None, out)
+    results = []
+    t = out.get()
+    while t != 'EOF':
+        results.append(t['id'])
+        t = out.get()
+    return results
+
+
+class TermKeyTest(unittest.TestCase):
+
+    def test_order_of_the_terms(self):
+        terms = ['', '_:b1', 'http://x/1', '2^^<%sinteger>' % XSD, '10^^<%sinteger>' % XSD,
+                 '10.5^^<%sdecimal>' % XSD, '2020-01-01T00:00:00Z^^<%sdateTime>' % XSD, 'abc']
+        shuffled = list(reversed(terms))
+        self.assertEqual(sorted(shuffled, key=term_key), terms)
+
+    def test_datetimes_are_compared_in_utc(self):
+        self.assertLess(term_key('2020-01-01T10:00:00+02:00^^<%sdateTime>' % XSD),
+                        term_key('2020-01-01T09:00:00Z^^<%sdateTime>' % XSD))
+
+    def test_json_terms(self):
+        self.assertEqual(term_key({'type': 'uri', 'value': 'http://x/1'}), term_key('http://x/1'))
+        self.assertEqual(term_key({'type': 'typed-literal', 'value': '7', 'datatype': XSD + 'int'}),
+                         term_key('7^^<%sinteger>' % XSD))
+        self.assertEqual(term_key({'type': 'bnode', 'value': 'b1'}), term_key('_:b1'))
+
+
+class XorderbyTest(unittest.TestCase):
+
+    tuples = data(5000)
+    args = conditions('DESC(?b) ?a')
+
+    def test_sort_in_memory(self):
+        self.assertEqual(run(Xorderby(self.args), self.tuples), expected(self.tuples, self.args))
+
+    def test_sort_is_stable(self):
+        args = conditions('?a')
+        self.assertEqual(run(Xorderby(args), self.tuples), expected(self.tuples, args))
+
+    def test_external_sort(self):
+        operator = Xorderby(self.args)
+        operator.memorySize = 20000
+        with mock.patch.object(Xorderby, 'writeRun', autospec=True, side_effect=Xorderby.writeRun) as writeRun:
+            results = run(operator, self.tuples)
+        self.assertGreater(writeRun.call_count, 1)
+        self.assertEqual(results, expected(self.tuples, self.args))
+        self.assertEqual(operator.account.size, 0)
+
+    def test_external_sort_with_memory_budget(self):
+        operator = Xorderby(self.args)
+        operator.memory = MemoryBudget(20000)
+        with mock.patch.object(Xorderby, 'writeRun', autospec=True, side_effect=Xorderby.writeRun) as writeRun:
+            results = run(operator, self.tuples)
+        self.assertGreater(writeRun.call_count, 1)
+        self.assertEqual(results, expected(self.tuples, self.args))
+        self.assertEqual(operator.memory.stats()['used'], 0)
+
+    def test_top_k(self):
+        for limit in [1, 15, 5000, 6000]:
+            with self.subTest(limit=limit):
+                operator = Xorderby(self.args, limit)
+                with mock.patch.object(Xorderby, 'sort', autospec=True) as sort:
+                    results = run(operator, self.tuples)
+                sort.assert_not_called()
+                self.assertEqual(results, expected(self.tuples, self.args)[:limit])
+
+    def test_large_limit_sorts_all_tuples(self):
+        with mock.patch.object(xorderby, 'MAX_TOP_K', 10):
+            operator = Xorderby(self.args, 15)
+            operator.memorySize = 20000
+            results = run(operator, self.tuples)
+        # The operator produces all the tuples, the limit is applied by the modifiers of the query.
+        self.assertEqual(results, expected(self.tuples, self.args))
+
+
+if __name__ == '__main__':
+    unittest.main()
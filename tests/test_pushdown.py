@@ -0,0 +1,160 @@
+import contextlib
+import io
+import re
+import unittest
+from unittest import mock
+
+from awudima.mediator.executor import AwudimaFQP
+from awudima.mediator.planner.QueryPlanner import AwudimaPlanner
+from awudima.mediator.PhysicalPlanOperators import LeafOperator, NodeOperator
+from awudima.operators.Multiplexer import ThreadQueue
+from awudima.pysparql import SPARQLEndpointWrapper
+from awudima.wrappers.mysql import MySQLWrapper
+from awudima.wrappers.triplestore import RDFStore
+from tests.test_cache import federation
+from tests.test_engine import results
+
+PREFIX = 'PREFIX x: <http://x/> '
+
+
+def operators(plan):
+    # Names of the operators of a plan, from the root to the first leaf.
+    names = []
+    while isinstance(plan, NodeOperator):
+        names.append(type(plan.operator).__name__)
+        plan = plan.left
+    return names
+
+
+def leaves(plan):
+    if isinstance(plan, LeafOperator):
+        return [plan]
+    if isinstance(plan, NodeOperator):
+        return leaves(plan.left) + (leaves(plan.right) if plan.right else [])
+    return []
+
+
+class PlannerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.federation = federation()
+        cls.fqp = AwudimaFQP(cls.federation)
+
+    def plan(self, query):
+        query = PREFIX + query
+        with contextlib.redirect_stdout(io.StringIO()):
+            return AwudimaPlanner(query, self.fqp.decompose(query), self.federation).create_physical_plan()
+
+    def pushed(self, plan):
+        return [(leaf.max_results, leaf.offset) for leaf in leaves(plan)]
+
+    def test_single_source(self):
+        plan = self.plan('SELECT ?n WHERE { ?p x:name ?n } LIMIT 10 OFFSET 5')
+        self.assertEqual(self.pushed(plan), [(10, 5)])
+        self.assertNotIn('Xoffset', operators(plan))
+
+    def test_single_source_distinct(self):
+        plan = self.plan('SELECT DISTINCT ?n WHERE { ?p x:name ?n } LIMIT 10 OFFSET 5')
+        self.assertEqual(self.pushed(plan), [(10, 5)])
+        self.assertIn('SELECT DISTINCT ?n', leaves(plan)[0].query_str)
+
+    def test_union(self):
+        # Every input of the union produces the first LIMIT + OFFSET results, the offset is applied by the mediator.
+        plan = self.plan('SELECT ?n WHERE { { ?p x:name ?n } UNION { ?o x:label ?n } } LIMIT 10 OFFSET 5')
+        self.assertEqual(self.pushed(plan), [(15, -1), (15, -1)])
+        self.assertIn('Xoffset', operators(plan))
+
+    def test_ask(self):
+        self.assertEqual(self.pushed(self.plan('ASK { ?p x:name ?n }')), [(1, -1)])
+
+    def test_not_pushed(self):
+        for query in ['SELECT ?n WHERE { ?p x:name ?n } ORDER BY ?n LIMIT 10',
+                      'SELECT DISTINCT ?n WHERE { { ?p x:name ?n } UNION { ?o x:label ?n } } LIMIT 10',
+                      'SELECT ?n ?l WHERE { ?p x:worksFor ?o . ?p x:name ?n . ?o x:label ?l } LIMIT 10']:
+            with self.subTest(query=query):
+                plan = self.plan(query)
+                self.assertTrue(all(pushed == (-1, -1) for pushed in self.pushed(plan)))
+                self.assertEqual(operators(plan)[0], 'Xlimit')
+
+
+class Datasource(object):
+    name = 'ds'
+    url = 'http://localhost/sparql'
+
+
+def page(query):
+    (limit, offset) = re.search(r'LIMIT (\d+) OFFSET (\d+)', query).groups()
+    return int(limit), int(offset)
+
+
+class RDFStoreTest(unittest.TestCase):
+    # The source has 100 results.
+
+    def execute(self, limit, offset, max_results):
+        pages = []
+
+        def contact(query, endpoint):
+            (size, start) = page(query)
+            pages.append((size, start))
+            n = max(0, min(size, 100 - start))
+            return [{'x': str(i)} for i in range(start, start + n)], n
+
+        out = ThreadQueue()
+        with mock.patch.object(SPARQLEndpointWrapper, 'contact_sparql_endpoint', side_effect=contact), \
+                contextlib.redirect_stdout(io.StringIO()):
+            RDFStore(Datasource(), None).executeQuery('SELECT * WHERE { ?x ?p ?o }', out, {}, limit, offset, max_results)
+        return pages, [int(t['x']) for t in results(out)]
+
+    def test_all_results(self):
+        pages, tuples = self.execute(10, -1, -1)
+        self.assertEqual(len(pages), 11)
+        self.assertEqual(tuples, list(range(100)))
+
+    def test_max_results(self):
+        pages, tuples = self.execute(10, 5, 25)
+        self.assertEqual(pages, [(10, 5), (10, 15), (5, 25)])
+        self.assertEqual(tuples, list(range(5, 30)))
+
+    def test_no_results_needed(self):
+        self.assertEqual(self.execute(10, 0, 0), ([], []))
+
+    def test_last_page_of_the_source(self):
+        self.assertEqual(self.execute(10, 95, 20), ([(10, 95)], list(range(95, 100))))
+
+
+class MySQLTest(unittest.TestCase):
+
+    def test_rows_with_null_values_are_not_counted(self):
+        # Every third row has a null value and is dropped: more pages are fetched until 25 rows are produced.
+        pages = []
+
+        class Cursor(object):
+            column_names = ['x']
+            rows = []
+
+            def execute(self, query):
+                if query.startswith('use'):
+                    return
+                (size, start) = page(query)
+                pages.append((size, start))
+                self.rows = [('null' if i % 3 == 0 else str(i),) for i in range(start, min(start + size, 100))]
+
+            def __iter__(self):
+                return iter(self.rows)
+
+        class Connection(object):
+            def cursor(self):
+                return Cursor()
+
+        wrapper = MySQLWrapper.__new__(MySQLWrapper)
+        wrapper.database_name = 'db'
+        wrapper.init_connection = Connection
+        out = ThreadQueue()
+        wrapper.executeQuery('SELECT x', out, {'x': {'type': 'literal', 'value': ''}}, 10, -1, 25)
+        self.assertEqual(len(results(out)), 25)
+        self.assertEqual(pages, [(10, 0), (10, 10), (10, 20), (5, 30), (2, 35), (1, 37)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,160 @@
+import threading
+import unittest
+from multiprocessing import Process, Queue
+from threading import Event
+from time import sleep, time
+
+from awudima.operators.BlockQueue import BlockQueue
+from awudima.operators.Multiplexer import InputMultiplexer, ThreadQueue
+
+
+def feed(queue, tuples, delay=0):
+    for t in tuples:
+        if delay:
+            sleep(delay)
+        queue.put(t)
+    queue.put('EOF')
+
+
+def drain(multiplexer):
+    results = []
+    while len(multiplexer) > 0:
+        results.append(multiplexer.get())
+    return results
+
+
+class InputMultiplexerTest(unittest.TestCase):
+
+    def test_thread_queues(self):
+        left, right = ThreadQueue(), ThreadQueue()
+        threads = [threading.Thread(target=feed, args=(left, range(100), 0.0001)),
+                   threading.Thread(target=feed, args=(right, range(50)))]
+        [t.start() for t in threads]
+        results = drain(InputMultiplexer(left, right))
+        self.assertEqual([t for (i, t) in results if i == 0], list(range(100)) + ['EOF'])
+        self.assertEqual([t for (i, t) in results if i == 1], list(range(50)) + ['EOF'])
+
+    def test_process_queues(self):
+        left, right = Queue(), Queue()
+        threading.Thread(target=feed, args=(left, range(20))).start()
+        threading.Thread(target=feed, args=(right, range(30), 0.001)).start()
+        results = drain(InputMultiplexer(left, right))
+        self.assertEqual(len([t for (i, t) in results if i == 0]), 21)
+        self.assertEqual(len([t for (i, t) in results if i == 1]), 31)
+
+    def test_round_robin(self):
+        left, right = ThreadQueue(), ThreadQueue()
+        feed(left, range(10))
+        feed(right, range(10))
+        keys = [i for (i, t) in drain(InputMultiplexer(left, right))]
+        self.assertEqual(keys[:6], [0, 1, 0, 1, 0, 1])
+
+    def test_timeout(self):
+        multiplexer = InputMultiplexer(ThreadQueue())
+        start = time()
+        self.assertIsNone(multiplexer.get(0.1))
+        self.assertLess(time() - start, 1)
+
+    def test_pause(self):
+        left, right = ThreadQueue(), ThreadQueue()
+        feed(left, range(3))
+        multiplexer = InputMultiplexer(left, right)
+        multiplexer.pause(0)
+        self.assertIsNone(multiplexer.get(0.1))
+        right.put('x')
+        self.assertEqual(multiplexer.get(), (1, 'x'))
+        multiplexer.resume(0)
+        self.assertEqual(multiplexer.get(), (0, 0))
+
+    def test_added_inputs(self):
+        multiplexer = InputMultiplexer(ThreadQueue())
+        queue = ThreadQueue()
+        multiplexer.add(5, queue)
+        threading.Thread(target=feed, args=(queue, ['a'], 0.05)).start()
+        self.assertEqual(multiplexer.get(), (5, 'a'))
+        self.assertEqual(multiplexer.get(), (5, 'EOF'))
+        self.assertEqual(len(multiplexer), 1)
+
+    def test_stopped(self):
+        # Inputs of a stopped query are finished, even if their workers never put their EOF.
+        stopped = Event()
+        left, right = ThreadQueue(), Queue()
+        multiplexer = InputMultiplexer(left, right, stopped=stopped)
+        threading.Timer(0.1, stopped.set).start()
+        start = time()
+        results = drain(multiplexer)
+        self.assertEqual(sorted(results), [(0, 'EOF'), (1, 'EOF')])
+        self.assertLess(time() - start, 5)
+
+
+def produce(queue, n):
+    for i in range(n):
+        queue.put({'i': i})
+    queue.put('EOF')
+
+
+class BlockQueueTest(unittest.TestCase):
+
+    def test_blocks_grow(self):
+        queue = ThreadQueue()
+        blocks = BlockQueue(queue, block_size=8, flush_timeout=10)
+        for i in range(40):
+            blocks.put(i)
+        blocks.put('EOF')
+        sizes = []
+        while not queue.empty():
+            sizes.append(len(queue.get()))
+        self.assertEqual(sizes[:4], [1, 2, 4, 8])
+        self.assertEqual(sum(sizes), 41)
+
+    def test_tuples_in_order(self):
+        blocks = BlockQueue(ThreadQueue(), block_size=16)
+        feed(blocks, range(100))
+        results = []
+        t = blocks.get()
+        while t != 'EOF':
+            results.append(t)
+            t = blocks.get()
+        self.assertEqual(results, list(range(100)))
+
+    def test_flush_timeout(self):
+        # A buffered tuple is sent after flush_timeout, even if its block is not full.
+        blocks = BlockQueue(ThreadQueue(), block_size=100, flush_timeout=0.05)
+        blocks.put(1)
+        blocks.put(2)
+        self.assertEqual(blocks.get(True, 5), 1)
+        self.assertEqual(blocks.get(True, 5), 2)
+
+    def test_flush(self):
+        blocks = BlockQueue(ThreadQueue(), block_size=100, flush_timeout=10)
+        blocks.put(1)
+        blocks.put(2)
+        blocks.flush()
+        self.assertEqual([blocks.get(False), blocks.get(False)], [1, 2])
+
+    def test_processes(self):
+        blocks = BlockQueue(Queue(), block_size=50)
+        p = Process(target=produce, args=(blocks, 1000))
+        p.start()
+        results = []
+        multiplexer = InputMultiplexer(blocks)
+        while len(multiplexer) > 0:
+            results.append(multiplexer.get()[1])
+        p.join()
+        self.assertEqual(results, [{'i': i} for i in range(1000)] + ['EOF'])
+
+    def test_pickled_buffers_are_local(self):
+        # Buffers of a producer are not copied to the worker process that gets the queue.
+        blocks = BlockQueue(ThreadQueue(), block_size=100, flush_timeout=10)
+        blocks.put(1)
+        blocks.put(2)
+        state = blocks.__getstate__()
+        self.assertNotIn('buffer', state)
+        copy = BlockQueue.__new__(BlockQueue)
+        copy.__setstate__(state)
+        self.assertEqual(copy.buffer, [])
+        self.assertEqual(copy.limit, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
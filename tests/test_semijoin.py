@@ -0,0 +1,79 @@
+import random
+import threading
+import unittest
+from collections import Counter
+from time import sleep
+
+from awudima.operators.Multiplexer import ThreadQueue
+from awudima.operators.nonblocking.Xgjoin import Xgjoin
+from tests.test_spill import data, feed, join
+
+
+def expected(left, right):
+    results = Counter()
+    for l in left:
+        for r in right:
+            if l['k'] == r['k']:
+                results[(l['k'], l['a'], r['b'])] += 1
+    return results
+
+
+def join_finished_left(operator, left, right):
+    # The left input sends its EOF before the right input sends any tuple.
+    left_queue, right_queue, out = ThreadQueue(), ThreadQueue(), ThreadQueue()
+    feed(left_queue, left)
+
+    def feed_right():
+        sleep(0.1)
+        feed(right_queue, right)
+
+    threading.Thread(target=feed_right).start()
+    operator.execute(left_queue, right_queue, out)
+    results = Counter()
+    t = out.get()
+    while t != 'EOF':
+        results[(t['k'], t['a'], t['b'])] += 1
+        t = out.get()
+    return results
+
+
+class SemiJoinTest(unittest.TestCase):
+
+    def test_reduced_input(self):
+        # Right tuples without matches in the finished left input are dropped, not inserted in the RJTs.
+        left, right, _ = data(300, 200, 21)
+        left = left[:50]
+
+        reduced = Xgjoin({'k'})
+        self.assertEqual(join_finished_left(reduced, left, right), expected(left, right))
+        self.assertGreater(reduced.reducedcount, 0)
+
+        operator = Xgjoin({'k'}, semijoin=False)
+        self.assertEqual(join_finished_left(operator, left, right), expected(left, right))
+        self.assertEqual(operator.reducedcount, 0)
+
+    def test_interleaved_inputs(self):
+        rnd = random.Random(25)
+        for trial in range(10):
+            with self.subTest(trial=trial):
+                left, right, _ = data(rnd.randrange(1, 300), rnd.randrange(1, 60), trial)
+                left = left[:rnd.randrange(1, len(left) + 1)]
+                right = right[:rnd.randrange(1, len(right) + 1)]
+                self.assertEqual(join(Xgjoin({'k'}), left, right), expected(left, right))
+                self.assertEqual(join(Xgjoin({'k'}, semijoin=False), left, right), expected(left, right))
+
+    def test_flushed_tables(self):
+        # Tuples with the join keys of flushed RJTs of the finished input are still inserted and joined later.
+        left, right, results = data(400, 50, 3)
+        for memorySize in [5, 20]:
+            with self.subTest(memorySize=memorySize):
+                operator = Xgjoin({'k'})
+                operator.memorySize = memorySize
+                self.assertEqual(join_finished_left(operator, left, right), results)
+                operator = Xgjoin({'k'})
+                operator.memorySize = memorySize
+                self.assertEqual(join(operator, left, right), results)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+from collections import Counter
+
+from awudima.operators.Multiplexer import ThreadQueue
+from awudima.operators.SpillFile import SpillFile
+from awudima.operators.nonblocking.Xgjoin import Xgjoin
+
+
+class SpillFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_partitions(self):
+        spill = SpillFile('.test', self.tmpdir)
+        spill.append('a', [1, 2])
+        spill.append('b', [{'x': 'y'}])
+        spill.append('a', [3])
+        self.assertEqual(len(spill), 2)
+        self.assertIn('a', spill)
+        self.assertEqual(spill.read('a'), [1, 2, 3])
+        self.assertEqual(list(spill.scan('b')), [{'x': 'y'}])
+        self.assertEqual(spill.read('c'), [])
+        spill.remove('a')
+        self.assertNotIn('a', spill)
+        self.assertEqual(spill.read('b'), [{'x': 'y'}])
+        spill.close()
+        self.assertEqual(len(spill), 0)
+
+    def test_file_is_created_in_its_directory(self):
+        # The file is created on the first append, and it is deleted when it is closed.
+        spill = SpillFile('.test', os.path.join(self.tmpdir, 'missing'))
+        self.assertEqual(len(spill), 0)
+        with self.assertRaises(OSError):
+            spill.append('a', [1])
+        spill = SpillFile('.test', self.tmpdir)
+        spill.append('a', [1])
+        spill.close()
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+
+def data(n, keys, seed):
+    rnd = random.Random(seed)
+    left = [{'k': 'r%d' % rnd.randrange(keys), 'a': 'x' * 50 + str(i)} for i in range(n)]
+    right = [{'k': 'r%d' % rnd.randrange(keys), 'b': 'y' * 50 + str(i)} for i in range(n)]
+    index = {}
+    for r in right:
+        index.setdefault(r['k'], []).append(r)
+    expected = Counter()
+    for l in left:
+        for r in index.get(l['k'], []):
+            expected[(l['k'], l['a'], r['b'])] += 1
+    return left, right, expected
+
+
+def feed(queue, tuples):
+    for t in tuples:
+        queue.put(dict(t))
+    queue.put('EOF')
+
+
+def join(operator, left, right):
+    left_queue, right_queue, out = ThreadQueue(), ThreadQueue(), ThreadQueue()
+    threads = [threading.Thread(target=feed, args=(left_queue, left)),
+               threading.Thread(target=feed, args=(right_queue, right))]
+    [t.start() for t in threads]
+    operator.execute(left_queue, right_queue, out)
+    results = Counter()
+    t = out.get()
+    while t != 'EOF':
+        results[(t['k'], t['a'], t['b'])] += 1
+        t = out.get()
+    return results
+
+
+class XgjoinSpillTest(unittest.TestCase):
+    # Results with the RJTs flushed to secondary memory are the results in main memory.
+
+    def test_in_memory(self):
+        left, right, expected = data(2000, 300, 1)
+        operator = Xgjoin({'k'})
+        self.assertEqual(join(operator, left, right), expected)
+        self.assertEqual(operator.fileDescriptor_left, {})
+
+    def test_spilled(self):
+        left, right, expected = data(2000, 300, 1)
+        operator = Xgjoin({'k'})
+        operator.memorySize = 200
+        self.assertEqual(join(operator, left, right), expected)
+        self.assertGreater(len(operator.fileDescriptor_left) + len(operator.fileDescriptor_right), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
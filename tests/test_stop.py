@@ -0,0 +1,116 @@
+import threading
+import unittest
+from time import sleep
+from unittest import mock
+
+from awudima.mediator.engine import ExecutionContext
+from awudima.mediator.PhysicalPlanOperators import NodeOperator
+from awudima.operators.Multiplexer import ThreadQueue
+from awudima.operators.nonblocking.Xask import Xask
+from awudima.operators.nonblocking.Xlimit import Xlimit
+from awudima.operators.nonblocking.Xproject import Xproject
+from awudima.pysparql import Argument, SPARQLEndpointWrapper
+from awudima.wrappers.triplestore import RDFStore
+from tests.test_engine import Leaf, results
+
+
+def run(operator, tuples, stopped):
+    left, out = ThreadQueue(), ThreadQueue()
+    for t in tuples:
+        left.put(dict(t))
+    left.put('EOF')
+    operator.stopped = stopped
+    operator.execute(left, None, out, ThreadQueue())
+    return results(out)
+
+
+class StopSignalTest(unittest.TestCase):
+
+    tuples = [{'x': str(i)} for i in range(10)]
+
+    def test_limit(self):
+        stopped = threading.Event()
+        self.assertEqual(run(Xlimit(None, 3), self.tuples, stopped), self.tuples[:3])
+        self.assertTrue(stopped.is_set())
+
+    def test_limit_not_reached(self):
+        stopped = threading.Event()
+        self.assertEqual(run(Xlimit(None, 20), self.tuples, stopped), self.tuples)
+        self.assertFalse(stopped.is_set())
+
+    def test_project(self):
+        stopped = threading.Event()
+        self.assertEqual(run(Xproject([Argument('?x', False)], 4), self.tuples, stopped), self.tuples[:4])
+        self.assertTrue(stopped.is_set())
+        stopped = threading.Event()
+        self.assertEqual(run(Xproject([Argument('?x', False)]), self.tuples, stopped), self.tuples)
+        self.assertFalse(stopped.is_set())
+
+    def test_ask(self):
+        stopped = threading.Event()
+        self.assertEqual(run(Xask(None), self.tuples, stopped), [True])
+        self.assertTrue(stopped.is_set())
+        stopped = threading.Event()
+        self.assertEqual(run(Xask(None), [], stopped), [False])
+        self.assertFalse(stopped.is_set())
+
+    def test_plan(self):
+        # The source of a query with LIMIT stops producing tuples once the limit is reached.
+        context = ExecutionContext('threads')
+        stopped = context.stopped
+        produced = []
+
+        class Endless(Leaf):
+            def execute(self, queue):
+                def run():
+                    while not stopped.is_set():
+                        produced.append(1)
+                        queue.put({'x': str(len(produced))})
+                        sleep(0.001)
+                    queue.put('EOF')
+                if self.engine.start(run) is None:
+                    queue.put('EOF')
+
+        node = NodeOperator(Xlimit(None, 5), {'x'}, None, Endless([], {'x'}))
+        node.engine = context
+        out = context.queue()
+        node.execute(out)
+        self.assertEqual(results(out), [{'x': str(i)} for i in range(1, 6)])
+        self.assertTrue(stopped.wait(5))
+        count = len(produced)
+        sleep(0.05)
+        self.assertLessEqual(len(produced), count + 1)
+        context.close()
+
+
+class Datasource(object):
+    name = 'ds'
+    url = 'http://localhost/sparql'
+
+
+class RDFStoreTest(unittest.TestCase):
+
+    def execute(self, stopped, pages):
+        wrapper = RDFStore(Datasource(), None)
+        wrapper.stopped = stopped
+        queries = []
+
+        def contact(query, endpoint):
+            queries.append(query)
+            if len(queries) == 2:
+                stopped.set()
+            return [{'x': str(len(queries))} for i in range(10)], 10
+
+        out = ThreadQueue()
+        with mock.patch.object(SPARQLEndpointWrapper, 'contact_sparql_endpoint', side_effect=contact):
+            wrapper.executeQuery('SELECT * WHERE { ?x ?p ?o }', out, {}, 10, 0, pages * 10)
+        return queries, results(out)
+
+    def test_pages_are_not_fetched_once_stopped(self):
+        queries, tuples = self.execute(threading.Event(), 5)
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(len(tuples), 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
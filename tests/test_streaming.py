@@ -0,0 +1,106 @@
+import json
+import unittest
+from time import sleep
+
+from awudima.mediator.engine import WorkerPool
+from awudima.mediator.executor import AwudimaFQP
+
+
+class Decomposition(object):
+    args = ['?x']
+
+
+def feed(context, q, rows, endless):
+    for r in rows:
+        q.put(r)
+    # an endless query runs until it is stopped (e.g., cancelled)
+    while endless and not context.stopped.is_set():
+        sleep(0.01)
+    q.put('EOF')
+
+
+def resultset(pool, rows, endless=False):
+    context = pool.admit()
+    q = context.queue()
+    context.start(feed, (context, q, rows, endless))
+    return AwudimaFQP.ResultSet('SELECT ?x WHERE { ?x ?p ?o }', q, Decomposition(), None, False, context)
+
+
+class StreamJSONTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = WorkerPool(4, max_workers=2, engine='threads')
+
+    def test_document(self):
+        rows = [{'x': str(i)} for i in range(250)]
+        doc = json.loads(''.join(resultset(self.pool, rows).stream_json(chunk_size=100)))
+        self.assertEqual(doc['head']['vars'], ['x'])
+        self.assertEqual(doc['results']['bindings'], rows)
+        self.assertEqual(self.pool.stats()['free'], 4)
+
+    def test_disconnect_after_head(self):
+        rs = resultset(self.pool, [{'x': '1'}], endless=True)
+        g = rs.stream_json()
+        next(g)
+        self.assertEqual(self.pool.stats()['free'], 2)
+        g.close()
+        self.assertTrue(rs.context.cancelled)
+        self.assertEqual(rs.status, 'Cancelled')
+        self.assertEqual(self.pool.stats(), {'size': 4, 'free': 4, 'running': 0, 'waiting': 0})
+
+    def test_disconnect_after_first_chunk(self):
+        rs = resultset(self.pool, [{'x': str(i)} for i in range(10)], endless=True)
+        g = rs.stream_json(chunk_size=1)
+        next(g)
+        next(g)
+        g.close()
+        self.assertTrue(rs.context.cancelled)
+        self.assertEqual(self.pool.stats()['free'], 4)
+
+
+class StreamWritersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = WorkerPool(4, max_workers=2, engine='threads')
+
+    def test_tsv(self):
+        rows = [{'x': str(i)} for i in range(5)]
+        doc = ''.join(resultset(self.pool, rows).stream_tsv(chunk_size=2))
+        self.assertEqual(len(doc.strip().split('\n')), 6)
+        self.assertEqual(self.pool.stats()['free'], 4)
+
+    def test_csv(self):
+        rows = [{'x': str(i)} for i in range(5)]
+        doc = ''.join(resultset(self.pool, rows).stream_csv(chunk_size=2))
+        self.assertEqual(len(doc.strip().splitlines()), 6)
+        self.assertEqual(self.pool.stats()['free'], 4)
+
+    def test_arrow(self):
+        try:
+            import pyarrow
+        except ImportError:
+            self.skipTest('pyarrow is not installed')
+        rows = [{'x': str(i)} for i in range(5)]
+        doc = b''.join(resultset(self.pool, rows).stream_arrow(chunk_size=2))
+        table = pyarrow.ipc.open_stream(doc).read_all()
+        self.assertEqual(table.num_rows, 5)
+        self.assertEqual(self.pool.stats()['free'], 4)
+
+    def test_disconnect_after_head(self):
+        streams = ['stream_tsv', 'stream_csv']
+        try:
+            import pyarrow
+            streams.append('stream_arrow')
+        except ImportError:
+            pass
+        for stream in streams:
+            rs = resultset(self.pool, [{'x': '1'}], endless=True)
+            g = getattr(rs, stream)()
+            next(g)
+            g.close()
+            self.assertTrue(rs.context.cancelled, stream)
+            self.assertEqual(self.pool.stats()['free'], 4, stream)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import threading
+import unittest
+from collections import Counter
+
+from awudima.mediator.engine import ExecutionContext
+from awudima.mediator.PhysicalPlanOperators import NodeOperator
+from awudima.operators.Multiplexer import ThreadQueue
+from awudima.operators.nonblocking.Xunion import Xunion
+from tests.test_engine import Leaf, results
+
+INPUTS = [({'x'}, [{'x': str(i % 7)} for i in range(20)]),
+          ({'x', 'y'}, [{'x': '1', 'y': '2'}] * 3),
+          ({'y'}, [{'y': '5'}]),
+          ({'x'}, [{'x': '3'}])]
+
+
+def padded(inputs):
+    # Tuples of the union of the inputs, with the variables an input does not bind padded with ''.
+    tuples = Counter()
+    for (vars, rows) in inputs:
+        for row in rows:
+            tuples[(row.get('x', ''), row.get('y', ''))] += 1
+    return tuples
+
+
+def counted(tuples):
+    return Counter((t['x'], t['y']) for t in tuples)
+
+
+class NaryUnionTest(unittest.TestCase):
+
+    def plan(self, context, distinct):
+        # Left-deep tree of unions over the inputs.
+        nodes = [Leaf(rows, vars) for (vars, rows) in INPUTS]
+        plan = nodes[0]
+        for node in nodes[1:]:
+            plan = NodeOperator(Xunion(plan.vars, node.vars, distinct), plan.vars | node.vars, None, plan, node)
+            plan.engine = context
+        return plan
+
+    def run_plan(self, engine, distinct):
+        context = ExecutionContext(engine)
+        try:
+            plan = self.plan(context, distinct)
+            self.assertEqual(len(plan.union_inputs()), len(INPUTS))
+            out = context.queue()
+            plan.execute(out)
+            return results(out)
+        finally:
+            context.close()
+
+    def test_threads(self):
+        self.assertEqual(counted(self.run_plan('threads', False)), padded(INPUTS))
+
+    def test_processes(self):
+        self.assertEqual(counted(self.run_plan('processes', False)), padded(INPUTS))
+
+    def test_distinct(self):
+        tuples = counted(self.run_plan('threads', True))
+        self.assertEqual(tuples, Counter(set(padded(INPUTS))))
+
+    def test_unions_with_other_settings_are_not_merged(self):
+        context = ExecutionContext('threads')
+        nodes = [Leaf(rows, vars) for (vars, rows) in INPUTS[:3]]
+        inner = NodeOperator(Xunion({'x'}, {'x', 'y'}, True), {'x', 'y'}, None, nodes[0], nodes[1])
+        plan = NodeOperator(Xunion({'x', 'y'}, {'y'}, False), {'x', 'y'}, None, inner, nodes[2])
+        self.assertEqual(plan.union_inputs(), [inner, nodes[2]])
+        context.close()
+
+
+class ExecuteInputsTest(unittest.TestCase):
+
+    def test_inputs_are_read_as_they_produce(self):
+        # A slow input does not delay the tuples of the other inputs.
+        slow, fast, out = ThreadQueue(), ThreadQueue(), ThreadQueue()
+        release = threading.Event()
+
+        def produce_slow():
+            release.wait(10)
+            slow.put({'x': 'slow'})
+            slow.put('EOF')
+
+        threading.Thread(target=produce_slow).start()
+        for i in range(3):
+            fast.put({'y': str(i)})
+        fast.put('EOF')
+        operator = Xunion({'x'}, {'y'})
+        thread = threading.Thread(target=operator.executeInputs, args=([slow, fast], [{'x'}, {'y'}], out))
+        thread.start()
+        first = [out.get(True, 10) for i in range(3)]
+        self.assertEqual(first, [{'x': '', 'y': str(i)} for i in range(3)])
+        release.set()
+        self.assertEqual(results(out), [{'x': 'slow', 'y': ''}])
+        thread.join(10)
+        self.assertEqual(operator.count, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
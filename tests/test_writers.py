@@ -0,0 +1,66 @@
+import unittest
+
+from awudima.mediator import writers
+
+ROWS = [{'s': 'http://example.org/a', 'o': 'say "hi"\tthere@en'},
+        {'s': {'type': 'bnode', 'value': 'b0'}, 'o': '5^^<http://www.w3.org/2001/XMLSchema#integer>'},
+        {'s': {'type': 'uri', 'value': 'http://example.org/b'}, 'o': {'type': 'literal', 'value': 'a,b'}},
+        {'s': 'http://example.org/c'}]
+
+
+class TSVTest(unittest.TestCase):
+
+    def test_terms(self):
+        self.assertEqual(writers.tsv_term('http://example.org/a'), '<http://example.org/a>')
+        self.assertEqual(writers.tsv_term('say "hi"\tthere@en'), '"say \\"hi\\"\\tthere"@en')
+        self.assertEqual(writers.tsv_term('5^^<http://www.w3.org/2001/XMLSchema#integer>'),
+                         '"5"^^<http://www.w3.org/2001/XMLSchema#integer>')
+        self.assertEqual(writers.tsv_term({'type': 'bnode', 'value': 'b0'}), '_:b0')
+        self.assertEqual(writers.tsv_term('_:b0'), '_:b0')
+        self.assertEqual(writers.tsv_term(None), '')
+
+    def test_document(self):
+        doc = writers.tsv_header(['s', 'o']) + writers.tsv_rows(['s', 'o'], ROWS)
+        lines = doc.split('\n')
+        self.assertEqual(lines[0], '?s\t?o')
+        self.assertEqual(len(lines), 6)
+        self.assertEqual([len(l.split('\t')) for l in lines[:5]], [2] * 5)
+        self.assertEqual(lines[4], '<http://example.org/c>\t')
+
+
+class CSVTest(unittest.TestCase):
+
+    def test_terms(self):
+        self.assertEqual(writers.csv_term('http://example.org/a'), 'http://example.org/a')
+        self.assertEqual(writers.csv_term({'type': 'literal', 'value': 'a,b'}), '"a,b"')
+        self.assertEqual(writers.csv_term('say "hi"'), '"say ""hi"""')
+        self.assertEqual(writers.csv_term({'type': 'bnode', 'value': 'b0'}), '_:b0')
+        self.assertEqual(writers.csv_term(None), '')
+
+    def test_document(self):
+        import csv
+        doc = writers.csv_header(['s', 'o']) + writers.csv_rows(['s', 'o'], ROWS)
+        rows = list(csv.reader(doc.splitlines()))
+        self.assertEqual(rows[0], ['s', 'o'])
+        self.assertEqual(rows[3], ['http://example.org/b', 'a,b'])
+        self.assertEqual(rows[4], ['http://example.org/c', ''])
+
+
+@unittest.skipUnless(writers.arrow_available(), 'pyarrow is not installed')
+class ArrowTest(unittest.TestCase):
+
+    def test_stream(self):
+        import pyarrow
+        writer = writers.ArrowStreamWriter(['s', 'o'])
+        data = writer.header() + writer.write(ROWS[:2]) + writer.write(ROWS[2:]) + writer.close()
+        reader = pyarrow.ipc.open_stream(data)
+        batches = list(reader)
+        self.assertEqual([b.num_rows for b in batches], [2, 2])
+        table = pyarrow.Table.from_batches(batches)
+        self.assertEqual(table.column('s').to_pylist(),
+                         ['http://example.org/a', '_:b0', 'http://example.org/b', 'http://example.org/c'])
+        self.assertIsNone(table.column('o').to_pylist()[3])
+
+
+if __name__ == '__main__':
+    unittest.main()